@@ -1,10 +1,45 @@
+import time
+_script_start = time.perf_counter()
+
 import streamlit as st
-from controller.chat_controller import run_chat_controller
-import pandas as pd
+from controller.chat_controller import finish_streamed_reply, run_chat_controller
+from core.gpt_handler import response_cache_stats
+from core.llm_dispatch import dispatch_report
+from core.model_router import routing_report
+from core.prompt_builder import prompt_report
+from core.metrics import stage_summary
+from core.rule_parser import fast_path_report
+from core.scoring import LOAD_TIMINGS, preload_index
+from core.utils import log_turn
+from core.session_store import SessionState, get_session_store, new_session_id
 
 # ----------------------------
 # Session State Initialization
 # ----------------------------
+# The conversation lives in the session store (SESSION_STORE), keyed by ?sid=,
+# so a reload, a restart or another replica picks it up where it left off.
+if "session" not in st.session_state:
+    sid = st.query_params.get("sid") or new_session_id()
+    st.query_params["sid"] = sid
+    session = get_session_store().load(sid) or SessionState(sid)
+    st.session_state.session = session
+    st.session_state.chat_history = session.history
+    for name in ("user_profile", "last_bot_action", "total_tokens", "total_cost_inr"):
+        if name in session.fields:
+            st.session_state[name] = session.fields[name]
+
+
+def save_session():
+    """Write this turn's changes (fields and new chat messages) to the session store."""
+    st.session_state.session.update(
+        user_profile=st.session_state.user_profile,
+        last_bot_action=st.session_state.last_bot_action,
+        total_tokens=st.session_state.total_tokens,
+        total_cost_inr=st.session_state.total_cost_inr,
+    )
+    get_session_store().save(st.session_state.session)
+
+
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
@@ -56,6 +91,35 @@ with st.sidebar:
     st.write(f"Total tokens: {st.session_state.total_tokens}")
     st.write(f"Estimated cost: ₹{st.session_state.total_cost_inr:.4f}")
 
+    st.subheader("Startup")
+    st.write(f"First render: {st.session_state.get('startup_ms', 0):.0f} ms")
+    st.write(f"Scoring index (ms): {LOAD_TIMINGS or 'not loaded yet'}")
+
+    if st.session_state.get("last_timings"):
+        st.subheader("Last turn (ms)")
+        st.json(st.session_state.last_timings, expanded=False)
+
+    if stage_summary():
+        st.subheader("Stages (avg ms)")
+        st.json(stage_summary(), expanded=False)
+
+    st.subheader("Fast path")
+    st.json(fast_path_report(), expanded=False)
+
+    if prompt_report():
+        st.subheader("Prompt size (est. tokens)")
+        st.json(prompt_report(), expanded=False)
+
+    if response_cache_stats() is not None:
+        st.subheader("LLM cache")
+        st.json(response_cache_stats(), expanded=False)
+
+    st.subheader("LLM dispatcher")
+    st.json(dispatch_report(), expanded=False)
+
+    st.subheader("Model routing")
+    st.json(routing_report(), expanded=False)
+
     st.subheader("User profile")
     st.json(st.session_state.user_profile)
 
@@ -68,9 +132,12 @@ with st.sidebar:
         st.session_state.last_bot_action = "reset_profile"
         st.session_state.show_profile_form = False
         st.session_state.chat_history.append(("assistant", "✅ Profile has been reset. Let's start fresh! What do you want to know about Health Insurance"))
+        save_session()
 
     # End Session button
     if st.button("⏹ End Session"):
+        get_session_store().delete(st.session_state.session.session_id)
+        st.query_params.clear()
         st.session_state.clear()
         st.rerun()
 
@@ -86,6 +153,11 @@ for role, message in st.session_state.chat_history:
     with st.chat_message(role):
         st.markdown(message)
 
+# Greeting is on screen; load scoring data in the background for recommend/compare
+if "startup_ms" not in st.session_state:
+    st.session_state.startup_ms = (time.perf_counter() - _script_start) * 1000
+    preload_index()
+
 # ----------------------------
 # Chat Input
 # ----------------------------
@@ -105,22 +177,30 @@ if user_input:
         user_profile=st.session_state.user_profile,
         last_bot_action=st.session_state.last_bot_action,
         total_tokens=st.session_state.total_tokens,
-        total_cost_inr=st.session_state.total_cost_inr
+        total_cost_inr=st.session_state.total_cost_inr,
+        stream=True
     )
 
-    # if bot asks for info, flip the flag
+    # if bot asks for info, flip the flag (the form replaces the reply, so its stream is never sent)
     if response.get("updated_last_action") == "ask_info":
         st.session_state.show_profile_form = True
+        log_turn(response["turn_record"])
     else:
         with st.chat_message("assistant"):
-            st.markdown(response.get("reply", ""))
+            if response.get("reply_stream") is not None:
+                st.write_stream(response["reply_stream"])
+                response = finish_streamed_reply(response)
+            else:
+                st.markdown(response.get("reply", ""))
         st.session_state.chat_history.append(("assistant", response.get("reply", "")))
+    st.session_state.last_timings = response.get("timings", {})
 
     # update state from controller
     st.session_state.user_profile = response.get("updated_profile", st.session_state.user_profile)
     st.session_state.last_bot_action = response.get("updated_last_action", st.session_state.last_bot_action)
     st.session_state.total_tokens = response.get("total_tokens", st.session_state.total_tokens)
     st.session_state.total_cost_inr = response.get("total_cost_inr", st.session_state.total_cost_inr)
+    save_session()
 
 # ----------------------------
 # Always render profile form if flag is set
@@ -288,6 +368,7 @@ def render_profile_form():
 
             st.session_state.chat_history.append(("assistant", summary_text))
             st.session_state.chat_history.append(("assistant", reply))
+            save_session()
 
 
 # render profile form if flag is set
@@ -1,44 +1,260 @@
 from core.dialogue_manager import handle_dialogue
-from core.intent_handler import classify_intent
-from core.gpt_handler import call_gpt
+from core.intent_handler import classify_intent, understand_message
+from core.profile_extractor import extraction_fields, gpt_profile_extractor
+from core.rule_parser import parse_message, record_turn
+from core.retrieval import get_engine
+from core.semantic_cache import OpenAIEmbedder, SemanticCache
+from core.model_router import BudgetExceeded, begin_turn, routed_call, routed_stream
 from core.scoring import score_plans_and_recommend
-import textwrap
+from core.prompt_builder import build_plan_prompt
+from core.premium import premium_facts
+from core.profile import Profile
+from core.metrics import record, span, start_turn
+from core.utils import log_turn, profile_hash
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+NO_MATCH_REPLY = (
+    "I couldn't find a plan that matches your profile yet. "
+    "Would you like me to connect you with an expert advisor?"
+)
+
+BUDGET_REPLY = (
+    "I've reached the usage limit for this conversation. "
+    "Please continue with one of our advisors, who can take it from here."
+)
+
+# "parallel" (two concurrent LLM calls) or "combined" (one structured-output call)
+UNDERSTAND_MODE = os.environ.get("UNDERSTAND_MODE", "parallel")
+
+# Rule-parser confidence needed to skip the LLM; above 1.0 disables the fast path
+FAST_PATH_THRESHOLD = float(os.environ.get("FAST_PATH_THRESHOLD", "1.0"))
+
+# Educational answers depend only on the question, so similar questions can share one.
+# Off unless SEMANTIC_CACHE=1; questions are then compared with SEMANTIC_CACHE_MODEL embeddings.
+SEMANTIC_CACHE_INTENTS = {"concept_query", "general_info"}
+ANSWER_CACHE = (
+    SemanticCache(OpenAIEmbedder(os.environ.get("SEMANTIC_CACHE_MODEL", "text-embedding-3-small")))
+    if os.environ.get("SEMANTIC_CACHE") == "1" else None
+)
+
+# Plan questions are answered from KB chunks; limitation questions only look at these sections
+KB_INTENTS = {"policy_query", "limitation_query"}
+LIMITATION_SECTIONS = ["exclusions", "waiting_periods", "co_pay_rules", "special_conditions"]
+KB_TOP_K = 6
+
+# Shared by all sessions; bounds concurrent understanding calls per process
+_understand_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="understand")
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _add_usage(usage, gpt_response):
+    usage["tokens_used"] += gpt_response["tokens_used"]
+    usage["cost_inr"] += gpt_response["cost_inr"]
+
+
+def understand(user_input, mode=None, profile=None):
+    """
+    Work out the intent and any profile info in the message.
+
+    Short turns the rule parser understands with confidence of at least
+    FAST_PATH_THRESHOLD skip the LLM. Otherwise "parallel" runs intent
+    classification and profile extraction concurrently; "combined" makes one
+    structured-output call and falls back to "parallel" when its reply fails
+    validation.
+    In "parallel", extraction only runs when the message has a profile cue
+    (or turns out to be profile_info), and only for the fields it hints at or
+    profile still lacks.
+    Returns (intent, new_info, usage, timings_ms).
+    """
+    mode = mode or UNDERSTAND_MODE
+    usage = {"tokens_used": 0, "cost_inr": 0.0}
+    timings = {}
+    start = time.perf_counter()
+
+    parsed = parse_message(user_input)
+    if parsed is not None and parsed["confidence"] >= FAST_PATH_THRESHOLD:
+        fast_ms = (time.perf_counter() - start) * 1000
+        timings["fast_path_ms"] = timings["understand_ms"] = round(fast_ms, 3)
+        record_turn(True, fast_ms)
+        record("fast_path", fast_ms)
+        intent = parsed.pop("intent")
+        parsed.pop("confidence")
+        return intent, parsed, usage, timings
+
+    if mode == "combined":
+        (understanding, gpt_response), combined_ms = _timed(understand_message, user_input)
+        _add_usage(usage, gpt_response)
+        timings["combined_ms"] = round(combined_ms, 1)
+        record("understand_combined", combined_ms, tokens=gpt_response["tokens_used"],
+               cost_inr=gpt_response["cost_inr"], valid=understanding is not None)
+        if understanding is not None:
+            timings["understand_ms"] = timings["combined_ms"]
+            record_turn(False, combined_ms, usage["tokens_used"])
+            intent = understanding.pop("intent")
+            return intent, understanding, usage, timings
+
+    parallel_start = time.perf_counter()
+    fields = extraction_fields(user_input, profile)
+    # copy the context so LLM spans recorded in the pool keep this turn's id
+    intent_future = _understand_pool.submit(contextvars.copy_context().run, _timed, classify_intent, user_input)
+    profile_future = None
+    if fields:
+        profile_future = _understand_pool.submit(
+            contextvars.copy_context().run, _timed, gpt_profile_extractor, user_input, with_usage=True, fields=fields
+        )
+    intent_obj, intent_ms = intent_future.result()
+    new_info, profile_response, profile_ms = {}, None, 0.0
+    if profile_future is not None:
+        (new_info, profile_response), profile_ms = profile_future.result()
+    else:
+        # no cue in the message; only a profile_info reply still needs the extractor
+        fields = extraction_fields(user_input, profile, intent=intent_obj["output"])
+        if fields:
+            (new_info, profile_response), profile_ms = _timed(
+                gpt_profile_extractor, user_input, with_usage=True, fields=fields
+            )
+    parallel_ms = (time.perf_counter() - parallel_start) * 1000
+    _add_usage(usage, intent_obj)
+    record("classify_intent", intent_ms, tokens=intent_obj["tokens_used"], cost_inr=intent_obj["cost_inr"])
+    if profile_response is not None:
+        _add_usage(usage, profile_response)
+        record("extract_profile", profile_ms, tokens=profile_response["tokens_used"],
+               cost_inr=profile_response["cost_inr"], fields=fields, cache_hit=profile_response["cache_hit"])
+    else:
+        timings["extraction_skipped"] = True
+
+    understand_ms = (time.perf_counter() - start) * 1000
+    record_turn(False, understand_ms, usage["tokens_used"])
+    timings.update({
+        "intent_ms": round(intent_ms, 1),
+        "profile_ms": round(profile_ms, 1),
+        "understand_ms": round(understand_ms, 1),
+        # what running the two calls back to back would have cost on top
+        "saved_ms": round(max(intent_ms + profile_ms - parallel_ms, 0.0), 1),
+    })
+    return intent_obj["output"], new_info, usage, timings
+
+
+def retrieve_facts(question, intent, k=KB_TOP_K):
+    """KB chunks relevant to the question, narrowed to any plans it names."""
+    with span("retrieve") as s:
+        try:
+            engine = get_engine()
+            hits = engine.hybrid_search(
+                question,
+                k=k,
+                policy=engine.mentioned("policy", question) or None,
+                section=LIMITATION_SECTIONS if intent == "limitation_query" else None,
+            )
+        except Exception as e:
+            # the span carries the failure (and counts it in chat_stage_errors_total)
+            s.set(error=type(e).__name__, message=str(e)[:200])
+            return []
+        s.set(hits=len(hits))
+    return [
+        f"{h['chunk']['policy']} ({h['chunk']['variant']}) – {h['chunk']['section']}: {h['chunk']['content']}"
+        for h in hits
+    ]
+
+
+def _lookup_answer(intent, question, reply_attrs):
+    """
+    (question vector, cached (answer, similarity) or None); the embedding's cost
+    goes into reply_attrs. A failing cache is skipped, so the LLM answers.
+    """
+    try:
+        vector, usage = ANSWER_CACHE.embed(question)
+        reply_attrs.update(embed_tokens=usage["tokens_used"], embed_cost_inr=usage["cost_inr"])
+        return vector, ANSWER_CACHE.lookup(intent, question, vector)
+    except Exception:
+        log.warning("Answer cache lookup failed; answering without it", exc_info=True)
+        reply_attrs["semantic_cache_error"] = True
+        return None, None
+
 
 def missing_fields(profile):
-    missing = []
-    if not any(m.get("relation") == "self" and isinstance(m.get("age"), int) for m in profile.get("members", [])):
-        missing.append("age")
-    if not profile.get("gender"):
-        missing.append("gender")
-    if not profile.get("location"):
-        missing.append("location")
-    return missing
-
-def run_chat_controller(user_input, user_profile, last_bot_action, total_tokens, total_cost_inr):
-    # Step 1: Use existing user_profile (no GPT extraction now)
+    return Profile.from_dict(profile).missing_fields()
+
+def run_chat_controller(user_input, user_profile, last_bot_action, total_tokens, total_cost_inr, stream=False):
+    """
+    One chat turn. With stream=True, LLM replies come back as "reply_stream"
+    (an iterable of text deltas) with reply=None; pass the response to
+    finish_streamed_reply() once the stream is consumed.
+    """
+    # Step 1: Start from the session's profile; understand() only extracts what this message adds
     updated_profile = dict(user_profile)
 
-    # Step 2: Classify intent
-    intent_obj = classify_intent(user_input)
-    intent = intent_obj["output"]
+    turn_start = time.perf_counter()
+    turn_id = start_turn()
+    begin_turn(total_cost_inr)
+    turn_tokens, turn_cost = total_tokens, total_cost_inr
+
+    # Step 2: Classify intent + extract profile (concurrently)
+    try:
+        with span("understand") as stage:
+            intent, new_info, usage, timings = understand(user_input, profile=updated_profile)
+            stage.set(intent=intent, tokens=usage["tokens_used"], cost_inr=usage["cost_inr"],
+                      fast_path="fast_path_ms" in timings)
+    except BudgetExceeded as e:
+        # the router refused the calls; answer without the LLM and leave the session as it was
+        timings = {"budget_refused": e.reason, "total_ms": round((time.perf_counter() - turn_start) * 1000, 1)}
+        record("turn", timings["total_ms"], intent=None, action="static", budget_refused=e.reason)
+        turn_record = {"turn_id": turn_id, "intent": None, "action": "static", "profile_hash": profile_hash(user_profile),
+                       "tokens": 0, "cost_inr": 0.0, "latency_ms": timings["total_ms"], "budget_refused": e.reason}
+        log_turn(turn_record)
+        return {
+            "reply": BUDGET_REPLY,
+            "action": "static",
+            "updated_profile": updated_profile,
+            "updated_last_action": last_bot_action,
+            "total_tokens": total_tokens,
+            "total_cost_inr": total_cost_inr,
+            "timings": timings,
+            "reply_stream": None,
+            "turn_record": turn_record,
+        }
+    total_tokens += usage["tokens_used"]
+    total_cost_inr += usage["cost_inr"]
 
     # Step 3: Dialogue manager
-    result = handle_dialogue(
-        user_input=user_input,
-        user_profile=updated_profile,
-        intent=intent,
-        last_bot_action=last_bot_action
-    )
+    with span("dialogue") as stage:
+        result = handle_dialogue(
+            user_input=user_input,
+            user_profile=updated_profile,
+            intent=intent,
+            last_bot_action=last_bot_action,
+            new_info=new_info
+        )
+        stage.set(action=result["action"], profile_changes=sorted(result.get("profile_changes") or ()))
+    timings["dialogue_ms"] = round(stage.ms, 3)
 
-    print('----------------------')
-    print(user_input)
-    print(intent)
-    print(result)
-    print('----------------------')
+    # Step 4: Score plans; fall back to a static reply when no profile row matches
+    if result["action"] in ["recommend", "compare"]:
+        with span("score") as stage:
+            recom_resp = score_plans_and_recommend(user_profile=result["profile"])
+            stage.set(matched=recom_resp["matched"])
+        timings["score_ms"] = round(stage.ms, 3)
+        if not recom_resp["matched"]:
+            result = dict(result, action="static", response=NO_MATCH_REPLY)
 
-    # Step 4: Generate reply
+    # Step 5: Generate reply (LLM actions only build the prompt here)
+    reply_start = time.perf_counter()
+    reply_attrs = {"action": result["action"]}
+    messages = None
+    on_reply = None
     if result["action"] == "ask_info":
-        miss = missing_fields(result["updated_profile"])
+        miss = result["profile"].missing_fields()
         system_prompt = """
         You are a smart and friendly health insurance advisor chatbot.
         Based on the user’s current profile and the missing fields list,
@@ -49,150 +265,48 @@ def run_chat_controller(user_input, user_profile, last_bot_action, total_tokens,
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"Profile so far: {result['updated_profile']}\nMissing fields: {miss}"}
         ]
-        gpt_response = call_gpt(messages)
-        reply = gpt_response["output"]
-        total_tokens += gpt_response["tokens_used"]
-        total_cost_inr += gpt_response["cost_inr"]
-
-    elif result["action"] == "recommend":
-        recom_resp = score_plans_and_recommend(user_profile=updated_profile)
-
-        # --- prepare score data ---
-        score_fit = recom_resp.get("score_fit", {})
-        score_fit_sorted = sorted(score_fit.items(), key=lambda x: x[1], reverse=True)
-
-        # top 3 distinct plans
-        seen = set()
-        top3 = []
-        for plan, score in score_fit_sorted:
-            if plan not in seen:
-                top3.append((plan, score))
-                seen.add(plan)
-            if len(top3) == 3:
-                break
-
-        # --- collect relevant needs from those top plans ---
-        user_needs = []
-        for plan, _ in top3:
-            user_needs.extend(recom_resp.get("needs", {}).get(plan, []))
-        user_needs = list(set(user_needs))
-
-        # --- build system prompt ---
-        system_prompt = textwrap.dedent(f"""
-            You are an insurance advisor. Based on the data below, generate:
-            1. A clear recommendation message (~150 words) highlighting the **single best plan**.
-            - Show why this plan fits the user’s profile (refer to these needs: {user_needs}).
-            - Mention Sum Insured and suggested term.
-            2. Mention the **next 2 best alternatives** briefly.
-            3. A comparison table (Markdown format) for the top 3 plans, with columns:
-            - Plan Name
-            - Score
-            - Key Benefits (only the needs relevant to user profile: {user_needs})
-            4. End with a short, friendly follow-up question that nudges the user towards action,
-            such as:
-            - connecting with an expert,
-            - requesting a callback,
-            - or exploring premium details.
-
-            Recommendation data:
-            Top 3 ranked plans: {top3}
-            All scores: {score_fit}
-            User attributes: {recom_resp.get('user_attributes')}
-            Relevant needs: {user_needs}
-            Suggested term: Suggest best term 1/2/ 3 years for this Profile
-            Sum Insured: Infer best SI for this profile in Lakh
-        """)
-
-        # --- GPT call ---
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"User intent: recommend. Question: {user_input}"}
-        ]
-        gpt_response = call_gpt(messages)
-
-        reply = gpt_response["output"]
-        total_tokens += gpt_response["tokens_used"]
-        total_cost_inr += gpt_response["cost_inr"]
-
-    elif result["action"] == "compare":
-        recom_resp = score_plans_and_recommend(user_profile=updated_profile)
-
-        # --- prepare score data ---
-        score_fit = recom_resp.get("score_fit", {})
-        score_fit_sorted = sorted(score_fit.items(), key=lambda x: x[1], reverse=True)
-
-        # top 3 distinct plans
-        seen = set()
-        top3 = []
-        for plan, score in score_fit_sorted:
-            if plan not in seen:
-                top3.append((plan, score))
-                seen.add(plan)
-            if len(top3) == 3:
-                break
-
-        # --- collect relevant needs from those top plans ---
-        user_needs = []
-        for plan, _ in top3:
-            user_needs.extend(recom_resp.get("needs", {}).get(plan, []))
-        user_needs = list(set(user_needs))
-
-        # --- build system prompt for comparison ---
-        system_prompt = textwrap.dedent(f"""
-            You are an insurance advisor. Based on the user profile and the retrieved data,
-            generate a **comparison** across the top 3 plans.
-
-            1. Create a clean Markdown table with columns:
-            - Plan Name
-            - Score
-            - Key Benefits (only the ones relevant to user profile: {user_needs})
-            - Riders (if applicable)
-            - Waiting Periods / Limitations (if available from KB)
-
-            2. After the table, write 3–4 bullet points highlighting the **main differences**
-            between these plans (coverage, riders, exclusions, limits).
-
-            3. End with a short, conversational follow-up question nudging the user to explore
-            premiums, request a callback, or connect with an expert.
-
-            Data for reference:
-            Top 3 ranked plans: {top3}
-            All scores: {score_fit}
-            User attributes: {recom_resp.get('user_attributes')}
-            Relevant needs: {user_needs}
-        """)
-
-        # --- GPT call ---
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"User intent: compare. Question: {user_input}"}
-        ]
-        gpt_response = call_gpt(messages)
 
-        reply = gpt_response["output"]
-        total_tokens += gpt_response["tokens_used"]
-        total_cost_inr += gpt_response["cost_inr"]
+    elif result["action"] in ("recommend", "compare"):
+        # top plans and their needs as a compact table, trimmed to the action's token budget
+        facts = premium_facts(result["updated_profile"]) if result["action"] == "recommend" else None
+        messages, prompt_info = build_plan_prompt(result["action"], recom_resp, user_input, facts=facts)
+        timings["prompt_tokens_est"] = prompt_info["prompt_tokens_est"]
+        reply_attrs["prompt_tokens_est"] = prompt_info["prompt_tokens_est"]
 
     elif result["action"] == "static":
         reply = result["response"]
 
     elif result["action"] == "call_gpt":
-        system_prompt = """
-        You are a helpful health insurance advisor. 
-        - ONLY talk about Health Insurance (ignore other types like auto, life etc.).
-        - Be clear, friendly, and factual.
-        - Return answers ONLY as neat bullet points and concise.
-        - Limit to max 5 points.
-        - Always give the follow-up question or next step to be truly conversational.
-        """
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"User intent: {intent}. Question: {user_input}"}
-        ]
-        gpt_response = call_gpt(messages)
-        reply = gpt_response["output"]
-        total_tokens += gpt_response["tokens_used"]
-        total_cost_inr += gpt_response["cost_inr"]
+        cached = question_vector = None
+        if ANSWER_CACHE is not None and intent in SEMANTIC_CACHE_INTENTS:
+            question_vector, cached = _lookup_answer(intent, user_input, reply_attrs)
+            total_tokens += reply_attrs.get("embed_tokens", 0)
+            total_cost_inr += reply_attrs.get("embed_cost_inr", 0.0)
+        if cached is not None:
+            reply, _similarity = cached
+            reply_attrs["semantic_cache_hit"] = True
+        else:
+            system_prompt = """
+            You are a helpful health insurance advisor. 
+            - ONLY talk about Health Insurance (ignore other types like auto, life etc.).
+            - Be clear, friendly, and factual.
+            - Return answers ONLY as neat bullet points and concise.
+            - Limit to max 5 points.
+            - Always give the follow-up question or next step to be truly conversational.
+            """
+            if intent in KB_INTENTS:
+                facts = retrieve_facts(user_input, intent)
+                if facts:
+                    system_prompt += "\nAnswer from these policy facts; say so if they don't cover the question:\n"
+                    system_prompt += "\n".join(f"- {fact}" for fact in facts)
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"User intent: {intent}. Question: {user_input}"}
+            ]
+            if question_vector is not None:
+                on_reply = lambda gpt_response: ANSWER_CACHE.store(
+                    intent, user_input, gpt_response["output"], question_vector
+                )
 
     elif result["action"] == "fallback":
         reply = result["response"]
@@ -200,11 +314,90 @@ def run_chat_controller(user_input, user_profile, last_bot_action, total_tokens,
     else:
         reply = "Let me connect you to a human advisor."
 
+    # Step 6: Call the LLM, or hand back a stream the caller renders as it arrives
+    reply_stream = None
+    if messages is not None:
+        # the router picks the model from the action and what the session has spent
+        route = "answer" if result["action"] == "call_gpt" else result["action"]
+        try:
+            if stream:
+                reply_stream = routed_stream(route, messages, on_complete=on_reply)
+                gpt_response = None
+            else:
+                gpt_response = routed_call(route, messages)
+        except BudgetExceeded as e:
+            reply, gpt_response = BUDGET_REPLY, None
+            reply_attrs["budget_refused"] = timings["budget_refused"] = e.reason
+        if reply_stream is not None:
+            reply = None
+            reply_attrs.update(streamed=True, model=reply_stream.model)
+        elif gpt_response is not None:
+            reply = gpt_response["output"]
+            total_tokens += gpt_response["tokens_used"]
+            total_cost_inr += gpt_response["cost_inr"]
+            reply_attrs.update(tokens=gpt_response["tokens_used"], cost_inr=gpt_response["cost_inr"],
+                               cache_hit=gpt_response["cache_hit"], model=gpt_response["model"])
+            if on_reply is not None:
+                on_reply(gpt_response)
+    timings["reply_ms"] = round((time.perf_counter() - reply_start) * 1000, 1)
+    record("reply", timings["reply_ms"], **reply_attrs)
+    timings["total_ms"] = round((time.perf_counter() - turn_start) * 1000, 1)
+    record("turn", timings["total_ms"], intent=intent, action=result.get("action", "static"),
+           tokens=total_tokens - turn_tokens, cost_inr=round(total_cost_inr - turn_cost, 6))
+
+    # Anonymized transcript record; a streamed reply is logged once finish_streamed_reply has its usage
+    turn_record = {
+        "turn_id": turn_id,
+        "intent": intent,
+        "action": result.get("action", "static"),
+        "profile_hash": profile_hash(result["updated_profile"]),
+        "tokens": total_tokens - turn_tokens,
+        "cost_inr": round(total_cost_inr - turn_cost, 6),
+        "latency_ms": timings["total_ms"],
+    }
+    if reply_stream is None:
+        log_turn(turn_record)
+
     return {
         "reply": reply,
         "action": result.get("action", "static"),
         "updated_profile": result["updated_profile"],
         "updated_last_action": result["updated_last_action"],
         "total_tokens": total_tokens,
-        "total_cost_inr": total_cost_inr
+        "total_cost_inr": total_cost_inr,
+        "timings": timings,
+        "reply_stream": reply_stream,
+        "turn_record": turn_record,
     }
+
+
+def finish_streamed_reply(response):
+    """
+    Fold a consumed reply_stream back into the response: final reply text,
+    token/cost totals and time-to-first-token.
+    """
+    stream = response.get("reply_stream")
+    if stream is None:
+        return response
+    if stream.result is None:
+        raise RuntimeError("reply_stream must be fully consumed before finishing the reply")
+    gpt_response = stream.result
+    timings = dict(response["timings"])
+    timings["ttft_ms"] = gpt_response["ttft_ms"]
+    timings["stream_ms"] = gpt_response["stream_ms"]
+    turn_record = response["turn_record"]
+    log_turn(dict(
+        turn_record,
+        tokens=turn_record["tokens"] + gpt_response["tokens_used"],
+        cost_inr=round(turn_record["cost_inr"] + gpt_response["cost_inr"], 6),
+        latency_ms=round(turn_record["latency_ms"] + gpt_response["stream_ms"], 1),
+        streamed=True,
+    ))
+    return dict(
+        response,
+        reply=gpt_response["output"],
+        total_tokens=response["total_tokens"] + gpt_response["tokens_used"],
+        total_cost_inr=response["total_cost_inr"] + gpt_response["cost_inr"],
+        timings=timings,
+        reply_stream=None,
+    )
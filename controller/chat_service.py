@@ -0,0 +1,369 @@
+"""
+Headless HTTP JSON service around run_chat_controller (no Streamlit).
+
+    python -m controller.chat_service --config service.json --port 8080 --workers 4
+
+    POST /v1/chat   {"message": "...", "session_id": "optional"}
+    GET  /healthz   200 while serving, 503 while draining
+    GET  /v1/stats  request counters
+    GET  /metrics   per-stage latency histograms and token/cost counters (Prometheus text)
+
+Configuration is DEFAULT_CONFIG, overlaid by a JSON file (--config or
+CHAT_SERVICE_CONFIG), then by CHAT_SERVICE_<KEY> environment variables, then by
+command-line flags. With --workers N, N processes share the port (SO_REUSEPORT),
+so a load balancer or the kernel spreads connections over them. Sessions live in
+session_store (see core.session_store); use sqlite:// or redis:// so every
+worker, and a restarted one, sees the same conversations. Turns of one session
+run one at a time within a process. If two workers run turns of the same
+session at once, the store keeps the first save and the other turn gets a 409.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from controller.chat_controller import run_chat_controller
+from core import gpt_handler
+from core.llm_dispatch import dispatch_report
+from core.metrics import prometheus_text, record
+from core.model_router import routing_report
+from core.session_store import SessionConflict, SessionState, new_session_id, open_session_store
+from core.utils import get_conversation_logger
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8080,
+    "workers": 1,
+    "max_concurrency": 32,  # controller calls running at once, per process
+    "max_pending": 256,  # requests allowed to wait for a slot before we answer 503
+    "request_timeout": 60.0,  # seconds per chat turn
+    "shutdown_grace": 30.0,  # seconds to let in-flight turns finish on SIGTERM
+    "max_body_bytes": 64 * 1024,
+    "session_store": "memory",  # memory | sqlite:///path | redis://host:port/db
+    "max_sessions": 10000,  # memory store size
+    "session_ttl": 3600.0,
+    "openai_api_key": None,  # None → OPENAI_API_KEY
+    "openai_base_url": None,
+}
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+def load_config(path=None, environ=None, **overrides):
+    """DEFAULT_CONFIG < JSON file < CHAT_SERVICE_* env vars < overrides (None values are ignored)."""
+    environ = os.environ if environ is None else environ
+    config = dict(DEFAULT_CONFIG)
+    path = path or environ.get("CHAT_SERVICE_CONFIG")
+    if path:
+        with open(path) as f:
+            from_file = json.load(f)
+        unknown = set(from_file) - set(config)
+        if unknown:
+            raise ValueError(f"{path}: unknown settings {sorted(unknown)}")
+        config.update(from_file)
+    for key, default in DEFAULT_CONFIG.items():
+        raw = environ.get(f"CHAT_SERVICE_{key.upper()}")
+        if raw is not None:
+            config[key] = type(default)(raw) if default is not None else raw
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    return config
+
+
+class _Text(str):
+    """A route result sent as text/plain instead of JSON."""
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ChatService:
+    """
+    Runs chat turns on a thread pool behind a concurrency limit, keeps session
+    state in a session store and serves it over a small HTTP/1.1 JSON server.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or load_config()
+        if self.config["openai_api_key"] or self.config["openai_base_url"]:
+            gpt_handler.configure_client(
+                api_key=self.config["openai_api_key"], base_url=self.config["openai_base_url"]
+            )
+        self.store = open_session_store(
+            self.config["session_store"], self.config["session_ttl"], self.config["max_sessions"]
+        )
+        # orders the turns of a session within this process: session_id → [lock, requests using it],
+        # dropped when the last request holding or waiting for the lock is done
+        self._session_locks = {}
+        self.stats = {"requests": 0, "turns": 0, "rejected": 0, "timeouts": 0, "conflicts": 0, "errors": 0,
+                      "in_flight": 0}
+        self.port = None
+        self.started = threading.Event()
+        self._executor = ThreadPoolExecutor(self.config["max_concurrency"], thread_name_prefix="chat")
+        self._slots = None
+        self._loop = None
+        self._stopping = None
+        self._draining = False
+        self._connections = set()
+
+    async def chat(self, message, session_id=None):
+        """One turn for a session (a new one when session_id is None or unknown)."""
+        if self.stats["in_flight"] >= self.config["max_concurrency"] + self.config["max_pending"]:
+            self.stats["rejected"] += 1
+            raise ServiceError(503, "server busy, retry shortly", {"Retry-After": "1"})
+
+        session_id = session_id or new_session_id()
+        entry = self._session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.stats["in_flight"] += 1
+        held, worker = [], None
+        try:
+            # turns of one session run in order; other sessions proceed in parallel
+            await entry[0].acquire()
+            held.append(entry[0])
+            await self._slots.acquire()
+            held.append(self._slots)
+            worker = self._loop.run_in_executor(self._executor, partial(self._turn, session_id, message))
+            try:
+                response = await asyncio.wait_for(asyncio.shield(worker), self.config["request_timeout"])
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise ServiceError(504, "the assistant took too long to answer")
+            except SessionConflict:
+                self.stats["conflicts"] += 1
+                raise ServiceError(409, "this session was updated by another request, retry with its latest state")
+            self.stats["turns"] += 1
+        finally:
+            if worker is not None and not worker.done():
+                # the thread can't be stopped: keep the session and the slot until it has saved,
+                # so the next turn of this session starts from what it wrote
+                worker.add_done_callback(partial(self._finish_late_turn, session_id, entry, held))
+            else:
+                self._release_turn(session_id, entry, held)
+
+        return {
+            "session_id": session_id,
+            "reply": response["reply"],
+            "action": response["action"],
+            "profile": response["updated_profile"],
+            "total_tokens": response["total_tokens"],
+            "total_cost_inr": round(response["total_cost_inr"], 4),
+            "timings": response.get("timings", {}),
+        }
+
+    def _release_turn(self, session_id, entry, held):
+        for primitive in reversed(held):
+            primitive.release()
+        self.stats["in_flight"] -= 1
+        entry[1] -= 1
+        if not entry[1]:
+            del self._session_locks[session_id]
+
+    def _finish_late_turn(self, session_id, entry, held, worker):
+        if not worker.cancelled() and worker.exception() is not None:
+            self.stats["errors"] += 1
+            log.error("Chat turn failed after its request timed out", exc_info=worker.exception())
+        self._release_turn(session_id, entry, held)
+
+    def _turn(self, session_id, message):
+        """Load the session, run the controller and save what changed (on an executor thread)."""
+        session = self.store.load(session_id) or SessionState(session_id)
+        response = run_chat_controller(
+            user_input=message,
+            user_profile=session.get("user_profile", {}),
+            last_bot_action=session.get("last_bot_action"),
+            total_tokens=session.get("total_tokens", 0),
+            total_cost_inr=session.get("total_cost_inr", 0.0),
+        )
+        session.apply(response)
+        session.history += [["user", message], ["assistant", response["reply"]]]
+        self.store.save(session)
+        return response
+
+    async def _route(self, method, path, body):
+        if path == "/healthz":
+            if self._draining:
+                raise ServiceError(503, "draining")
+            return {"status": "ok", "pid": os.getpid()}
+        if path == "/v1/stats":
+            logger = get_conversation_logger()
+            return dict(self.stats, sessions=len(self._session_locks),
+                        conversation_log=dict(logger.stats) if logger is not None else None,
+                        llm=dispatch_report(), routing=routing_report())
+        if path == "/metrics":
+            return _Text(prometheus_text())
+        if path != "/v1/chat":
+            raise ServiceError(404, f"no route for {path}")
+        if method != "POST":
+            raise ServiceError(405, "use POST")
+        if self._draining:
+            raise ServiceError(503, "shutting down", {"Retry-After": "1"})
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise ServiceError(400, "body must be JSON")
+        message = payload.get("message") if isinstance(payload, dict) else None
+        if not isinstance(message, str) or not message.strip():
+            raise ServiceError(400, "'message' must be a non-empty string")
+        return await self.chat(message.strip(), payload.get("session_id"))
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while not self._draining:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "malformed request line"}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "malformed Content-Length"}, keep_alive=False)
+                    break
+                if length > self.config["max_body_bytes"]:
+                    await self._respond(writer, 413, {"error": "request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                self.stats["requests"] += 1
+                path = target.split("?", 1)[0]
+                start = time.perf_counter()
+                try:
+                    status, payload, extra = 200, await self._route(method, path, body), {}
+                except ServiceError as e:
+                    status, payload, extra = e.status, {"error": str(e)}, e.headers
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    record("request", (time.perf_counter() - start) * 1000, path=path, error=type(e).__name__)
+                    log.exception("Chat service error on %s %s", method, path)
+                    status, payload, extra = 500, {"error": "internal error"}, {}
+                keep_alive = keep_alive and not self._draining
+                await self._respond(writer, status, payload, keep_alive, extra)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive=True, headers=None):
+        if isinstance(payload, _Text):
+            data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        lines = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+    async def serve(self, install_signal_handlers=True):
+        """Serve until SIGTERM/SIGINT (or shutdown()), then drain in-flight turns."""
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.config["max_concurrency"])
+        self._stopping = asyncio.Event()
+        if install_signal_handlers:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                self._loop.add_signal_handler(sig, self._stopping.set)
+
+        server = await asyncio.start_server(
+            self._handle_connection,
+            self.config["host"],
+            self.config["port"],
+            reuse_port=self.config["workers"] > 1 or None,
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        log.info("Chat service pid %d listening on %s:%d", os.getpid(), self.config["host"], self.port)
+        self.started.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            # stop accepting, let running turns finish, then drop idle keep-alive connections
+            self._draining = True
+            server.close()
+            deadline = time.monotonic() + self.config["shutdown_grace"]
+            while self.stats["in_flight"] and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            for writer in list(self._connections):
+                writer.close()
+            await server.wait_closed()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self.store.close()
+            log.info("Chat service pid %d stopped (%d turns abandoned)", os.getpid(), self.stats["in_flight"])
+
+    def shutdown(self):
+        """Thread-safe request to stop serving."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+
+def _run_worker(config):
+    asyncio.run(ChatService(config).serve())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", help="JSON settings file (keys of DEFAULT_CONFIG)")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int, help="processes sharing the port")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+    config = load_config(args.config, host=args.host, port=args.port, workers=args.workers)
+
+    if config["workers"] <= 1:
+        _run_worker(config)
+        return
+
+    processes = [multiprocessing.Process(target=_run_worker, args=(config,)) for _ in range(config["workers"])]
+    for p in processes:
+        p.start()
+
+    def stop(signum, frame):
+        for p in processes:
+            if p.is_alive():
+                p.terminate()  # SIGTERM: each worker drains on its own
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
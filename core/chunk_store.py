@@ -0,0 +1,170 @@
+"""
+Columnar, memory-mapped store for the KB chunks and their vectors
+(data/kb_chunks.cols), in place of a pickle of chunk dicts.
+
+Layout: an 8-byte magic, the length of a JSON header, the header, then
+64-byte aligned arrays:
+
+- policy, insurer, variant, section: dictionary codes (uint16 per row), with
+  the distinct values in the header;
+- id, content: UTF-8 bytes of all rows back to back plus int64 offsets, so
+  row i is data[offsets[i]:offsets[i + 1]];
+- feature_tags: one uint64 bitmask per row over the tag names in the header;
+- vectors: float32 (rows, dim).
+
+open_chunk_store() maps the file read-only, so opening costs one header parse
+however large the KB is, and every worker process shares the same page-cache
+pages. Filters compare the code columns as arrays; a chunk dict is only built
+for the rows a search returns.
+"""
+import graphlib
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"KBCOLS01"
+ALIGN = 64
+DICT_COLUMNS = ("policy", "insurer", "variant", "section")
+STRING_COLUMNS = ("id", "content")
+_LENGTH = struct.Struct("<Q")
+
+
+def dictionary_encode(values):
+    """(distinct values, uint16 code per value)."""
+    dictionary = sorted(set(values), key=lambda v: (v is None, v or ""))
+    index = {value: code for code, value in enumerate(dictionary)}
+    if len(dictionary) > np.iinfo(np.uint16).max:
+        raise ValueError(f"too many distinct values ({len(dictionary)}) for a dictionary column")
+    return dictionary, np.array([index[v] for v in values], dtype=np.uint16)
+
+
+def _tag_order(tag_lists):
+    """One tag order that agrees with every row's own order, so rows read back unchanged."""
+    sorter = graphlib.TopologicalSorter()
+    for tags in tag_lists:
+        for tag in tags:
+            sorter.add(tag)
+        for before, after in zip(tags, tags[1:]):
+            sorter.add(after, before)
+    try:
+        return list(sorter.static_order())
+    except graphlib.CycleError:
+        raise ValueError("feature_tags are listed in conflicting orders") from None
+
+
+def _string_column(values):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def write_chunk_store(path, chunks, vectors, metric):
+    """Write chunks (dicts as in kb.json) and their row-aligned vectors to path."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) != len(chunks):
+        raise ValueError(f"{len(vectors)} vectors but {len(chunks)} chunks")
+    arrays = {}
+    dictionaries = {}
+    for field in DICT_COLUMNS:
+        dictionaries[field], arrays[f"{field}.codes"] = dictionary_encode([c.get(field) for c in chunks])
+    for field in STRING_COLUMNS:
+        arrays[f"{field}.offsets"], arrays[f"{field}.data"] = _string_column([c[field] for c in chunks])
+    tags = _tag_order([c.get("feature_tags") or [] for c in chunks])
+    if len(tags) > 64:
+        raise ValueError(f"{len(tags)} feature tags do not fit a 64-bit mask")
+    bit = {tag: np.uint64(1) << np.uint64(i) for i, tag in enumerate(tags)}
+    masks = np.zeros(len(chunks), dtype=np.uint64)
+    for row, c in enumerate(chunks):
+        for tag in c.get("feature_tags") or []:
+            masks[row] |= bit[tag]
+    arrays["feature_tags"] = masks
+    arrays["vectors"] = vectors
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({
+        "rows": len(chunks), "metric": metric, "dictionaries": dictionaries, "tags": tags, "arrays": layout,
+    }).encode("utf-8")
+    start = -(-(len(MAGIC) + _LENGTH.size + len(header)) // ALIGN) * ALIGN
+    with open(path, "wb") as f:
+        f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+
+
+class ChunkStore:
+    """
+    Read-only view of a chunk store file. Behaves as a sequence of chunk dicts
+    (len, indexing, iteration) and exposes the columns for vectorised filters.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(len(MAGIC) + _LENGTH.size)
+            if head[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path}: not a chunk store")
+            (length,) = _LENGTH.unpack_from(head, len(MAGIC))
+            header = json.loads(f.read(length))
+        start = -(-(len(MAGIC) + _LENGTH.size + length) // ALIGN) * ALIGN
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        self._arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            begin = start + spec["offset"]
+            raw = self._buffer[begin:begin + count * dtype.itemsize]
+            self._arrays[name] = raw.view(dtype).reshape(spec["shape"])
+        self.rows = header["rows"]
+        self.metric = header["metric"]
+        self.dictionaries = header["dictionaries"]
+        self.tags = header["tags"]
+        self.vectors = self._arrays["vectors"]
+
+    def __len__(self):
+        return self.rows
+
+    def codes(self, field):
+        return self._arrays[f"{field}.codes"]
+
+    def values(self, field):
+        return self.dictionaries[field]
+
+    def string(self, field, row):
+        offsets = self._arrays[f"{field}.offsets"]
+        return self._arrays[f"{field}.data"][offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+    def strings(self, field):
+        """A whole string column as a list."""
+        offsets = self._arrays[f"{field}.offsets"]
+        data = self._arrays[f"{field}.data"].tobytes()
+        return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(self.rows)]
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError(row)
+        bits = int(self._arrays["feature_tags"][row])
+        chunk = {"id": self.string("id", row)}
+        for field in DICT_COLUMNS:
+            chunk[field] = self.dictionaries[field][self.codes(field)[row]]
+        chunk["content"] = self.string("content", row)
+        chunk["feature_tags"] = [tag for i, tag in enumerate(self.tags) if bits >> i & 1]
+        return chunk
+
+    def __iter__(self):
+        return (self[row] for row in range(self.rows))
+
+
+def open_chunk_store(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path}: no chunk store, run python -m core.kb_build")
+    return ChunkStore(path)
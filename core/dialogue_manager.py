@@ -1,41 +1,37 @@
-from core.profile_extractor import gpt_profile_extractor
+from core.profile import Profile
+from core.profile_extractor import extraction_fields, gpt_profile_extractor
 
 REQUIRED_FIELDS = ["gender", "location", "members"]
 
 def is_profile_complete(profile):
-    has_valid_self = any(
-        m.get("relation") == "self" and isinstance(m.get("age"), int) and m["age"] >= 18
-        for m in profile.get("members", [])
-    )
-    has_gender = profile.get("gender") is not None
-    has_location = profile.get("location") is not None
-
-    return has_valid_self and has_gender and has_location
-
-def merge_members(existing, new):
-    relation_map = {m['relation']: m for m in existing}
-    for m in new:
-        relation = m['relation']
-        if relation in relation_map:
-            # Only update fields that are present
-            if 'age' in m and m['age'] is not None:
-                relation_map[relation]['age'] = m['age']
-        else:
-            relation_map[relation] = m
-    return list(relation_map.values())
-
+    return Profile.from_dict(profile).is_complete()
 
 
-def handle_dialogue(user_input, user_profile, intent, last_bot_action):
-    # Step 1: Extract profile info from GPT
-    new_info = gpt_profile_extractor(user_input)
+def handle_dialogue(user_input, user_profile, intent, last_bot_action, new_info=None):
+    # Step 1: Extract profile info from GPT (unless the caller already did, or the message has nothing to extract)
+    usage = {"tokens_used": 0, "cost_inr": 0.0}
+    if new_info is None:
+        new_info = {}
+        fields = extraction_fields(user_input, user_profile, intent)
+        if fields:
+            new_info, gpt_response = gpt_profile_extractor(user_input, with_usage=True, fields=fields)
+            usage = {"tokens_used": gpt_response["tokens_used"], "cost_inr": gpt_response["cost_inr"]}
 
     # Step 2: Merge profile
-    updated_profile = dict(user_profile)
-    updated_profile["gender"] = new_info.get("gender") or user_profile.get("gender")
-    updated_profile["location"] = new_info.get("location") or user_profile.get("location")
-    updated_profile["members"] = merge_members(user_profile.get("members", []), new_info.get("members", []))
+    previous = Profile.from_dict(user_profile)
+    profile = previous.merge(new_info)
+
+    result = decide_action(profile, intent, last_bot_action)
+    # the session keeps a plain dict; "profile" is the Profile it was built from
+    result["profile"] = profile
+    result["updated_profile"] = profile.to_dict()
+    result["profile_changes"] = sorted(profile.diff(previous))
+    # LLM usage spent inside the dialogue manager (zero when new_info was given)
+    result.update(usage)
+    return result
+
 
+def decide_action(updated_profile, intent, last_bot_action):
     # Step 3: Handle greeting
     if intent == "greeting":
         return {
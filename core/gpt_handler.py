@@ -1,10 +1,17 @@
-from openai import OpenAI
-import streamlit as st
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from core.llm_cache import ResponseCache, cache_key
+from core.llm_dispatch import get_dispatcher
+from core.metrics import record
 
 COSTS = {
     "gpt-4o-mini": {
         "input": 0.00015,
-        "output": 0.00060 
+        "output": 0.00060
     },
     "gpt-4o": {
         "input": 5.00 / 1000,
@@ -12,36 +19,131 @@ COSTS = {
     }
 }
 
-def call_gpt(messages, model="gpt-4o-mini", temperature=0):
+# USD per 1K input tokens
+EMBEDDING_COSTS = {
+    "text-embedding-3-small": 0.00002,
+    "text-embedding-3-large": 0.00013,
+    "text-embedding-ada-002": 0.0001,
+}
+
+USD_TO_INR = 83
+MAX_TOKENS = 500
+
+# Shared client settings; change them with configure_client()
+CLIENT_CONFIG = {
+    "api_key": None,  # None → OPENAI_API_KEY, then st.secrets["openai"]["api_key"]
+    "base_url": None,  # None → OpenAI default (or OPENAI_BASE_URL)
+    "timeout": 30.0,  # seconds per request
+    "connect_timeout": 5.0,
+    "max_retries": 0,  # the SDK's own retries; core.llm_dispatch retries with backoff on top
+    "max_connections": 50,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+}
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", ".cache", "llm_responses.sqlite"
+)
+
+_client = None
+_response_cache = None
+_async_clients = weakref.WeakKeyDictionary()  # event loop → AsyncOpenAI
+_client_lock = threading.Lock()
+
+
+def configure_client(**settings):
     """
-    GPT call wrapper with cost + token tracking.
-    API key is fetched securely from Streamlit secrets.
+    Update CLIENT_CONFIG and drop the cached clients so the next call
+    reconnects with the new settings (e.g. a local base_url in tests).
     """
+    unknown = set(settings) - set(CLIENT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {sorted(unknown)}")
+    global _client
+    with _client_lock:
+        CLIENT_CONFIG.update(settings)
+        if _client is not None:
+            _client.close()
+        _client = None
+        _async_clients.clear()
+
+
+def _streamlit_api_key():
+    # only the Streamlit app keeps its key in st.secrets; workers and tests use env/config
+    import streamlit as st
+
+    return st.secrets["openai"]["api_key"]
+
+
+def _client_kwargs(async_client):
+    # imported here so the first page render doesn't pay for the SDK import
+    import openai
+
+    config = CLIENT_CONFIG
+    api_key = config["api_key"] or os.environ.get("OPENAI_API_KEY") or _streamlit_api_key()
+    timeout = openai.Timeout(config["timeout"], connect=config["connect_timeout"])
+    # Limits class of whichever httpx version the SDK is built on
+    limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=config["max_connections"],
+        max_keepalive_connections=config["max_keepalive_connections"],
+        keepalive_expiry=config["keepalive_expiry"],
+    )
+    http_client_cls = openai.DefaultAsyncHttpxClient if async_client else openai.DefaultHttpxClient
+    kwargs = {
+        "api_key": api_key,
+        "timeout": timeout,
+        "max_retries": config["max_retries"],
+        "http_client": http_client_cls(limits=limits),
+    }
+    if config["base_url"]:
+        kwargs["base_url"] = config["base_url"]
+    return kwargs
+
+
+def get_client():
+    """Process-wide OpenAI client; its keep-alive pool is reused across calls."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                _client = OpenAI(**_client_kwargs(async_client=False))
+    return _client
+
+
+def get_async_client():
+    """AsyncOpenAI client shared by every coroutine on the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+
+        client = AsyncOpenAI(**_client_kwargs(async_client=True))
+        _async_clients[loop] = client
+    return client
+
+
+def _check_model(model):
     if model not in COSTS:
         raise ValueError(f"Unsupported model: {model}")
 
-    api_key = st.secrets["openai"]["api_key"]
-    client = OpenAI(api_key=api_key)
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=500
-    )
+def _build_result(response, model):
+    return _usage_result(response.choices[0].message.content.strip(), response.usage, model)
 
-    output = response.choices[0].message.content.strip()
 
-    usage = response.usage
-    input_tokens = usage.prompt_tokens
-    output_tokens = usage.completion_tokens
-    total_tokens = usage.total_tokens
+def _usage_result(output, usage, model):
+    # a stream cut short never delivers its usage chunk
+    input_tokens = usage.prompt_tokens if usage is not None else 0
+    output_tokens = usage.completion_tokens if usage is not None else 0
+    total_tokens = usage.total_tokens if usage is not None else 0
 
     cost_usd = (
         (input_tokens / 1000) * COSTS[model]["input"]
         + (output_tokens / 1000) * COSTS[model]["output"]
     )
-    cost_inr = cost_usd * 83
+    cost_inr = cost_usd * USD_TO_INR
 
     return {
         "output": output,
@@ -49,5 +151,222 @@ def call_gpt(messages, model="gpt-4o-mini", temperature=0):
         "input_tokens": input_tokens,
         "output_tokens": output_tokens,
         "cost_usd": round(cost_usd, 4),
-        "cost_inr": round(cost_inr, 4)
+        "cost_inr": round(cost_inr, 4),
+        "cache_hit": False
+    }
+
+
+def _cached_result(output):
+    # served without an API call, so nothing is billed
+    return {
+        "output": output,
+        "tokens_used": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cost_usd": 0.0,
+        "cost_inr": 0.0,
+        "cache_hit": True
     }
+
+
+def enable_response_cache(path=DEFAULT_CACHE_PATH, memory_entries=1024, ttl_seconds=7 * 24 * 3600,
+                          max_bytes=64 * 1024 * 1024):
+    """
+    Opt in to caching completions by (model, messages, temperature, max_tokens).
+    path=None keeps the cache in memory only.
+    """
+    global _response_cache
+    disable_response_cache()
+    _response_cache = ResponseCache(path, memory_entries, ttl_seconds, max_bytes)
+    return _response_cache
+
+
+def disable_response_cache():
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = None
+
+
+def response_cache_stats():
+    return _response_cache.report() if _response_cache is not None else None
+
+
+def _shared_result(result):
+    # answered by an identical request already in flight; only the leader is billed
+    return dict(_cached_result(result["output"]), cache_hit=False, coalesced=True)
+
+
+def _estimate_tokens(messages):
+    # what the TPM limit counts: prompt (about 4 characters a token) plus the completion cap
+    return sum(len(m["content"]) for m in messages) // 4 + MAX_TOKENS
+
+
+def _record_llm(result, model, start, **attrs):
+    record("llm", (time.perf_counter() - start) * 1000, model=model, tokens=result["tokens_used"],
+           cost_inr=result["cost_inr"], cache_hit=result["cache_hit"], **attrs)
+    return result
+
+
+def _request_kwargs(messages, model, temperature, response_format):
+    kwargs = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": MAX_TOKENS
+    }
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    return kwargs
+
+
+def call_gpt(messages, model="gpt-4o-mini", temperature=0, response_format=None):
+    """
+    GPT call wrapper with cost + token tracking.
+    API key comes from configure_client, OPENAI_API_KEY or Streamlit secrets.
+    """
+    _check_model(model)
+    start = time.perf_counter()
+
+    key = cache_key(model, messages, temperature, MAX_TOKENS, response_format)
+    cache = _response_cache
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return _record_llm(_cached_result(cached), model, start)
+
+    def send():
+        response = get_client().chat.completions.create(
+            **_request_kwargs(messages, model, temperature, response_format)
+        )
+        return _build_result(response, model)
+
+    # rate limit, retries and coalescing of identical in-flight requests
+    result, coalesced = get_dispatcher().call(key, send, _estimate_tokens(messages))
+    if coalesced:
+        return _record_llm(_shared_result(result), model, start, coalesced=True)
+    if cache is not None:
+        cache.put(key, result["output"])
+    return _record_llm(result, model, start)
+
+
+async def acall_gpt(messages, model="gpt-4o-mini", temperature=0, response_format=None):
+    """Async counterpart of call_gpt; returns the same token/cost dict."""
+    _check_model(model)
+    start = time.perf_counter()
+
+    key = cache_key(model, messages, temperature, MAX_TOKENS, response_format)
+    cache = _response_cache
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return _record_llm(_cached_result(cached), model, start)
+
+    async def send():
+        response = await get_async_client().chat.completions.create(
+            **_request_kwargs(messages, model, temperature, response_format)
+        )
+        return _build_result(response, model)
+
+    result, coalesced = await get_dispatcher().acall(key, send, _estimate_tokens(messages))
+    if coalesced:
+        return _record_llm(_shared_result(result), model, start, coalesced=True)
+    if cache is not None:
+        cache.put(key, result["output"])
+    return _record_llm(result, model, start)
+
+
+class GPTStream:
+    """
+    Iterable of the text deltas of a streamed completion. The request is only
+    sent when iteration starts. Once exhausted, .result holds the call_gpt dict
+    plus ttft_ms (time to first token) and stream_ms, and on_complete(result)
+    has been called.
+    """
+
+    def __init__(self, messages, model="gpt-4o-mini", temperature=0, on_complete=None):
+        _check_model(model)
+        self.messages = messages
+        self.model = model
+        self.temperature = temperature
+        self.on_complete = on_complete
+        self.result = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        cache = _response_cache
+        if cache is not None:
+            key = cache_key(self.model, self.messages, self.temperature, MAX_TOKENS, None)
+            cached = cache.get(key)
+            if cached is not None:
+                yield cached
+                self._finish(_cached_result(cached), start, start)
+                return
+
+        # limited and retried until the stream opens; a stream broken mid-way is not resent
+        response = get_dispatcher().run(
+            lambda: get_client().chat.completions.create(
+                **_request_kwargs(self.messages, self.model, self.temperature, None),
+                stream=True,
+                stream_options={"include_usage": True},
+            ),
+            _estimate_tokens(self.messages),
+        )
+        parts = []
+        usage = None
+        first_token_at = None
+        for chunk in response:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                text = chunk.choices[0].delta.content
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(text)
+                yield text
+        result = _usage_result("".join(parts).strip(), usage, self.model)
+        if cache is not None:
+            cache.put(key, result["output"])
+        self._finish(result, start, first_token_at or time.perf_counter())
+
+    def _finish(self, result, start, first_token_at):
+        result["ttft_ms"] = round((first_token_at - start) * 1000, 1)
+        result["stream_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        self.result = result
+        _record_llm(result, self.model, start, streamed=True, ttft_ms=result["ttft_ms"])
+        if self.on_complete is not None:
+            self.on_complete(result)
+
+
+def stream_gpt(messages, model="gpt-4o-mini", temperature=0, on_complete=None):
+    """Streaming counterpart of call_gpt; see GPTStream."""
+    return GPTStream(messages, model, temperature, on_complete)
+
+
+def embed_texts(texts, model="text-embedding-3-small"):
+    """Embeddings for a batch of texts, with the same token/cost fields as call_gpt."""
+    if model not in EMBEDDING_COSTS:
+        raise ValueError(f"Unsupported embedding model: {model}")
+
+    start = time.perf_counter()
+
+    def send():
+        response = get_client().embeddings.create(model=model, input=list(texts))
+        tokens = response.usage.total_tokens
+        cost_usd = (tokens / 1000) * EMBEDDING_COSTS[model]
+        return {
+            "embeddings": [item.embedding for item in sorted(response.data, key=lambda d: d.index)],
+            "tokens_used": tokens,
+            "cost_usd": round(cost_usd, 6),
+            "cost_inr": round(cost_usd * USD_TO_INR, 6)
+        }
+
+    # rate limited and retried like the chat calls (about 4 characters a token)
+    result = get_dispatcher().run(send, sum(len(text) for text in texts) // 4 + 1)
+    record("embed", (time.perf_counter() - start) * 1000, model=model, tokens=result["tokens_used"],
+           cost_inr=result["cost_inr"])
+    return result
+
+
+if os.environ.get("LLM_CACHE") == "1":
+    enable_response_cache(os.environ.get("LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
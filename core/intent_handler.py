@@ -1,13 +1,23 @@
-from openai import OpenAI
-import os
-from core.gpt_handler import call_gpt
+import json
 
+from core.model_router import routed_call
 
+INTENTS = [
+    "greeting",
+    "profile_info",
+    "recommend",
+    "policy_query",
+    "concept_query",
+    "compare",
+    "limitation_query",
+    "affirmation",
+    "general_info",
+    "unknown",
+]
 
-def classify_intent(user_input: str, model="gpt-4o-mini"):
-    system_prompt = """
-    You are an intent classifier for a health insurance chatbot. Classify the user's message into one of these intents:
+LOCATIONS = ["Tier 1", "Tier 2", "Tier 3"]
 
+INTENT_DEFINITIONS = """
     1. greeting – greetings like "hi", "hello", etc.
     2. profile_info – user gives info like age, gender, city, or family members. Even single words like "male", "30", or "Bangalore" should be profile_info.
     3. recommend – asks for plan suggestions or best policy.
@@ -18,7 +28,13 @@ def classify_intent(user_input: str, model="gpt-4o-mini"):
     8. affirmation – short positive replies like "yes", "okay", "sure", "go ahead".
     9. general_info – user wants to know about insurance in general, or asks vague/broad questions (e.g., “I want to know about insurance”).
     10. unknown – anything else.
+"""
+
 
+def classify_intent(user_input: str, model=None):
+    system_prompt = f"""
+    You are an intent classifier for a health insurance chatbot. Classify the user's message into one of these intents:
+    {INTENT_DEFINITIONS}
     Return only the intent label (e.g., "profile_info").
     """
 
@@ -28,5 +44,102 @@ def classify_intent(user_input: str, model="gpt-4o-mini"):
         {"role": "user", "content": user_input}
     ]
 
-    result = call_gpt(messages, model=model, temperature=0)
-    return result
\ No newline at end of file
+    result = routed_call("classify", messages, model=model, temperature=0)
+    return result
+
+
+UNDERSTAND_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "understanding",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "intent": {"type": "string", "enum": INTENTS},
+                "gender": {"type": ["string", "null"], "enum": ["male", "female", None]},
+                "location": {"type": ["string", "null"], "enum": LOCATIONS + [None]},
+                "members": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "relation": {"type": "string"},
+                            "age": {"type": "integer"},
+                        },
+                        "required": ["relation", "age"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["intent", "gender", "location", "members"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def parse_understanding(raw_output):
+    """
+    Validate a combined intent + profile reply against UNDERSTAND_SCHEMA.
+    Raises ValueError when it doesn't conform.
+    """
+    data = json.loads(raw_output)
+    if not isinstance(data, dict):
+        raise ValueError("understanding must be a JSON object")
+    if data.get("intent") not in INTENTS:
+        raise ValueError(f"unknown intent: {data.get('intent')!r}")
+    if data.get("gender") not in ("male", "female", None):
+        raise ValueError(f"invalid gender: {data.get('gender')!r}")
+    if data.get("location") not in LOCATIONS + [None]:
+        raise ValueError(f"invalid location: {data.get('location')!r}")
+    members = data.get("members")
+    if not isinstance(members, list):
+        raise ValueError("members must be a list")
+    for m in members:
+        if not isinstance(m, dict) or not isinstance(m.get("relation"), str) \
+                or not isinstance(m.get("age"), int) or isinstance(m.get("age"), bool):
+            raise ValueError(f"invalid member: {m!r}")
+    return {
+        "intent": data["intent"],
+        "gender": data["gender"],
+        "location": data["location"],
+        "members": [{"relation": m["relation"], "age": m["age"]} for m in members],
+    }
+
+
+def understand_message(user_input: str, model=None):
+    """
+    One structured-output call that classifies the intent and extracts the
+    profile together. Returns (understanding or None, gpt_response); None
+    means the reply failed validation and the caller should fall back.
+    """
+    system_prompt = f"""
+    You are the understanding engine for a health insurance chatbot.
+    For the user's message return JSON with:
+
+    - "intent": one of these intents:
+    {INTENT_DEFINITIONS}
+    - "gender": "male" or "female" or null
+    - "location": "Tier 1" / "Tier 2" / "Tier 3" or null
+    - "members": list of {{"relation": "self/spouse/father/mother/son/daughter/...", "age": integer}}
+
+    Strict rules:
+    - Extract only what is *explicitly stated* in the message.
+    - Do NOT assume gender or location. If not clearly mentioned, set them to null.
+    - Age must be a number. If unclear, skip the member.
+    - If a person is mentioned but no relation is stated, default to "self".
+    - Never guess or hallucinate values.
+    """
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_input}
+    ]
+
+    response = routed_call("understand", messages, model=model, temperature=0, response_format=UNDERSTAND_SCHEMA)
+    try:
+        understanding = parse_understanding(response["output"])
+    except ValueError:
+        understanding = None
+    return understanding, response
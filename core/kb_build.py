@@ -0,0 +1,294 @@
+"""
+Builds data/kb.json, data/kb_chunks.cols (the chunk store the engine maps)
+and data/kb.index (the same vectors for faiss tooling) from
+data/knowledge_base_merged.json:
+
+    python -m core.kb_build                       # embed with KB_EMBEDDING_MODEL
+    python -m core.kb_build --embedder local      # offline, deterministic hashing embedder
+
+Chunking is deterministic, and every chunk is keyed by a hash of the text
+that gets embedded. data/kb_manifest.json records those hashes and the
+embedder the index was built with, so a rebuild only embeds chunks that are new
+or changed and takes the rest from the previous index. Each output is written
+to a temporary file and moved into place, so readers never see a half-written
+file.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from core.keyword_index import KB_PATH
+from core.chunk_store import write_chunk_store
+from core.retrieval import INDEX_PATH, KB_EMBEDDING_MODEL, METRIC_L2, STORE_PATH, read_flat_index, write_flat_index
+
+DATA_DIR = os.path.dirname(KB_PATH)
+SOURCE_PATH = os.path.join(DATA_DIR, "knowledge_base_merged.json")
+MANIFEST_PATH = os.path.join(DATA_DIR, "kb_manifest.json")
+
+# tag → keywords looked for in the lowercased chunk text; tags are listed in this order
+FEATURE_TAGS = {
+    "maternity": ["maternity", "newborn", "natal", "m-iracle"],
+    "ped": ["ped", "pre-existing"],
+    "room_rent": ["room rent", "proportionate"],
+    "ayush": ["ayush"],
+    "air_ambulance": ["air ambulance"],
+    "restore": ["restor", "reset", "recharge"],
+    "non_payables": ["non-medical", "protect", "safeguard"],
+    "bonus": ["bonus", "ncb"],
+    "copay": ["co-pay"],
+    "deductible": ["deductible"],
+    "opd": ["opd", "outpatient"],
+}
+# Sections whose text makes up a variant's VARIANT_SUMMARY chunk
+SUMMARY_SECTIONS = ("coverage", "exclusions", "waiting_periods", "value_added_services")
+# Not chunked: the name is on every chunk, riders are add-ons rather than plan features
+SKIP_SECTIONS = ("variant_name", "riders")
+
+
+def feature_tags(text):
+    lowered = text.lower()
+    return [tag for tag, words in FEATURE_TAGS.items() if any(w in lowered for w in words)]
+
+
+def _merge_tags(chunks):
+    found = {tag for chunk in chunks for tag in chunk["feature_tags"]}
+    return [tag for tag in FEATURE_TAGS if tag in found]
+
+
+def _slug(text):
+    return str(text).replace(" ", "_")
+
+
+def _chunk(policy, variant, section, suffix, content, tags=None):
+    return {
+        "id": "-".join(_slug(part) for part in (policy["name"], variant, section, suffix) if part is not None),
+        "policy": policy["name"],
+        "insurer": policy["insurer"],
+        "variant": variant,
+        "section": section,
+        "content": content,
+        "feature_tags": feature_tags(content) if tags is None else tags,
+    }
+
+
+def _flatten(values, prefix=()):
+    """(key path, value) pairs of a nested dict, depth first."""
+    for key, value in values.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + (key,))
+        else:
+            yield prefix + (key,), value
+
+
+def chunk_variant(policy, variant):
+    name = variant["variant_name"]
+    chunks = []
+    for section, value in variant.items():
+        if section in SKIP_SECTIONS:
+            continue
+        if isinstance(value, str):
+            chunks.append(_chunk(policy, name, section, None, value))
+        elif isinstance(value, list):
+            items = [item for item in value if isinstance(item, str)]
+            section_chunks = [_chunk(policy, name, section, i, item) for i, item in enumerate(items)]
+            if items:
+                section_chunks.append(
+                    _chunk(policy, name, section, "SUMMARY", " | ".join(items), _merge_tags(section_chunks))
+                )
+            chunks += section_chunks
+        elif section == "variant_details":
+            # keyed by sub-variant (e.g. Gold+ / Diamond+), which becomes the chunk's variant
+            for sub_variant, details in value.items():
+                for path, detail in _flatten(details):
+                    suffix = "-".join(_slug(key) for key in path)
+                    chunks.append(_chunk(policy, sub_variant, section, suffix, f"{' '.join(path)}: {detail}"))
+        elif isinstance(value, dict):
+            chunks += [_chunk(policy, name, section, key, f"{key}: {item}") for key, item in value.items()]
+    summarised = [c for c in chunks if c["section"] in SUMMARY_SECTIONS]
+    chunks.append({
+        "id": f"{_slug(policy['name'])}-{_slug(name)}-VARIANT_SUMMARY",
+        "policy": policy["name"],
+        "insurer": policy["insurer"],
+        "variant": name,
+        "section": "variant_summary",
+        "content": " | ".join(c["content"] for c in summarised),
+        "feature_tags": _merge_tags(summarised),
+    })
+    return chunks
+
+
+def chunk_knowledge_base(kb):
+    """All chunks of the merged knowledge base, in policy, variant and section order."""
+    chunks = [c for policy in kb["policies"] for variant in policy["variants"] for c in chunk_variant(policy, variant)]
+    seen = set()
+    for chunk in chunks:
+        if chunk["id"] in seen:
+            raise ValueError(f"duplicate chunk id {chunk['id']}")
+        seen.add(chunk["id"])
+    return chunks
+
+
+def embedding_text(chunk):
+    return chunk["content"]
+
+
+def content_hash(chunk):
+    return hashlib.sha256(embedding_text(chunk).encode("utf-8")).hexdigest()[:32]
+
+
+def make_embedder(name=None):
+    """"local" or "hashing-<dim>" for the offline HashingEmbedder, anything else is an OpenAI model."""
+    from core.semantic_cache import HashingEmbedder, OpenAIEmbedder
+
+    name = name or KB_EMBEDDING_MODEL
+    if name == "local":
+        return HashingEmbedder()
+    if name.startswith("hashing-"):
+        return HashingEmbedder(int(name[len("hashing-"):]))
+    return OpenAIEmbedder(name)
+
+
+def load_manifest(path=None):
+    path = path or MANIFEST_PATH
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def kb_embedder():
+    """Embedder matching the vectors in data/kb.index, for embedding queries."""
+    manifest = load_manifest()
+    return make_embedder(manifest["embedder"] if manifest else None)
+
+
+def _previous_vectors(out_dir, embedder_name):
+    """
+    (ids, hashes, vectors) of the index already in out_dir, row-aligned, or
+    None when there is none or it came from another embedder.
+    """
+    index_path = os.path.join(out_dir, os.path.basename(INDEX_PATH))
+    kb_json = os.path.join(out_dir, os.path.basename(KB_PATH))
+    if not (os.path.exists(index_path) and os.path.exists(kb_json)):
+        return None
+    with open(kb_json) as f:
+        old_chunks = json.load(f)
+    manifest = load_manifest(os.path.join(out_dir, os.path.basename(MANIFEST_PATH)))
+    if manifest is not None:
+        built_with, hashes = manifest["embedder"], manifest["hashes"]
+    else:
+        # an index from before manifests was embedded from kb.json with KB_EMBEDDING_MODEL
+        built_with, hashes = KB_EMBEDDING_MODEL, [content_hash(c) for c in old_chunks]
+    vectors, _ = read_flat_index(index_path)
+    if built_with != embedder_name or not len(vectors) == len(hashes) == len(old_chunks):
+        return None
+    return [c["id"] for c in old_chunks], hashes, vectors
+
+
+def embed_in_batches(embedder, texts, batch_size=64, workers=4):
+    """Embed texts in batches of batch_size, up to workers batches at a time; rows keep the input order."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if not batches:
+        return []
+    with ThreadPoolExecutor(max(1, min(workers, len(batches))), thread_name_prefix="kb-embed") as pool:
+        results = list(pool.map(lambda batch: np.asarray(embedder(batch), dtype=np.float32), batches))
+    return np.vstack(results)
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def build_kb(source_path=None, out_dir=None, embedder=None, batch_size=64, workers=4, full=False):
+    """
+    Chunk the merged knowledge base, embed what isn't in the current index and
+    write kb.json, kb_chunks.cols, kb.index and kb_manifest.json to out_dir.
+    full=True re-embeds every chunk. Returns a report of what was done.
+    """
+    start = time.perf_counter()
+    out_dir = out_dir or DATA_DIR
+    embedder = embedder or make_embedder()
+    with open(source_path or SOURCE_PATH) as f:
+        chunks = chunk_knowledge_base(json.load(f))
+    hashes = [content_hash(c) for c in chunks]
+
+    previous = None if full else _previous_vectors(out_dir, embedder.name)
+    old_ids, old_hashes, old_vectors = previous or ([], [], None)
+    by_hash = {h: row for row, h in enumerate(old_hashes)}
+    by_id = {chunk_id: row for row, chunk_id in enumerate(old_ids)}
+
+    # identical texts (e.g. sum insured options shared by policies) are embedded once
+    first_row = {}
+    for row, h in enumerate(hashes):
+        if h not in by_hash:
+            first_row.setdefault(h, row)
+    texts = [embedding_text(chunks[row]) for row in first_row.values()]
+    embed_start = time.perf_counter()
+    fresh = embed_in_batches(embedder, texts, batch_size, workers)
+    embed_ms = (time.perf_counter() - embed_start) * 1000
+    new_rows = {h: n for n, h in enumerate(first_row)}
+
+    dim = fresh.shape[1] if texts else old_vectors.shape[1]
+    vectors = np.empty((len(chunks), dim), dtype=np.float32)
+    for row, (chunk, h) in enumerate(zip(chunks, hashes)):
+        if h in new_rows:
+            vectors[row] = fresh[new_rows[h]]
+        else:
+            # an unchanged chunk keeps its own vector even when another chunk has the same text
+            old_row = by_id.get(chunk["id"])
+            vectors[row] = old_vectors[old_row if old_row is not None and old_hashes[old_row] == h else by_hash[h]]
+    reused = sum(1 for h in hashes if h not in new_rows)
+    removed = len(set(old_ids) - {c["id"] for c in chunks})
+    del previous, old_vectors  # the memmap of the index about to be replaced
+
+    manifest = {"embedder": embedder.name, "dim": dim, "chunks": len(chunks), "hashes": hashes}
+    index_path = os.path.join(out_dir, os.path.basename(INDEX_PATH))
+    store_path = os.path.join(out_dir, os.path.basename(STORE_PATH))
+    write_flat_index(index_path + ".tmp", vectors, METRIC_L2)
+    write_chunk_store(store_path + ".tmp", chunks, vectors, METRIC_L2)
+    _write_atomic(os.path.join(out_dir, os.path.basename(KB_PATH)), json.dumps(chunks, indent=2).encode("utf-8"))
+    os.replace(index_path + ".tmp", index_path)
+    os.replace(store_path + ".tmp", store_path)
+    _write_atomic(os.path.join(out_dir, os.path.basename(MANIFEST_PATH)), json.dumps(manifest).encode("utf-8"))
+
+    return {
+        "chunks": len(chunks),
+        "reused": reused,
+        "embedded": len(chunks) - reused,
+        "embedded_texts": len(texts),
+        "removed": removed,
+        "embedder": embedder.name,
+        "embed_ms": round(embed_ms, 1),
+        "build_seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the KB chunks and vector index")
+    parser.add_argument("--source", default=SOURCE_PATH)
+    parser.add_argument("--out-dir", default=DATA_DIR)
+    parser.add_argument("--embedder", default=None, help='"local" for offline builds, else an OpenAI embedding model')
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--full", action="store_true", help="re-embed every chunk")
+    args = parser.parse_args(argv)
+
+    report = build_kb(args.source, args.out_dir, make_embedder(args.embedder), args.batch_size, args.workers, args.full)
+    print(f"Built {report['chunks']} chunks in {report['build_seconds']}s: {report['reused']} reused, "
+          f"{report['embedded']} embedded ({report['embedded_texts']} unique texts, {report['embed_ms']} ms), "
+          f"{report['removed']} removed, embedder {report['embedder']}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
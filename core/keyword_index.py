@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KB_PATH = os.path.join(BASE_DIR, "data", "kb.json")
+CACHE_DIR = os.path.join(BASE_DIR, "data", ".cache")
+
+# Bump when tokenisation or the on-disk layout changes
+BM25_FORMAT = 1
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_SUFFIXES = ("ations", "ation", "ings", "ing", "es", "ed", "e", "s")
+
+
+def _stem(word):
+    # just enough to line up restore/restoration, rooms/room, waiting/wait
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    text = text.lower().replace("-", "").replace("_", " ")
+    return [_stem(w) for w in _WORD_RE.findall(text)]
+
+
+def document_text(chunk):
+    # tags are short and precise, so count them twice
+    tags = " ".join(chunk.get("feature_tags") or [])
+    return " ".join([chunk.get("content", ""), chunk.get("section", ""), tags, tags])
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 weights precomputed per posting, stored as CSR
+    arrays: the postings of term t are doc_ids/weights[offsets[t]:offsets[t + 1]].
+    A query only sums the weights of its terms' postings.
+    """
+
+    def __init__(self, doc_ids, vocab, offsets, postings, weights):
+        self.doc_ids = list(doc_ids)
+        self.vocab = vocab
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+
+    @classmethod
+    def build(cls, chunks, k1=1.2, b=0.75):
+        docs = [tokenize(document_text(c)) for c in chunks]
+        lengths = np.array([len(d) for d in docs], dtype=np.float32)
+        avg_len = float(lengths.mean()) if len(docs) else 0.0
+
+        term_docs = {}
+        for doc, tokens in enumerate(docs):
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_docs.setdefault(token, []).append((doc, tf))
+
+        vocab = {term: i for i, term in enumerate(sorted(term_docs))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        postings, weights = [], []
+        n_docs = len(docs)
+        for term, t in vocab.items():
+            entries = term_docs[term]
+            idf = np.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            for doc, tf in entries:
+                norm = k1 * (1 - b + b * lengths[doc] / avg_len)
+                postings.append(doc)
+                weights.append(idf * tf * (k1 + 1) / (tf + norm))
+            offsets[t + 1] = len(postings)
+        return cls(
+            [c["id"] for c in chunks],
+            vocab,
+            offsets,
+            np.array(postings, dtype=np.int32),
+            np.array(weights, dtype=np.float32),
+        )
+
+    def scores(self, query):
+        """BM25 score of every document for a query string."""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is not None:
+                lo, hi = self.offsets[t], self.offsets[t + 1]
+                # a term lists each document once, so plain fancy-index add is safe
+                scores[self.postings[lo:hi]] += self.weights[lo:hi]
+        return scores
+
+    def save(self, path):
+        meta = json.dumps({"doc_ids": self.doc_ids, "terms": sorted(self.vocab, key=self.vocab.get)})
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                meta=np.frombuffer(meta.encode("utf-8"), dtype=np.uint8),
+                offsets=self.offsets,
+                postings=self.postings,
+                weights=self.weights,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes())
+            vocab = {term: i for i, term in enumerate(meta["terms"])}
+            return cls(meta["doc_ids"], vocab, data["offsets"], data["postings"], data["weights"])
+
+
+def load_or_build(kb_path=None, cache_dir=None):
+    """
+    BM25 index for kb.json, read from data/.cache when one was already built
+    for this exact file content.
+    """
+    kb_path = kb_path or KB_PATH
+    cache_dir = cache_dir or CACHE_DIR
+    with open(kb_path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw + f"format={BM25_FORMAT}".encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"kb_bm25.{digest}.npz")
+    if os.path.exists(path):
+        return BM25Index.load(path)
+
+    index = BM25Index.build(json.loads(raw))
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(cache_dir):
+        if name.startswith("kb_bm25.") and name.endswith(".npz"):
+            os.remove(os.path.join(cache_dir, name))
+    index.save(path)
+    return index
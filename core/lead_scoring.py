@@ -0,0 +1,245 @@
+"""
+Batch recommendations for lead files (CSV or Parquet), streamed in chunks.
+
+    python -m core.lead_scoring leads.csv scored.csv --plan-features plans.csv --workers 4
+
+Each lead row has gender, age, location, members and ped_conditions (see
+scoring.profile_flag_matrix). Any other column named after an attribute of the
+Att x Feat matrix (e.g. doctor_visits_high) is read as a 0/1 flag.
+
+With --plan-features (a plan x feature weight CSV) leads are scored by matrix
+products: needs = attributes @ Att x Feat, score = cosine(needs, plan features).
+Without it, each distinct profile is looked up once in the precomputed
+recommendation index.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from core import scoring
+
+ATT_FEAT_PATH = os.path.join(scoring.BASE_DIR, "data", "Policy Mapping - Att X Feat.csv")
+CHUNK_SIZE = 50_000
+OUTPUT_COLUMNS = ["lead_id"] + [f"{field}_{i}" for i in range(1, scoring.TOP_K + 1) for field in ("plan", "score")]
+
+
+def load_attribute_weights(path=None):
+    """(attributes, features, weights) with weights an (n_attributes, n_features) float32 array."""
+    import pandas as pd
+
+    frame = pd.read_csv(path or ATT_FEAT_PATH).set_index("feature")
+    return list(frame.index), list(frame.columns), np.ascontiguousarray(frame.to_numpy(dtype=np.float32))
+
+
+def encode_leads(frame, attributes):
+    """(n, len(attributes)) float32 attribute matrix for a chunk of lead rows."""
+    matrix = np.zeros((len(frame), len(attributes)), dtype=np.float32)
+    col = {name: i for i, name in enumerate(attributes)}
+    flags = scoring.profile_flag_matrix(frame)
+    for j, name in enumerate(scoring.PROFILE_FLAGS):
+        if name in col:
+            matrix[:, col[name]] = flags[:, j]
+    for name in frame.columns:
+        if name in col and name not in scoring.PROFILE_FLAGS:
+            matrix[:, col[name]] = frame[name].fillna(0).to_numpy(dtype=np.float32)
+    return matrix
+
+
+class MatrixScorer:
+    """
+    Scores chunks against a plan x feature matrix. Rows are named by the
+    variant column when there is one, and variants with the same plan
+    ("Aspire - Gold+" and "Aspire - Diamond+" of Aspire) compete for a single
+    slot, like scoring.top_plans; without it every row is a plan of its own.
+    """
+
+    def __init__(self, plan_features_path, att_feat_path=None, k=scoring.TOP_K):
+        import pandas as pd
+
+        self.attributes, features, self.weights = load_attribute_weights(att_feat_path)
+        plans = pd.read_csv(plan_features_path)
+        names = plans["plan"].astype(str).tolist()
+        plans = plans.set_index("variant" if "variant" in plans else "plan").drop(columns="plan", errors="ignore")
+        if not set(plans.columns) & set(features):
+            raise ValueError(f"{plan_features_path}: no feature columns in common with the Att x Feat matrix")
+        plans = plans.reindex(columns=features, fill_value=0.0).fillna(0.0)
+        vectors = plans.to_numpy(dtype=np.float32)
+        self.plan_vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self.plan_names = [str(p) for p in plans.index]
+        self.groups = [np.array([i for i, n in enumerate(names) if n == name]) for name in dict.fromkeys(names)]
+        self.k = min(k, len(self.groups))
+
+    def score(self, frame):
+        """(plan_indices, scores), each (n, k), best first."""
+        needs = encode_leads(frame, self.attributes) @ self.weights
+        needs /= np.maximum(np.linalg.norm(needs, axis=1, keepdims=True), 1e-12)
+        scores = needs @ self.plan_vectors.T
+
+        # best variant of each plan, then top-k plans
+        group_scores = np.empty((len(frame), len(self.groups)), dtype=np.float32)
+        group_best = np.empty((len(frame), len(self.groups)), dtype=np.int64)
+        for g, cols in enumerate(self.groups):
+            best = np.argmax(scores[:, cols], axis=1)
+            group_best[:, g] = cols[best]
+            group_scores[:, g] = scores[np.arange(len(frame)), cols[best]]
+        top = np.argpartition(-group_scores, self.k - 1, axis=1)[:, :self.k]
+        order = np.argsort(-np.take_along_axis(group_scores, top, axis=1), axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        return np.take_along_axis(group_best, top, axis=1), np.take_along_axis(group_scores, top, axis=1)
+
+    def rows(self, frame):
+        indices, scores = self.score(frame)
+        names = np.array(self.plan_names, dtype=object)
+        return names[indices], scores
+
+
+class IndexScorer:
+    """Scores chunks through the precomputed RecommendationIndex, one lookup per distinct profile."""
+
+    def __init__(self, k=scoring.TOP_K):
+        self.index = scoring.get_index()
+        self.k = k
+
+    def rows(self, frame):
+        flags = scoring.profile_flag_matrix(frame).astype(np.int64)
+        keys = flags @ np.left_shift(np.int64(1), np.arange(len(scoring.PROFILE_FLAGS), dtype=np.int64))
+        unique, inverse = np.unique(keys, return_inverse=True)
+        names = np.full((len(unique), self.k), None, dtype=object)
+        scores = np.full((len(unique), self.k), np.nan, dtype=np.float32)
+        for u, key in enumerate(unique):
+            entry = self.index.lookup(int(key))
+            for j, (plan, score) in enumerate((entry or {}).get("top_plans", [])[:self.k]):
+                names[u, j] = plan
+                scores[u, j] = score
+        return names[inverse], scores[inverse]
+
+
+def score_chunk(scorer, frame, id_column=None):
+    import pandas as pd
+
+    names, scores = scorer.rows(frame)
+    out = {"lead_id": frame[id_column].to_numpy() if id_column else frame.index.to_numpy()}
+    for j in range(scoring.TOP_K):
+        out[f"plan_{j + 1}"] = names[:, j] if j < names.shape[1] else None
+        out[f"score_{j + 1}"] = np.round(scores[:, j], 4) if j < scores.shape[1] else np.nan
+    return pd.DataFrame(out, columns=OUTPUT_COLUMNS)
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """DataFrames of at most chunk_size leads, with a running row index."""
+    start = 0
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        batches = (b.to_pandas() for b in pq.ParquetFile(path).iter_batches(batch_size=chunk_size))
+    else:
+        import pandas as pd
+
+        batches = pd.read_csv(path, chunksize=chunk_size)
+    for frame in batches:
+        frame.index = np.arange(start, start + len(frame))
+        start += len(frame)
+        yield frame
+
+
+class ChunkWriter:
+    """Appends result chunks to a CSV or Parquet file as they arrive."""
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet = None
+        self._first = True
+
+    def write(self, frame):
+        if self.path.endswith(".parquet"):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+# One scorer per worker process, built by the pool initializer
+_worker_scorer = None
+
+
+def _make_scorer(plan_features_path):
+    return MatrixScorer(plan_features_path) if plan_features_path else IndexScorer()
+
+
+def _init_worker(plan_features_path):
+    global _worker_scorer
+    _worker_scorer = _make_scorer(plan_features_path)
+
+
+def _score_in_worker(frame, id_column):
+    return score_chunk(_worker_scorer, frame, id_column)
+
+
+def score_file(input_path, output_path, plan_features_path=None, chunk_size=CHUNK_SIZE, workers=1,
+               id_column=None):
+    """
+    Stream input_path through the scorer into output_path, chunk by chunk.
+    With workers > 1 chunks are scored in a process pool; at most 2 chunks
+    per worker are in flight, so memory stays bounded whatever the file size.
+    Returns {"leads", "chunks", "seconds"}.
+    """
+    start = time.perf_counter()
+    writer = ChunkWriter(output_path)
+    leads = chunks = 0
+    try:
+        if workers <= 1:
+            scorer = _make_scorer(plan_features_path)
+            for frame in read_chunks(input_path, chunk_size):
+                writer.write(score_chunk(scorer, frame, id_column))
+                leads += len(frame)
+                chunks += 1
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(plan_features_path,)) as pool:
+                pending = []
+                for frame in read_chunks(input_path, chunk_size):
+                    pending.append(pool.submit(_score_in_worker, frame, id_column))
+                    if len(pending) >= 2 * workers:
+                        result = pending.pop(0).result()
+                        writer.write(result)
+                        leads += len(result)
+                        chunks += 1
+                for future in pending:
+                    result = future.result()
+                    writer.write(result)
+                    leads += len(result)
+                    chunks += 1
+    finally:
+        writer.close()
+    return {"leads": leads, "chunks": chunks, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="leads .csv or .parquet")
+    parser.add_argument("output", help="results .csv or .parquet")
+    parser.add_argument("--plan-features", help="plan x feature weight CSV: a plan column, plus a variant column for plans with variants")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="scoring processes (default 1)")
+    parser.add_argument("--id-column", help="lead id column to copy to the output (default: row number)")
+    args = parser.parse_args()
+
+    stats = score_file(args.input, args.output, args.plan_features, args.chunk_size, args.workers, args.id_column)
+    rate = stats["leads"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"Scored {stats['leads']} leads in {stats['chunks']} chunks, {stats['seconds']} s ({rate:,.0f} leads/s)")
+
+
+if __name__ == "__main__":
+    main()
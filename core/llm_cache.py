@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(model, messages, temperature, max_tokens, response_format=None):
+    """Content address of a chat completion request."""
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "response_format": response_format,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Bounded in-process LRU with per-entry expiry. Not thread-safe on its own."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        evicted = 0
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    Disk tier: key → text with a TTL, trimmed to max_bytes by evicting the
+    least recently used rows.
+    """
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_access ON llm_cache(last_access)")
+
+    def get(self, key):
+        row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        now = time.time()
+        if self.ttl_seconds and created + self.ttl_seconds < now:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value.encode("utf-8")), now, now),
+        )
+        return self._trim()
+
+    def _trim(self):
+        evicted = 0
+        if self.ttl_seconds:
+            evicted += self._conn.execute(
+                "DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+        rows = self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access").fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+        return evicted + len(stale)
+
+    def clear(self):
+        self._conn.execute("DELETE FROM llm_cache")
+
+    def close(self):
+        self._conn.close()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of completion outputs: an LRU in front of SQLite.
+    Disk hits are promoted into memory.
+    """
+
+    def __init__(self, path, memory_entries=1024, ttl_seconds=7 * 24 * 3600, max_bytes=64 * 1024 * 1024):
+        self.memory = LRUCache(memory_entries, ttl_seconds)
+        self.disk = SQLiteCache(path, ttl_seconds, max_bytes) if path else None
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.stats["memory_hits"] += 1
+                return value
+            if self.disk is not None:
+                value = self.disk.get(key)
+                if value is not None:
+                    self.stats["disk_hits"] += 1
+                    self.stats["evictions"] += self.memory.put(key, value)
+                    return value
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self.stats["stores"] += 1
+            self.stats["evictions"] += self.memory.put(key, value)
+            if self.disk is not None:
+                self.stats["evictions"] += self.disk.put(key, value)
+
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+            if self.disk is not None:
+                self.disk.clear()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
@@ -0,0 +1,351 @@
+"""
+Process-wide gate in front of every chat completion:
+
+- a token-bucket limiter for requests and tokens per minute, so a traffic spike
+  queues here instead of turning into a wall of 429s;
+- retries with jittered exponential backoff (honouring Retry-After) for 429s,
+  timeouts, connection errors and 5xx;
+- single-flight: identical requests already in flight share one API call;
+- optional hedging: after hedge_after_ms a duplicate request is sent, if the
+  limiter can take it without waiting, and the first answer wins. Both
+  requests are billed, so the winner's result carries the other's usage too.
+
+Settings live in DISPATCH_CONFIG (env LLM_RPM, LLM_TPM, LLM_MAX_ATTEMPTS,
+LLM_HEDGE_AFTER_MS); change them with configure_dispatcher().
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from core.metrics import record
+
+DISPATCH_CONFIG = {
+    "rpm": float(os.environ.get("LLM_RPM", 3000)),  # requests per minute, 0 = unlimited
+    "tpm": float(os.environ.get("LLM_TPM", 1000000)),  # tokens per minute, 0 = unlimited
+    "burst_seconds": 1.0,  # bucket capacity, in seconds of rate
+    "max_attempts": int(os.environ.get("LLM_MAX_ATTEMPTS", 4)),
+    "base_delay": 0.5,  # seconds; attempt n waits up to base_delay * 2**n
+    "max_delay": 8.0,
+    "hedge_after_ms": float(os.environ.get("LLM_HEDGE_AFTER_MS", 0)),  # 0 = no hedging
+}
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# Usage fields of a result that add up across the two requests of a hedge
+USAGE_FIELDS = ("tokens_used", "input_tokens", "output_tokens", "cost_usd", "cost_inr")
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    rate units per second, up to capacity banked. reserve() takes the units
+    straight away (the balance may go negative) and returns how long the caller
+    must wait before using them, so callers are served in arrival order.
+    """
+
+    def __init__(self, rate_per_minute, burst_seconds=1.0):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            return -self.level / self.rate if self.level < 0 else 0.0
+
+    def available(self, amount):
+        """Whether amount could be reserved now without waiting."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            level = min(self.capacity, self.level + (time.monotonic() - self.updated) * self.rate)
+            return level >= amount
+
+    def refund(self, amount):
+        if self.rate > 0 and amount:
+            with self._lock:
+                self.level = min(self.capacity, self.level + amount)
+
+
+def _status(error):
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+
+def _retryable(error):
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return _status(error) in RETRY_STATUSES
+
+
+def _hedged_result(winner, loser):
+    """
+    The winner's result with the loser's usage added: its own once it has
+    finished, else the winner's as the estimate (same prompt, same task), since
+    a request that is already sent is billed whether or not it is awaited.
+    """
+    if not isinstance(winner, dict):
+        return winner
+    if loser.done():
+        if loser.cancelled() or loser.exception() is not None:
+            return winner
+        other, estimated = loser.result(), False
+    else:
+        other, estimated = winner, True
+    result = dict(winner, hedged=True, hedge_estimated=estimated)
+    for name in USAGE_FIELDS:
+        if name in winner:
+            result[name] = winner[name] + other.get(name, 0)
+    return result
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class LLMDispatcher:
+    def __init__(self, config=None):
+        self.config = dict(DISPATCH_CONFIG, **(config or {}))
+        self.requests = TokenBucket(self.config["rpm"], self.config["burst_seconds"])
+        self.tokens = TokenBucket(self.config["tpm"], self.config["burst_seconds"])
+        self.stats = {
+            "calls": 0, "api_calls": 0, "retries": 0, "rate_limited": 0, "failures": 0,
+            "coalesced": 0, "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0,
+            "queue_wait_ms": 0.0, "max_queue_wait_ms": 0.0,
+        }
+        self._stats_lock = threading.Lock()
+        self._inflight = {}  # key → Future of the leader's result
+        self._inflight_lock = threading.Lock()
+        self._async_inflight = weakref.WeakKeyDictionary()  # event loop → {key: asyncio.Future}
+        self._hedge_pool = None
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def _reserve(self, est_tokens):
+        """Seconds to wait before the next attempt may be sent."""
+        delay = max(self.requests.reserve(1), self.tokens.reserve(est_tokens))
+        wait_ms = delay * 1000
+        with self._stats_lock:
+            self.stats["api_calls"] += 1
+            self.stats["queue_wait_ms"] += wait_ms
+            self.stats["max_queue_wait_ms"] = max(self.stats["max_queue_wait_ms"], wait_ms)
+        if delay:
+            record("llm_queue", wait_ms)
+        return delay
+
+    def _settle(self, est_tokens, result):
+        # give back what the estimate over-reserved once the real usage is known
+        if isinstance(result, dict) and result.get("tokens_used"):
+            self.tokens.refund(est_tokens - result["tokens_used"])
+
+    def _backoff(self, attempt, error):
+        """Delay before retrying after error, or None to give up."""
+        if attempt + 1 >= self.config["max_attempts"] or not _retryable(error):
+            self._count("failures")
+            return None
+        if _status(error) == 429:
+            self._count("rate_limited")
+        self._count("retries")
+        ceiling = min(self.config["max_delay"], self.config["base_delay"] * 2 ** attempt)
+        delay = random.uniform(0, ceiling)
+        retry_after = _retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def _reserve_hedge(self, est_tokens):
+        """Reserve a hedge request only when it needn't wait: a hedge must not queue ahead of real traffic."""
+        if not (self.requests.available(1) and self.tokens.available(est_tokens)):
+            self._count("hedges_skipped")
+            return False
+        self._reserve(est_tokens)
+        self._count("hedges")
+        return True
+
+    def run(self, fn, est_tokens=0, reserved=False):
+        """fn() behind the limiter, retried on transient errors; reserved=True when the first send is paid for."""
+        attempt = 0
+        while True:
+            delay = 0.0 if reserved else self._reserve(est_tokens)
+            reserved = False
+            if delay:
+                time.sleep(delay)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._backoff(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._settle(est_tokens, result)
+            return result
+
+    def _run_hedged(self, fn, est_tokens):
+        hedge_after = self.config["hedge_after_ms"] / 1000
+        if hedge_after <= 0:
+            return self.run(fn, est_tokens)
+        if self._hedge_pool is None:
+            with self._inflight_lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(32, thread_name_prefix="llm-hedge")
+        first = self._hedge_pool.submit(self.run, fn, est_tokens)
+        try:
+            return first.result(timeout=hedge_after)
+        except FutureTimeout:
+            pass
+        if not self._reserve_hedge(est_tokens):
+            return first.result()
+        second = self._hedge_pool.submit(self.run, fn, est_tokens, True)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedge_wins")
+                    return _hedged_result(future.result(), second if future is first else first)
+                error = future.exception()
+        raise error
+
+    def call(self, key, fn, est_tokens=0):
+        """
+        Returns (result, coalesced). Callers with the same key while one is in
+        flight wait for that call instead of sending their own.
+        """
+        self._count("calls")
+        with self._inflight_lock:
+            leader = self._inflight.get(key)
+            if leader is None:
+                self._inflight[key] = future = Future()
+        if leader is not None:
+            self._count("coalesced")
+            return leader.result(), True
+        try:
+            result = self._run_hedged(fn, est_tokens)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    async def arun(self, fn, est_tokens=0, reserved=False):
+        """Async run(): fn is a coroutine function."""
+        attempt = 0
+        while True:
+            delay = 0.0 if reserved else self._reserve(est_tokens)
+            reserved = False
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = self._backoff(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._settle(est_tokens, result)
+            return result
+
+    async def _arun_hedged(self, fn, est_tokens):
+        hedge_after = self.config["hedge_after_ms"] / 1000
+        if hedge_after <= 0:
+            return await self.arun(fn, est_tokens)
+        first = asyncio.ensure_future(self.arun(fn, est_tokens))
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+        if not self._reserve_hedge(est_tokens):
+            return await first
+        second = asyncio.ensure_future(self.arun(fn, est_tokens, True))
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        self._count("hedge_wins")
+                    result = _hedged_result(task.result(), second if task is first else first)
+                    for other in pending:
+                        other.cancel()
+                    return result
+                error = task.exception()
+        raise error
+
+    async def acall(self, key, fn, est_tokens=0):
+        """Async call(); coalesces within the running event loop."""
+        self._count("calls")
+        inflight = self._async_inflight.setdefault(asyncio.get_running_loop(), {})
+        leader = inflight.get(key)
+        if leader is not None:
+            self._count("coalesced")
+            return await asyncio.shield(leader), True
+        inflight[key] = future = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._arun_hedged(fn, est_tokens)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del inflight[key]
+
+    def report(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["avg_queue_wait_ms"] = round(stats["queue_wait_ms"] / stats["api_calls"], 1) if stats["api_calls"] else 0.0
+        stats["queue_wait_ms"] = round(stats["queue_wait_ms"], 1)
+        stats["max_queue_wait_ms"] = round(stats["max_queue_wait_ms"], 1)
+        return stats
+
+
+def configure_dispatcher(**settings):
+    """Update DISPATCH_CONFIG and start a fresh dispatcher (limits and counters reset)."""
+    unknown = set(settings) - set(DISPATCH_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown dispatcher settings: {sorted(unknown)}")
+    global _dispatcher
+    with _dispatcher_lock:
+        DISPATCH_CONFIG.update(settings)
+        _dispatcher = None
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = LLMDispatcher()
+    return _dispatcher
+
+
+def dispatch_report():
+    return get_dispatcher().report()
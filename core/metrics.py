@@ -0,0 +1,173 @@
+import atexit
+import bisect
+import contextvars
+import math
+import os
+import threading
+import time
+import uuid
+
+from core.utils import ConversationLogger
+
+# Upper bounds (ms) of the stage latency histogram buckets
+BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, math.inf]
+# Span attributes that are summed into per-stage counters
+COUNTED_ATTRS = ("tokens", "cost_inr")
+
+_turn_id = contextvars.ContextVar("turn_id", default=None)
+_lock = threading.Lock()
+_config = {
+    "enabled": os.environ.get("METRICS", "1") != "0",
+    "jsonl_path": os.environ.get("METRICS_JSONL") or None,
+}
+_jsonl = None  # ConversationLogger for jsonl_path, started by the first record()
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS_MS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+_histograms = {}  # stage → _Histogram
+_counters = {}  # (metric, labels tuple) → float
+
+
+def configure_metrics(enabled=True, jsonl_path=None):
+    """Turn aggregation on/off and set (or clear) the JSON-lines span file."""
+    global _jsonl
+    with _lock:
+        _config["enabled"] = enabled
+        _config["jsonl_path"] = jsonl_path
+        previous, _jsonl = _jsonl, None
+    if previous is not None:
+        previous.close()  # writes out what it had queued
+
+
+def reset_metrics():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _count(metric, labels, value=1.0):
+    key = (metric, labels)
+    _counters[key] = _counters.get(key, 0.0) + value
+
+
+def record(stage, ms, **attrs):
+    """Record a finished stage: its wall time plus attributes (tokens, cost_inr, model, cache_hit, ...)."""
+    if not _config["enabled"]:
+        return
+    global _jsonl
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = _Histogram()
+        hist.observe(ms)
+        for name in COUNTED_ATTRS:
+            if attrs.get(name):
+                _count(f"chat_stage_{name}_total", (("stage", stage),), attrs[name])
+        if stage == "llm":
+            _count("chat_llm_calls_total", (("model", str(attrs.get("model"))), ("cache_hit", str(bool(attrs.get("cache_hit"))).lower())))
+        if stage == "turn":
+            _count("chat_turns_total", (("action", str(attrs.get("action"))),))
+        if attrs.get("error"):
+            _count("chat_stage_errors_total", (("stage", stage), ("error", str(attrs["error"]))))
+        if _config["jsonl_path"] and _jsonl is None:
+            _jsonl = ConversationLogger(_config["jsonl_path"], name="metrics-jsonl")
+            atexit.register(_jsonl.close)
+        spans = _jsonl
+
+    # the background writer does the I/O; log() only enqueues
+    if spans is not None:
+        spans.log({"ts": round(time.time(), 3), "turn_id": _turn_id.get(), "stage": stage, "ms": round(ms, 3), **attrs})
+
+
+class Span:
+    """
+    Times a block; attributes can be added with set() while it runs. The wall
+    time is always measured (callers use .ms), but only recorded when metrics
+    are enabled.
+    """
+
+    __slots__ = ("stage", "attrs", "start", "ms")
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+        self.start = 0.0
+        self.ms = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.ms = (time.perf_counter() - self.start) * 1000
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        record(self.stage, self.ms, **self.attrs)
+        return False
+
+
+def span(stage, **attrs):
+    return Span(stage, attrs)
+
+
+def start_turn():
+    """New turn id for the spans recorded in this context (and contexts copied from it)."""
+    turn_id = uuid.uuid4().hex[:12]
+    _turn_id.set(turn_id)
+    return turn_id
+
+
+def _labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+def prometheus_text():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {stage: (list(h.counts), h.total, h.count) for stage, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = [
+        "# HELP chat_stage_duration_ms Wall time of each chat stage.",
+        "# TYPE chat_stage_duration_ms histogram",
+    ]
+    for stage, (counts, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS, counts):
+            cumulative += n
+            le = "+Inf" if bound == math.inf else str(bound)
+            lines.append(f'chat_stage_duration_ms_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'chat_stage_duration_ms_sum{{stage="{stage}"}} {round(total, 3)}')
+        lines.append(f'chat_stage_duration_ms_count{{stage="{stage}"}} {count}')
+
+    for metric in sorted({metric for metric, _ in counters}):
+        lines.append(f"# TYPE {metric} counter")
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f"{metric}{{{_labels(labels)}}} {round(value, 6):g}")
+    return "\n".join(lines) + "\n"
+
+
+def stage_summary():
+    """{stage: {"count", "avg_ms"}} for quick display (e.g. the Streamlit sidebar)."""
+    with _lock:
+        return {
+            stage: {"count": h.count, "avg_ms": round(h.total / h.count, 1) if h.count else 0.0}
+            for stage, h in sorted(_histograms.items())
+        }
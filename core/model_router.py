@@ -0,0 +1,221 @@
+"""
+Picks the model for each LLM call from ROUTING_POLICY and keeps spend in check.
+
+Every action names a preferred model and, optionally, a cheaper fallback:
+
+- the fallback is used once the session or the day has spent downgrade_at of
+  its budget (ROUTER_SESSION_BUDGET_INR / ROUTER_DAILY_BUDGET_INR);
+- it is also used while the preferred model's recent latency for that action
+  is over the action's latency_ms target, with every probe_every-th call still
+  going to the preferred model so it can recover;
+- once a budget is fully spent, an action with no fallback is refused with
+  BudgetExceeded instead of being sent.
+
+routed_call()/routed_stream() wrap call_gpt/stream_gpt with the choice and
+record cost and latency per (action, model); routing_report() summarises them.
+Every action defaults to gpt-4o-mini with no fallback; ROUTING_POLICY_PATH may
+point to a JSON file overriding policy entries, e.g. to upgrade recommend.
+"""
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from core.gpt_handler import COSTS, call_gpt, stream_gpt
+
+ROUTING_POLICY = {
+    "classify": {"model": "gpt-4o-mini", "latency_ms": 1500},
+    "extract": {"model": "gpt-4o-mini", "latency_ms": 2000},
+    "understand": {"model": "gpt-4o-mini", "latency_ms": 2500},
+    "ask_info": {"model": "gpt-4o-mini", "latency_ms": 2500},
+    # a bigger model here is opt-in through ROUTING_POLICY_PATH, e.g.
+    # {"recommend": {"model": "gpt-4o", "fallback": "gpt-4o-mini"}}
+    "recommend": {"model": "gpt-4o-mini", "latency_ms": 6000},
+    "compare": {"model": "gpt-4o-mini", "latency_ms": 6000},
+    "answer": {"model": "gpt-4o-mini", "latency_ms": 4000},
+}
+ROUTER_CONFIG = {
+    "session_budget_inr": float(os.environ.get("ROUTER_SESSION_BUDGET_INR", 5.0)),
+    "daily_budget_inr": float(os.environ.get("ROUTER_DAILY_BUDGET_INR", 2000.0)),
+    "downgrade_at": 0.8,  # share of a budget spent before switching to the fallback
+    "latency_alpha": 0.2,  # weight of the newest call in the moving latency average
+    "probe_every": 20,
+}
+LATENCY_SAMPLES = 500  # per (action, model), for the report percentiles
+
+_session_cost = contextvars.ContextVar("session_cost_inr", default=0.0)
+_lock = threading.Lock()
+_stats = {}  # (action, model) → {"calls", "tokens", "cost_inr", "latencies"}
+_latency_ewma = {}  # (action, model) → ms
+_downgrades = {}  # (action, reason) → count
+_latency_skips = {}  # action → calls sent to the fallback for latency
+_refusals = {}  # (action, reason) → calls refused with BudgetExceeded
+_daily = {"date": None, "cost_inr": 0.0}
+
+
+class BudgetExceeded(RuntimeError):
+    """The session or daily budget is spent and the action has no cheaper model to fall back to."""
+
+    def __init__(self, action, reason):
+        super().__init__(f"{action}: {reason.replace('_', ' ')} exhausted")
+        self.action = action
+        self.reason = reason
+
+
+def _load_policy_overrides():
+    path = os.environ.get("ROUTING_POLICY_PATH")
+    if path:
+        with open(path) as f:
+            configure_router(policy=json.load(f))
+
+
+def configure_router(policy=None, **settings):
+    """Merge policy entries into ROUTING_POLICY and update ROUTER_CONFIG."""
+    unknown = set(settings) - set(ROUTER_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown router settings: {sorted(unknown)}")
+    for action, entry in (policy or {}).items():
+        for model in (entry.get("model"), entry.get("fallback")):
+            if model is not None and model not in COSTS:
+                raise ValueError(f"{action}: unsupported model {model}")
+    with _lock:
+        for action, entry in (policy or {}).items():
+            ROUTING_POLICY[action] = dict(ROUTING_POLICY.get(action, {}), **entry)
+        ROUTER_CONFIG.update(settings)
+
+
+def reset_router_stats():
+    with _lock:
+        _stats.clear()
+        _latency_ewma.clear()
+        _downgrades.clear()
+        _latency_skips.clear()
+        _refusals.clear()
+        _daily.update(date=None, cost_inr=0.0)
+
+
+def begin_turn(session_cost_inr):
+    """Tell the router what this session has spent so far (for this context and copies of it)."""
+    _session_cost.set(session_cost_inr)
+
+
+def _daily_spend():
+    today = datetime.date.today()
+    if _daily["date"] != today:
+        _daily.update(date=today, cost_inr=0.0)
+    return _daily["cost_inr"]
+
+
+def _budget_used(share):
+    """The budget ("session_budget", then "daily_budget") with at least share of it spent; call with _lock held."""
+    config = ROUTER_CONFIG
+    if _session_cost.get() >= config["session_budget_inr"] * share:
+        return "session_budget"
+    if _daily_spend() >= config["daily_budget_inr"] * share:
+        return "daily_budget"
+    return None
+
+
+def choose_model(action):
+    """
+    (model, reason) for an action; reason is None unless the call was downgraded.
+    Raises BudgetExceeded when a budget is spent and there is no fallback.
+    """
+    policy = ROUTING_POLICY[action]
+    preferred, fallback = policy["model"], policy.get("fallback")
+    config = ROUTER_CONFIG
+    with _lock:
+        if fallback is None:
+            exhausted = _budget_used(1.0)
+            if exhausted is None:
+                return preferred, None
+            _refusals[(action, exhausted)] = _refusals.get((action, exhausted), 0) + 1
+            raise BudgetExceeded(action, exhausted)
+        reason = _budget_used(config["downgrade_at"])
+        if reason is None and _latency_ewma.get((action, preferred), 0.0) > policy.get("latency_ms", float("inf")):
+            reason = "latency"
+            _latency_skips[action] = skips = _latency_skips.get(action, 0) + 1
+            # a periodic probe keeps the preferred model's latency estimate current
+            if skips % config["probe_every"] == 0:
+                return preferred, None
+        if reason is None:
+            return preferred, None
+        _downgrades[(action, reason)] = _downgrades.get((action, reason), 0) + 1
+    return fallback, reason
+
+
+def record_usage(action, model, result, ms):
+    """Add one finished call to the per (action, model) stats and the day's spend."""
+    key = (action, model)
+    with _lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = {"calls": 0, "tokens": 0, "cost_inr": 0.0,
+                                   "latencies": deque(maxlen=LATENCY_SAMPLES)}
+        stats["calls"] += 1
+        stats["tokens"] += result["tokens_used"]
+        stats["cost_inr"] += result["cost_inr"]
+        _daily_spend()
+        _daily["cost_inr"] += result["cost_inr"]
+        # cache hits and coalesced answers say nothing about the model's latency
+        if result["tokens_used"]:
+            stats["latencies"].append(ms)
+            alpha = ROUTER_CONFIG["latency_alpha"]
+            previous = _latency_ewma.get(key)
+            _latency_ewma[key] = ms if previous is None else alpha * ms + (1 - alpha) * previous
+
+
+def routed_call(action, messages, model=None, **kwargs):
+    """call_gpt with the model chosen for action (unless model is given); the result names the model."""
+    model = model or choose_model(action)[0]
+    start = time.perf_counter()
+    result = call_gpt(messages, model=model, **kwargs)
+    record_usage(action, model, result, (time.perf_counter() - start) * 1000)
+    return dict(result, model=model)
+
+
+def routed_stream(action, messages, on_complete=None, model=None, **kwargs):
+    """stream_gpt with the routed model; usage is recorded when the stream finishes."""
+    model = model or choose_model(action)[0]
+
+    def finished(result):
+        result["model"] = model
+        record_usage(action, model, result, result["stream_ms"])
+        if on_complete is not None:
+            on_complete(result)
+
+    return stream_gpt(messages, model=model, on_complete=finished, **kwargs)
+
+
+def routing_report():
+    """Calls, tokens, cost and latency per action and model, plus budget use and downgrades."""
+    with _lock:
+        rows = {key: (dict(s), list(s["latencies"])) for key, s in _stats.items()}
+        downgrades = dict(_downgrades)
+        refusals = dict(_refusals)
+        spent = _daily_spend()
+    by_action = {}
+    for (action, model), (stats, latencies) in sorted(rows.items()):
+        by_action.setdefault(action, {})[model] = {
+            "calls": stats["calls"],
+            "tokens": stats["tokens"],
+            "cost_inr": round(stats["cost_inr"], 4),
+            "avg_cost_inr": round(stats["cost_inr"] / stats["calls"], 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1) if latencies else None,
+            "p95_ms": round(float(np.percentile(latencies, 95)), 1) if latencies else None,
+        }
+    return {
+        "daily_spend_inr": round(spent, 4),
+        "daily_budget_inr": ROUTER_CONFIG["daily_budget_inr"],
+        "by_action": by_action,
+        "downgrades": {f"{action}:{reason}": n for (action, reason), n in sorted(downgrades.items())},
+        "refusals": {f"{action}:{reason}": n for (action, reason), n in sorted(refusals.items())},
+    }
+
+
+_load_policy_overrides()
@@ -0,0 +1,148 @@
+import os
+import threading
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREMIUM_PATH = os.path.join(BASE_DIR, "data", "premium_table.csv")
+
+# Floater premium = eldest member's premium x loading for the family size.
+# Assumed, not from the table or any insurer's filing: floater figures are only
+# ever shown as estimates.
+FLOATER_LOADING = np.array([0.0, 1.0, 1.45, 1.65, 1.8, 1.95, 2.1, 2.25], dtype=np.float64)
+
+# Sum insured (in lakh) suggested per city tier before adjustments
+BASE_SUM_INSURED = {"Tier 1": 20, "Tier 2": 10, "Tier 3": 10}
+SENIOR_AGE = 60
+
+
+def _lakh(label):
+    label = label.strip()
+    if label.endswith("Cr"):
+        return int(float(label[:-2]) * 100)
+    return int(float(label.rstrip("L")))
+
+
+class PremiumTable:
+    """
+    Annual premiums as a contiguous (ages, sums insured) float64 array. Row i is
+    age min_age + i; ages outside the table are priced at its nearest edge.
+    """
+
+    def __init__(self, ages, sums_insured, premiums):
+        ages = np.asarray(ages, dtype=np.int64)
+        if not np.array_equal(ages, np.arange(ages[0], ages[0] + len(ages))):
+            raise ValueError("premium table ages must be consecutive")
+        self.min_age = int(ages[0])
+        self.max_age = int(ages[-1])
+        self.sums_insured = list(sums_insured)  # lakh
+        self.premiums = np.ascontiguousarray(premiums, dtype=np.float64)
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or PREMIUM_PATH
+        with open(path) as f:
+            header = f.readline().strip().split(",")
+        data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        return cls(data[:, 0], [_lakh(label) for label in header[1:]], data[:, 1:])
+
+    def label(self, lakh):
+        return f"{lakh // 100}Cr" if lakh >= 100 else f"{lakh}L"
+
+    def age_premiums(self, ages):
+        """Premium rows for an array of ages: shape ages.shape + (n_sums_insured,)."""
+        rows = np.clip(np.asarray(ages, dtype=np.int64), self.min_age, self.max_age) - self.min_age
+        return self.premiums[rows]
+
+    def quote_batch(self, ages):
+        """
+        Price many profiles at once. ages is an (n_profiles, max_members) array
+        padded with -1. Returns (individual, floater), each (n_profiles, n_sums_insured):
+        the sum of the members' own premiums, and the family floater premium.
+        """
+        ages = np.atleast_2d(np.asarray(ages, dtype=np.int64))
+        present = ages >= 0
+        per_member = self.age_premiums(ages) * present[..., None]
+        individual = per_member.sum(axis=1)
+        counts = np.minimum(present.sum(axis=1), len(FLOATER_LOADING) - 1)
+        floater = per_member.max(axis=1) * FLOATER_LOADING[counts][:, None]
+        return individual, floater
+
+    def quote(self, ages):
+        """Individual vs floater premium of one profile at every sum insured."""
+        ages = [int(a) for a in ages]
+        individual, floater = self.quote_batch(np.array([ages or [-1]]))
+        return [
+            {
+                "sum_insured": self.label(lakh),
+                "individual": round(float(individual[0, i])),
+                "floater": round(float(floater[0, i])),
+            }
+            for i, lakh in enumerate(self.sums_insured)
+        ]
+
+
+def member_ages(profile):
+    return [m["age"] for m in profile.get("members", []) if isinstance(m.get("age"), int)]
+
+
+def suggest_cover(profile, table):
+    """
+    Deterministic sum insured and term for a profile: the tier's base cover, one
+    step up for a family of 3+, for anyone 45 or older and for pre-existing
+    conditions; a 3-year term unless someone is a senior citizen.
+    """
+    ages = member_ages(profile)
+    base = BASE_SUM_INSURED.get(profile.get("location"), 10)
+    step = table.sums_insured.index(base) if base in table.sums_insured else 0
+    step += len(ages) >= 3
+    step += any(age >= 45 for age in ages)
+    step += bool(profile.get("ped_conditions"))
+    sum_insured = table.sums_insured[min(step, len(table.sums_insured) - 1)]
+    # seniors' premiums are reviewed yearly, so don't lock them in
+    term = 1 if any(age >= SENIOR_AGE for age in ages) else 3
+    return sum_insured, term
+
+
+def premium_facts(profile, table=None):
+    """
+    Quote lines for the recommend prompt: suggested SI and term, the table
+    premium at that SI (per member summed, for a family) and, for a family, an
+    estimated floater premium labelled as such. Empty when no member has an age.
+    """
+    table = table or get_table()
+    ages = member_ages(profile)
+    if not ages:
+        return []
+    sum_insured, term = suggest_cover(profile, table)
+    quote = table.quote(ages)[table.sums_insured.index(sum_insured)]
+    facts = [f"Suggested Sum Insured: {quote['sum_insured']} for {len(ages)} member(s)"]
+    if len(ages) > 1:
+        facts.append(
+            f"Annual premium at {quote['sum_insured']} from the premium table: ₹{quote['individual']:,} "
+            f"as individual policies (each member's table premium, summed)"
+        )
+        facts.append(
+            f"A family floater is not in the premium table; rough estimate ₹{quote['floater']:,} a year "
+            f"(assumed loading, must be called an estimate and confirmed with the insurer)"
+        )
+    else:
+        facts.append(f"Annual premium at {quote['sum_insured']} from the premium table: ₹{quote['individual']:,}")
+    if term > 1:
+        facts.append(f"Suggested term: {term} years (multi-year discounts vary by insurer, no figure available)")
+    else:
+        facts.append("Suggested term: 1 year (senior member, renew annually)")
+    return facts
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table():
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = PremiumTable.load()
+    return _table
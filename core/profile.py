@@ -0,0 +1,129 @@
+from core.scoring import pack_flags, profile_flags
+
+ADULT_AGE = 18
+# Relations a family can have several of
+CHILDREN = {"son", "daughter", "child"}
+
+
+class Profile:
+    """
+    Immutable user profile: gender, location, members as (relation, ages)
+    pairs (one per relation, with an age per member, so two sons are
+    ("son", (5, 3))) and ped_conditions. Hashable, so it can key caches;
+    .key is the bit-packed PROFILE_FLAGS encoding the scoring index uses.
+
+    The session and the UI keep plain dicts; convert with from_dict/to_dict.
+    """
+
+    __slots__ = ("gender", "location", "members", "ped_conditions", "_key", "_hash")
+
+    def __init__(self, gender=None, location=None, members=(), ped_conditions=()):
+        set_ = object.__setattr__
+        set_(self, "gender", gender)
+        set_(self, "location", location)
+        set_(self, "members", tuple(members))
+        set_(self, "ped_conditions", tuple(ped_conditions))
+        set_(self, "_key", None)
+        set_(self, "_hash", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Profile is immutable; use merge()")
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, Profile):
+            return data
+        data = data or {}
+        members = {}
+        for m in data.get("members") or []:
+            members[m["relation"]] = members.get(m["relation"], ()) + (m.get("age"),)
+        return cls(data.get("gender"), data.get("location"), members.items(), data.get("ped_conditions") or ())
+
+    def to_dict(self):
+        return {
+            "gender": self.gender,
+            "location": self.location,
+            "members": [{"relation": relation, "age": age} for relation, ages in self.members for age in ages],
+            "ped_conditions": list(self.ped_conditions),
+        }
+
+    def _fields(self):
+        return (self.gender, self.location, self.members, self.ped_conditions)
+
+    def __eq__(self, other):
+        return isinstance(other, Profile) and self._fields() == other._fields()
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash(self._fields()))
+        return self._hash
+
+    def __repr__(self):
+        return f"Profile({self.to_dict()})"
+
+    @property
+    def key(self):
+        """PROFILE_FLAGS bitmask, computed once."""
+        if self._key is None:
+            object.__setattr__(self, "_key", pack_flags(profile_flags(self.to_dict())))
+        return self._key
+
+    def ages_of(self, relation):
+        for r, ages in self.members:
+            if r == relation:
+                return ages
+        return ()
+
+    def age_of(self, relation):
+        """Age of the first member with this relation (for "self", the user)."""
+        ages = self.ages_of(relation)
+        return ages[0] if ages else None
+
+    def merge(self, new_info):
+        """
+        New profile with new_info (a dict or Profile) layered on top: set
+        gender/location replace ours, members are merged per relation. A
+        list at least as long as ours is the whole relation, matched by
+        position, and a member given without an age keeps our age for that
+        position. A shorter list of children ("another son aged 2") adds the
+        ages we don't have yet; for anyone else it replaces ours.
+        """
+        new = Profile.from_dict(new_info)
+        members = dict(self.members)
+        for relation, ages in new.members:
+            old = members.get(relation, ())
+            if len(ages) < len(old) and relation in CHILDREN:
+                members[relation] = old + tuple(age for age in ages if age is not None and age not in old)
+                continue
+            if len(ages) <= len(old) and all(age is None for age in ages):
+                continue
+            members[relation] = tuple(
+                old[i] if age is None and i < len(old) else age for i, age in enumerate(ages)
+            )
+        merged = Profile(
+            new.gender or self.gender,
+            new.location or self.location,
+            members.items(),
+            new.ped_conditions or self.ped_conditions,
+        )
+        return self if merged == self else merged
+
+    def diff(self, other):
+        """Names of the fields that differ from other."""
+        other = Profile.from_dict(other)
+        names = ("gender", "location", "members", "ped_conditions")
+        return {name for name, a, b in zip(names, self._fields(), other._fields()) if a != b}
+
+    def missing_fields(self):
+        missing = []
+        if not isinstance(self.age_of("self"), int):
+            missing.append("age")
+        if not self.gender:
+            missing.append("gender")
+        if not self.location:
+            missing.append("location")
+        return missing
+
+    def is_complete(self):
+        age = self.age_of("self")
+        return isinstance(age, int) and age >= ADULT_AGE and self.gender is not None and self.location is not None
@@ -1,6 +1,51 @@
-from core.gpt_handler import call_gpt
+import json
+import re
+import threading
 
-def gpt_profile_extractor(user_input: str, model="gpt-4o-mini") -> dict:
+from core.llm_cache import LRUCache
+from core.model_router import routed_call
+from core.profile import Profile
+from core.rule_parser import profile_cues
+
+PROFILE_FIELDS = ("gender", "location", "members")
+# Extractions keyed by normalized message and requested fields
+_cache = LRUCache(4096)
+_cache_lock = threading.Lock()
+_NORMALIZE_RE = re.compile(r"[^a-z0-9]+")
+
+
+def clear_extraction_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def normalize_message(user_input):
+    return _NORMALIZE_RE.sub(" ", user_input.lower()).strip()
+
+
+def extraction_fields(user_input, profile, intent=None):
+    """
+    Profile fields worth an extraction call for this message; empty when the
+    call can be skipped. Fields the message hints at are always included (a
+    changed age or city), plus the ones still missing when the message has any
+    profile signal or the intent is profile_info.
+    """
+    cued = profile_cues(user_input)
+    if not cued and intent != "profile_info":
+        return []
+    missing = {"members" if field == "age" else field for field in Profile.from_dict(profile).missing_fields()}
+    return sorted(cued | missing)
+
+
+def _skipped_response():
+    return {"output": "", "tokens_used": 0, "input_tokens": 0, "output_tokens": 0,
+            "cost_usd": 0.0, "cost_inr": 0.0, "cache_hit": True}
+
+
+def gpt_profile_extractor(user_input: str, model=None, with_usage=False, fields=None):
+    only = ""
+    if fields is not None:
+        only = f"\n    Only extract these fields: {', '.join(fields)}. Leave the others null (members: [])."
     system_prompt = """
     You are a profile extraction engine for a health insurance chatbot.
     Extract structured data from the user's message in the following JSON format:
@@ -19,24 +64,36 @@ def gpt_profile_extractor(user_input: str, model="gpt-4o-mini") -> dict:
     - Do NOT assume gender or location. If not clearly mentioned, set them to null.
     - Age must be a number. If unclear, skip the member.
     - If a person is mentioned but no relation is stated, default to "self".
-    - Never guess or hallucinate values.
+    - Never guess or hallucinate values.""" + only + """
 
     Only return valid JSON. No explanations or extra text.
     """
 
+    key = (normalize_message(user_input), tuple(fields) if fields is not None else None, model)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None:
+        extracted, response = dict(cached), _skipped_response()
+    else:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_input}
+        ]
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_input}
-    ]
-
-    response = call_gpt(messages, model=model, temperature=0)
-    raw_output = response["output"]
+        response = routed_call("extract", messages, model=model, temperature=0)
+        raw_output = response["output"]
 
-    try:
-        import json
-        extracted = json.loads(raw_output)
-    except Exception:
-        extracted = {}
+        try:
+            extracted = json.loads(raw_output)
+        except Exception:
+            extracted = {}
+        if fields is not None and isinstance(extracted, dict):
+            # a field we didn't ask about must not overwrite what the profile already has
+            extracted = {name: value for name, value in extracted.items() if name in fields}
+        if extracted:
+            with _cache_lock:
+                _cache.put(key, dict(extracted))
 
+    if with_usage:
+        return extracted, response
     return extracted
@@ -0,0 +1,137 @@
+import re
+import textwrap
+import threading
+
+# Estimated prompt tokens (system + user message) allowed per action
+PROMPT_BUDGETS = {
+    "recommend": 450,
+    "compare": 450,
+}
+MAX_PLANS = 3
+# Enough to pick out a plan's distinguishing benefits without listing all of them
+MAX_NEEDS_PER_PLAN = 6
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+RECOMMEND_INSTRUCTIONS = textwrap.dedent("""
+    You are an insurance advisor. Using the plan table below, write:
+    1. A clear recommendation (~150 words) of the single best plan: why it fits the user's
+       attributes and needs, with a Sum Insured, term and premium (take them from the quote
+       facts when given; quote no other rupee figures and present estimates as estimates).
+    2. The next 2 best alternatives, briefly.
+    3. A Markdown table of the listed plans: Plan Name | Score | Key Benefits (from their needs).
+    4. A short, friendly follow-up question nudging the user to connect with an expert,
+       request a callback, or explore premium details.
+""").strip()
+
+COMPARE_INSTRUCTIONS = textwrap.dedent("""
+    You are an insurance advisor. Compare the plans in the table below:
+    1. A Markdown table: Plan Name | Score | Key Benefits (from their needs) | Riders (if applicable)
+       | Waiting Periods / Limitations (if known).
+    2. 3-4 bullet points on the main differences (coverage, riders, exclusions, limits).
+    3. A short, conversational follow-up question nudging the user to explore premiums,
+       request a callback, or connect with an expert.
+""").strip()
+
+INSTRUCTIONS = {
+    "recommend": RECOMMEND_INSTRUCTIONS,
+    "compare": COMPARE_INSTRUCTIONS,
+}
+
+
+def estimate_tokens(text):
+    """
+    Rough local token count: one per word or punctuation mark, plus one for every
+    further 4 characters of a long word. Good enough for budgeting; billing
+    still uses the usage the API reports.
+    """
+    return sum(1 + (len(piece) - 1) // 4 for piece in _PIECE_RE.findall(text))
+
+
+def plan_rows(recom_resp, max_plans=MAX_PLANS, max_needs=MAX_NEEDS_PER_PLAN):
+    """(plan, score, needs) for the top plans, each plan's needs capped at max_needs."""
+    needs = recom_resp.get("needs", {})
+    return [
+        (plan, score, list(needs.get(plan, []))[:max_needs])
+        for plan, score in recom_resp.get("top_plans", [])[:max_plans]
+    ]
+
+
+def encode_table(rows, user_attributes):
+    # pipe table: the column names are stated once instead of repeated per plan
+    lines = [f"User attributes: {', '.join(user_attributes) or 'none'}", "plan|score|needs"]
+    for plan, score, needs in rows:
+        lines.append(f"{plan}|{score:.2f}|{'; '.join(needs) or '-'}")
+    return "\n".join(lines)
+
+
+def _fit(instructions, rows, user_attributes, facts, budget):
+    # trim needs from the longest list first, then drop the lowest-ranked plan
+    rows = [(plan, score, list(needs)) for plan, score, needs in rows]
+    tail = "".join(f"\n- {fact}" for fact in facts)
+    if tail:
+        tail = "\n\nQuote facts:" + tail
+    while True:
+        prompt = f"{instructions}\n\n{encode_table(rows, user_attributes)}{tail}"
+        tokens = estimate_tokens(prompt)
+        if tokens <= budget or not rows:
+            return prompt, tokens, rows
+        longest = max(range(len(rows)), key=lambda i: len(rows[i][2]))
+        if len(rows[longest][2]) > 1:
+            rows[longest][2].pop()
+        elif len(rows) > 1:
+            rows.pop()
+        else:
+            return prompt, tokens, rows
+
+
+# Running prompt-size statistics per action for prompt_report()
+_stats_lock = threading.Lock()
+PROMPT_STATS = {}
+
+
+def build_plan_prompt(action, recom_resp, user_input, budget=None, facts=None):
+    """
+    System + user messages for a recommend/compare turn, kept within the
+    action's token budget. facts (e.g. premium quotes) are always kept.
+    Returns (messages, info) where info has the estimated tokens, the budget
+    and how many plans/needs made it in.
+    """
+    if action not in INSTRUCTIONS:
+        raise ValueError(f"No plan prompt for action: {action}")
+    budget = budget or PROMPT_BUDGETS[action]
+
+    user_prompt = f"User intent: {action}. Question: {user_input}"
+    user_tokens = estimate_tokens(user_prompt)
+    rows = plan_rows(recom_resp)
+    system_prompt, tokens, rows = _fit(
+        INSTRUCTIONS[action], rows, recom_resp.get("user_attributes") or [], facts or [], budget - user_tokens
+    )
+    tokens += user_tokens
+
+    info = {
+        "action": action,
+        "prompt_tokens_est": tokens,
+        "budget": budget,
+        "plans": len(rows),
+        "needs": sum(len(needs) for _, _, needs in rows),
+    }
+    with _stats_lock:
+        stats = PROMPT_STATS.setdefault(action, {"calls": 0, "tokens": 0, "over_budget": 0})
+        stats["calls"] += 1
+        stats["tokens"] += tokens
+        stats["over_budget"] += tokens > budget
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    return messages, info
+
+
+def prompt_report():
+    with _stats_lock:
+        return {
+            action: dict(stats, avg_tokens=round(stats["tokens"] / stats["calls"], 1))
+            for action, stats in PROMPT_STATS.items()
+        }
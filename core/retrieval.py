@@ -0,0 +1,254 @@
+import os
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+
+from core.chunk_store import ChunkStore, dictionary_encode, open_chunk_store
+from core.llm_cache import LRUCache
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_PATH = os.path.join(BASE_DIR, "data", "kb.index")
+STORE_PATH = os.path.join(BASE_DIR, "data", "kb_chunks.cols")
+
+# The model the KB vectors were built with, unless data/kb_manifest.json names another
+KB_EMBEDDING_MODEL = os.environ.get("KB_EMBEDDING_MODEL", "text-embedding-3-small")
+
+FILTER_FIELDS = ["policy", "insurer", "variant", "section"]
+
+METRIC_INNER_PRODUCT = 0
+METRIC_L2 = 1
+# fourcc → metric for the flat FAISS indexes we can read without faiss
+_FLAT_INDEXES = {b"IxFI": METRIC_INNER_PRODUCT, b"IxF2": METRIC_L2}
+_HEADER = struct.Struct("<4siqqq?i")  # fourcc, d, ntotal, dummy, dummy, is_trained, metric
+
+
+def read_flat_index(path):
+    """
+    Memory-map the vector block of a FAISS IndexFlat file.
+    Returns (vectors, metric) with vectors as a read-only (ntotal, d) float32 array.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size + 8)
+    fourcc, d, ntotal, _, _, _, metric = _HEADER.unpack_from(header)
+    if fourcc not in _FLAT_INDEXES:
+        raise ValueError(f"{path}: unsupported index type {fourcc!r}, expected a flat index")
+    (n_codes,) = struct.unpack_from("<Q", header, _HEADER.size)
+    # older faiss counts float32s here, newer versions count bytes
+    if n_codes not in (ntotal * d, ntotal * d * 4):
+        raise ValueError(f"{path}: vector block size {n_codes} does not match {ntotal} x {d}")
+    vectors = np.memmap(path, dtype=np.float32, mode="r", offset=_HEADER.size + 8, shape=(ntotal, d))
+    return vectors, metric
+
+
+def write_flat_index(path, vectors, metric=METRIC_L2):
+    """Write vectors as a FAISS IndexFlat file (IndexFlatL2 or IndexFlatIP) that faiss and read_flat_index can load."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, d = vectors.shape
+    fourcc = {metric: fourcc for fourcc, metric in _FLAT_INDEXES.items()}[metric]
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(fourcc, d, ntotal, 1 << 20, 1 << 20, True, metric))
+        f.write(struct.pack("<Q", ntotal * d))  # faiss counts float32s here
+        f.write(vectors.tobytes())
+
+
+class RetrievalEngine:
+    """
+    Exact top-k search over the KB vectors with a single matrix product.
+
+    Metadata filters compare dictionary-encoded columns (a small integer per
+    row and field), so a filtered search only adds a few vectorised ops.
+    Query embeddings go through an LRU so repeated questions skip the embedder.
+    """
+
+    def __init__(self, vectors, chunks, metric=METRIC_INNER_PRODUCT, embedder=None, query_cache_size=1024,
+                 keyword_index=None):
+        if len(vectors) != len(chunks):
+            raise ValueError(f"{len(vectors)} vectors but {len(chunks)} chunks")
+        self.vectors = vectors
+        self.chunks = chunks
+        self.metric = metric
+        self.embedder = embedder
+        # ||x||² for L2, where the score is -||q - x||² = 2 q·x - ||x||² - ||q||²
+        self._sq_norms = np.einsum("ij,ij->i", vectors, vectors) if metric == METRIC_L2 else None
+        # per filter field: its distinct values and one code per row
+        if isinstance(chunks, ChunkStore):
+            self._columns = {field: (chunks.values(field), chunks.codes(field)) for field in FILTER_FIELDS}
+        else:
+            self._columns = {field: dictionary_encode([c.get(field) for c in chunks]) for field in FILTER_FIELDS}
+        self.keyword_index = keyword_index
+        if keyword_index is not None:
+            ids = chunks.strings("id") if isinstance(chunks, ChunkStore) else [chunk["id"] for chunk in chunks]
+            row_of = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            missing = [doc_id for doc_id in keyword_index.doc_ids if doc_id not in row_of]
+            if missing:
+                raise ValueError(f"keyword index has chunks the vectors don't: {missing[:5]}")
+            self._keyword_rows = np.array([row_of[doc_id] for doc_id in keyword_index.doc_ids], dtype=np.int64)
+        self._query_cache = LRUCache(query_cache_size)
+        self._cache_lock = threading.Lock()
+        self.stats = {"queries": 0, "embed_cache_hits": 0, "search_ms": 0.0}
+
+    @classmethod
+    def from_files(cls, store_path=None, embedder=None, keyword_index=None):
+        """Engine over a chunk store (data/kb_chunks.cols), memory-mapped rather than read."""
+        store = open_chunk_store(store_path or STORE_PATH)
+        return cls(store.vectors, store, metric=store.metric, embedder=embedder, keyword_index=keyword_index)
+
+    def values(self, field):
+        return sorted(v for v in self._columns[field][0] if v is not None)
+
+    def mentioned(self, field, text):
+        """Values of a filter field (e.g. policy names) that appear in text as whole words."""
+        lowered = text.lower()
+        # lookarounds rather than \b so values ending in punctuation ("Gold+") still match
+        return [v for v in self.values(field) if re.search(rf"(?<!\w){re.escape(v.lower())}(?!\w)", lowered)]
+
+    def filter_mask(self, **filters):
+        """AND across fields, OR within a field: filter_mask(policy=["Care", "Aspire"], section="exclusions")."""
+        mask = None
+        for field, wanted in filters.items():
+            if wanted is None:
+                continue
+            if field not in self._columns:
+                raise ValueError(f"Unknown filter field: {field}")
+            if isinstance(wanted, str):
+                wanted = [wanted]
+            values, codes = self._columns[field]
+            field_mask = np.isin(codes, [code for code, value in enumerate(values) if value in wanted])
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
+
+    def embed(self, texts):
+        vectors = [None] * len(texts)
+        missing = []
+        with self._cache_lock:
+            for i, text in enumerate(texts):
+                vectors[i] = self._query_cache.get(text)
+                if vectors[i] is None:
+                    missing.append(i)
+            self.stats["embed_cache_hits"] += len(texts) - len(missing)
+        if missing:
+            if self.embedder is None:
+                raise RuntimeError("RetrievalEngine has no embedder; pass query vectors to search()")
+            fresh = np.asarray(self.embedder([texts[i] for i in missing]), dtype=np.float32)
+            with self._cache_lock:
+                for i, vector in zip(missing, fresh):
+                    vectors[i] = vector
+                    self._query_cache.put(texts[i], vector)
+        return np.vstack(vectors)
+
+    def search(self, queries, k=5, **filters):
+        """
+        Batched top-k for a (m, d) array of query vectors (or one (d,) vector).
+        Returns one list per query of {"score", "chunk"} dicts, best first;
+        score is the inner product, or the negated squared distance for L2.
+        """
+        start = time.perf_counter()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        # vectors @ q.T keeps the big operand contiguous (q @ vectors.T is ~3x slower)
+        scores = (self.vectors @ queries.T).T
+        if self.metric == METRIC_L2:
+            scores = 2 * scores - self._sq_norms - np.einsum("ij,ij->i", queries, queries)[:, None]
+
+        mask = self.filter_mask(**filters)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, int(mask.sum()))
+        k = min(k, scores.shape[1])
+
+        results = []
+        if k <= 0:
+            results = [[] for _ in range(len(queries))]
+        else:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for row, candidates in enumerate(top):
+                order = candidates[np.argsort(-scores[row, candidates])]
+                results.append([{"score": float(scores[row, i]), "chunk": self.chunks[i]} for i in order])
+
+        self.stats["queries"] += len(queries)
+        self.stats["search_ms"] += (time.perf_counter() - start) * 1000
+        return results
+
+    def search_text(self, texts, k=5, **filters):
+        if isinstance(texts, str):
+            return self.search(self.embed([texts]), k, **filters)[0]
+        return self.search(self.embed(list(texts)), k, **filters)
+
+    def keyword_scores(self, text):
+        """BM25 scores in engine row order."""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        scores[self._keyword_rows] = self.keyword_index.scores(text)
+        return scores
+
+    def hybrid_search(self, text, k=5, candidates=50, rrf_k=60, **filters):
+        """
+        Top-k by reciprocal rank fusion of the vector and BM25 rankings:
+        score = sum over rankings of 1 / (rrf_k + rank). Either side may be
+        missing (no embedder / no keyword index) and the other is used alone.
+        """
+        start = time.perf_counter()
+        mask = self.filter_mask(**filters)
+        rankings = {}
+        if self.embedder is not None:
+            vector = self.embed([text])[0]
+            scores = (self.vectors @ vector).astype(np.float32)
+            if self.metric == METRIC_L2:
+                scores = 2 * scores - self._sq_norms - float(vector @ vector)
+            rankings["vector"] = scores
+        if self.keyword_index is not None:
+            scores = self.keyword_scores(text)
+            scores[scores <= 0] = -np.inf  # no shared terms: not a keyword match
+            rankings["bm25"] = scores
+
+        fused = np.zeros(len(self.chunks), dtype=np.float64)
+        ranks = {}
+        for name, scores in rankings.items():
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+            n = min(candidates, int(np.isfinite(scores).sum()))
+            if n <= 0:
+                continue
+            top = np.argpartition(-scores, n - 1)[:n]
+            top = top[np.argsort(-scores[top])]
+            fused[top] += 1.0 / (rrf_k + np.arange(1, n + 1))
+            ranks[name] = {int(row): rank for rank, row in enumerate(top, start=1)}
+
+        hits = np.flatnonzero(fused)
+        hits = hits[np.argsort(-fused[hits], kind="stable")][:k]
+        results = [
+            {
+                "score": float(fused[i]),
+                "vector_rank": ranks.get("vector", {}).get(int(i)),
+                "bm25_rank": ranks.get("bm25", {}).get(int(i)),
+                "chunk": self.chunks[i],
+            }
+            for i in hits
+        ]
+        self.stats["queries"] += 1
+        self.stats["search_ms"] += (time.perf_counter() - start) * 1000
+        return results
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Process-wide engine over data/kb.index plus the BM25 index of kb.json,
+    embedding queries with the embedder the index was built with.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                from core.kb_build import kb_embedder
+                from core.keyword_index import load_or_build
+
+                _engine = RetrievalEngine.from_files(
+                    embedder=kb_embedder(),
+                    keyword_index=load_or_build(),
+                )
+    return _engine
@@ -0,0 +1,209 @@
+import re
+import threading
+
+from core.profile import CHILDREN
+
+# Lexicons for the turns we can understand without an LLM
+GREETINGS = {"hi", "hii", "hello", "hey", "hiya", "namaste", "greetings", "morning", "afternoon", "evening"}
+# Only words that are a yes on their own; "it", "do", "go", "great"... also start questions and remarks
+AFFIRMATIONS = {"yes", "yeah", "yep", "yup", "ok", "okay", "sure", "proceed", "alright", "continue"}
+# A yes only as the whole message: "i am fine" answers "how are you"
+LONE_AFFIRMATIONS = {"fine"}
+GENDERS = {"male": "male", "man": "male", "guy": "male", "female": "female", "woman": "female", "lady": "female"}
+RELATIONS = {
+    "self": "self", "myself": "self",
+    "wife": "wife", "husband": "husband",
+    "son": "son", "daughter": "daughter",
+    "father": "father", "dad": "father", "papa": "father",
+    "mother": "mother", "mom": "mother", "mum": "mother", "mummy": "mother",
+}
+TIERS = {"1": "Tier 1", "one": "Tier 1", "i": "Tier 1", "2": "Tier 2", "two": "Tier 2", "ii": "Tier 2",
+         "3": "Tier 3", "three": "Tier 3", "iii": "Tier 3"}
+# Words that carry no meaning of their own in these short messages
+FILLERS = {"i", "am", "im", "my", "is", "are", "and", "a", "an", "the", "years", "year", "yrs", "yr", "old",
+           "aged", "age", "in", "from", "city", "live", "we", "me", "please", "let", "s", "lets", "of", "also", "with",
+           "good", "there"}
+
+# Words that suggest a message carries profile info, even when the rule parser can't read it
+GENDER_CUES = set(GENDERS) | {"men", "women", "boy", "girl", "gender", "sex"}
+LOCATION_CUES = {"tier", "city", "metro", "town", "village", "live", "living", "based", "stay", "staying",
+                 "located", "mumbai", "delhi", "bangalore", "bengaluru", "chennai", "kolkata", "hyderabad", "pune",
+                 "ahmedabad", "noida", "gurgaon", "gurugram"}
+MEMBER_CUES = set(RELATIONS) | {"age", "aged", "old", "years", "yrs", "spouse", "kid", "kids", "child",
+                                "children", "baby", "parent", "parents", "family", "members", "sister", "brother"}
+
+# A message starting with one of these is a question, whatever else it contains
+QUESTION_WORDS = {"is", "are", "am", "do", "does", "did", "can", "could", "should", "would", "will", "what",
+                  "which", "who", "why", "how", "when", "where", "whats"}
+# After a number these make it a duration or an amount rather than an age
+NON_AGE_UNITS = {"lakh", "lakhs", "lac", "lacs", "l", "k", "cr", "crore", "crores", "rs", "inr", "months", "month"}
+YEAR_WORDS = {"years", "year", "yrs", "yr"}
+MIN_ADULT_AGE = 18
+# Confidence of a parse that read every word but may have read a number wrongly
+AMBIGUOUS_CONFIDENCE = 0.5
+
+MAX_AGE = 100
+_TOKEN_RE = re.compile(r"[a-z]+|\d+")
+
+
+def _tokenize(text):
+    text = text.lower().replace("i'm", "i am").replace("’", "'")
+    return _TOKEN_RE.findall(text)
+
+
+def parse_message(user_input):
+    """
+    Rule/lexicon parse of short turns ("hi", "ok sure", "30", "male, Tier 2",
+    "wife 28 and son 3"). Returns a dict with intent, confidence (share of tokens
+    the lexicon understood, capped at AMBIGUOUS_CONFIDENCE when a number may not
+    be the age it looks like) and the extracted gender/location/members, or None
+    when nothing was recognised or the message is a question.
+    """
+    tokens = _tokenize(user_input)
+    if not tokens or "?" in user_input or tokens[0] in QUESTION_WORDS:
+        return None
+
+    covered = 0
+    saw_greeting = saw_affirmation = False
+    gender = location = None
+    members = []
+    pending_relation = pending_at = None
+    bare_ages = 0
+    ambiguous = False
+
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok == "tier" and i + 1 < len(tokens) and tokens[i + 1] in TIERS:
+            location = TIERS[tokens[i + 1]]
+            covered += 2
+            i += 2
+            continue
+        if tok in GENDERS:
+            gender = GENDERS[tok]
+            covered += 1
+        elif tok in RELATIONS:
+            pending_relation, pending_at = RELATIONS[tok], i
+            covered += 1
+        elif tok.isdigit():
+            age = int(tok)
+            unit = tokens[i + 1] if i + 1 < len(tokens) else None
+            # "3 years" may be a policy term and "5 lakh" a sum insured; "3 years old" is an age
+            if unit in NON_AGE_UNITS or (unit in YEAR_WORDS and "old" not in tokens[i + 2:i + 3]):
+                ambiguous = True
+            # "wife and i are 30": whose age it is isn't clear
+            if pending_relation is not None and {"and", "i", "we"} & set(tokens[pending_at + 1:i]):
+                ambiguous = True
+            if age <= MAX_AGE:
+                relation = pending_relation
+                if relation is None:
+                    # "30 year old wife": the relation follows the age, unless it has its own
+                    following = [t for t in tokens[i + 1:] if t not in FILLERS][:2]
+                    relation = "self"
+                    if following and following[0] in RELATIONS and not (len(following) > 1 and following[1].isdigit()):
+                        relation = RELATIONS[following[0]]
+                if relation == "self" and pending_relation is None:
+                    bare_ages += 1
+                    # "we are 2" counts people; a policyholder is an adult
+                    if age < MIN_ADULT_AGE:
+                        ambiguous = True
+                members.append({"relation": relation, "age": age})
+                pending_relation = None
+                covered += 1
+        elif tok in GREETINGS:
+            saw_greeting = True
+            covered += 1
+        elif tok in AFFIRMATIONS or (tok in LONE_AFFIRMATIONS and len(tokens) == 1):
+            saw_affirmation = True
+            covered += 1
+        elif tok in FILLERS:
+            covered += 1
+        i += 1
+
+    if gender or location or members:
+        intent = "profile_info"
+    elif saw_greeting:
+        intent = "greeting"
+    elif saw_affirmation:
+        intent = "affirmation"
+    else:
+        return None
+
+    # "30 and 28": several ages with nobody named
+    if bare_ages > 1:
+        ambiguous = True
+    confidence = covered / len(tokens)
+    if ambiguous:
+        confidence = min(confidence, AMBIGUOUS_CONFIDENCE)
+
+    # children can repeat ("son 5 and son 3"); anyone else listed twice keeps their last age
+    by_relation = {}
+    for m in members:
+        by_relation.setdefault(m["relation"], []).append(m)
+    members = [m for relation, found in by_relation.items() for m in (found if relation in CHILDREN else found[-1:])]
+    return {
+        "intent": intent,
+        "confidence": confidence,
+        "gender": gender,
+        "location": location,
+        "members": members,
+    }
+
+
+def profile_cues(user_input):
+    """Profile fields ("gender", "location", "members") the message may say something about."""
+    fields = set()
+    for tok in _tokenize(user_input):
+        if tok in GENDER_CUES:
+            fields.add("gender")
+        if tok in LOCATION_CUES:
+            fields.add("location")
+        if tok in MEMBER_CUES or (tok.isdigit() and int(tok) <= MAX_AGE):
+            fields.add("members")
+    return fields
+
+
+# Running fast-path statistics for fast_path_report()
+_stats_lock = threading.Lock()
+FAST_PATH_STATS = {
+    "turns": 0,
+    "hits": 0,
+    "fast_ms": 0.0,
+    "llm_turns": 0,
+    "llm_ms": 0.0,
+    "llm_tokens": 0,
+}
+
+
+def record_turn(hit, understand_ms, tokens_used=0):
+    with _stats_lock:
+        FAST_PATH_STATS["turns"] += 1
+        if hit:
+            FAST_PATH_STATS["hits"] += 1
+            FAST_PATH_STATS["fast_ms"] += understand_ms
+        else:
+            FAST_PATH_STATS["llm_turns"] += 1
+            FAST_PATH_STATS["llm_ms"] += understand_ms
+            FAST_PATH_STATS["llm_tokens"] += tokens_used
+
+
+def fast_path_report():
+    """
+    Hit rate of the rule parser and the LLM latency/tokens it saved, estimated
+    from the average understanding cost of turns that did go to the LLM.
+    """
+    with _stats_lock:
+        stats = dict(FAST_PATH_STATS)
+    hits, llm_turns = stats["hits"], stats["llm_turns"]
+    avg_fast_ms = stats["fast_ms"] / hits if hits else 0.0
+    avg_llm_ms = stats["llm_ms"] / llm_turns if llm_turns else 0.0
+    avg_llm_tokens = stats["llm_tokens"] / llm_turns if llm_turns else 0.0
+    return {
+        "turns": stats["turns"],
+        "hits": hits,
+        "hit_rate": round(hits / stats["turns"], 3) if stats["turns"] else 0.0,
+        "avg_fast_ms": round(avg_fast_ms, 3),
+        "avg_llm_ms": round(avg_llm_ms, 1),
+        "est_saved_ms": round(hits * max(avg_llm_ms - avg_fast_ms, 0.0), 1),
+        "est_saved_tokens": round(hits * avg_llm_tokens),
+    }
@@ -1,40 +1,67 @@
-import pandas as pd
 import numpy as np
+import hashlib
+import heapq
+import json
+import logging
 import os
+import re
+import threading
+import time
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-DATA_PATH_v = os.path.join(BASE_DIR,"insurance_agentic_chatbot", "data", "df_variations.csv")
-DATA_PATH_r = os.path.join(BASE_DIR,"insurance_agentic_chatbot", "data", "dfv_variations.parquet")
+from core.metrics import span
 
-df_all = pd.read_csv(DATA_PATH_v)
-df_rec = pd.read_parquet(DATA_PATH_r)
+log = logging.getLogger(__name__)
 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.environ.get("SCORING_DATA_DIR", os.path.join(BASE_DIR, "data"))
+DATA_PATH_v = os.path.join(DATA_DIR, "df_variations.csv")
+DATA_PATH_r = os.path.join(DATA_DIR, "dfv_variations.parquet")
+# variant,plan rows: score_fit keys that are variants of one plan ("Aspire - Gold+" → "Aspire")
+PLANS_PATH = os.path.join(DATA_DIR, "plan_variants.csv")
+CACHE_DIR = os.path.join(DATA_DIR, ".cache")
+
+# Bump when the compiled index layout changes so old cache files are ignored
+INDEX_FORMAT = 1
+
+# Order matters: position i is bit i of the packed profile key
+PROFILE_FLAGS = [
+    "male_below_35",
+    "female_below_35",
+    "male_35_to_45",
+    "female_35_to_45",
+    "male_46_60",
+    "female_46_60",
+    "male_above_60",
+    "female_above_60",
+    "city_tier_1",
+    "city_tier_2",
+    "city_tier_3",
+    "family_self",
+    "family_self_spouse",
+    "family_self_children",
+    "family_self_parents",
+    # "family_extended",
+    "chronic_condition",
+    "critical_illness_history",
+]
+
+FAMILY_FLAGS = ["family_self", "family_self_spouse", "family_self_children", "family_self_parents"]
+
+TOP_K = 3
 
-def convert_user_profile(raw_profile):
-    profile_flags = {
-        "male_below_35": 0,
-        "female_below_35": 0,
-        "male_35_to_45": 0,
-        "female_35_to_45": 0,
-        "male_46_60": 0,
-        "female_46_60": 0,
-        "male_above_60": 0,
-        "female_above_60": 0,
-        "city_tier_1": 0,
-        "city_tier_2": 0,
-        "city_tier_3": 0,
-        "family_self": 0,
-        "family_self_spouse": 0,
-        "family_self_children": 0,
-        "family_self_parents": 0,
-        # "family_extended": 0,
-        "chronic_condition": 0,
-        "critical_illness_history": 0
-    }
+
+def relation_of(value):
+    """Normalised member relation; a member with none stated is the user ("self"), as the extractor assumes."""
+    return str(value or "").strip(" []'\"").lower() or "self"
+
+
+def profile_flags(raw_profile):
+    profile_flags = dict.fromkeys(PROFILE_FLAGS, 0)
+    members = raw_profile.get("members") or []
 
     # Gender + Age mapping (for self only)
-    for member in raw_profile.get("members", []):
-        if member["relation"] == "self":
+    for member in members:
+        if relation_of(member.get("relation")) == "self" and member.get("age") is not None:
             age = member["age"]
             gender = raw_profile["gender"]
             if gender == "male":
@@ -57,7 +84,7 @@ def convert_user_profile(raw_profile):
                     profile_flags["female_above_60"] = 1
 
     # City tier mapping
-    loc = raw_profile.get("location", "").lower()
+    loc = (raw_profile.get("location") or "").lower()
     if "tier 1" in loc:
         profile_flags["city_tier_1"] = 1
     elif "tier 2" in loc:
@@ -66,35 +93,377 @@ def convert_user_profile(raw_profile):
         profile_flags["city_tier_3"] = 1
 
     # Family structure
-    relations = [m["relation"] for m in raw_profile.get("members", [])]
-    if relations == ["self"]:
-        profile_flags["family_self"] = 1
-    elif "wife" in relations or "husband" in relations:
-        profile_flags["family_self_spouse"] = 1
-    elif any(r in ["son", "daughter", "child"] for r in relations):
-        profile_flags["family_self_children"] = 1
-    elif any(r in ["father", "mother", "parent"] for r in relations):
-        profile_flags["family_self_parents"] = 1
-    # elif len(relations) > 2:
-    #     profile_flags["family_extended"] = 1
+    family = family_flag([m.get("relation") for m in members])
+    if family:
+        profile_flags[family] = 1
 
     # Health conditions → simple rule
     if len(raw_profile.get("ped_conditions", [])) > 0:
         profile_flags["chronic_condition"] = 1
         profile_flags["critical_illness_history"] = 1
 
-    return pd.DataFrame([profile_flags])
+    return profile_flags
 
-def score_plans_and_recommend(user_profile):
-    df_profile = convert_user_profile(user_profile)
 
-    # df_all = df_all.drop_duplicates(subset=df_profile.columns.tolist())
-    matches = np.all(df_all[df_profile.columns ].values == df_profile .values, axis=1)
-    matching_indices = df_all.index[matches].tolist()[0]
-    df_final = df_rec.loc[[matching_indices], :] 
-    final_dict = df_final.sample(1) .to_dict() 
+def family_flag(relations):
+    """Family structure flag for the members' relations (each normalised by relation_of), None for no members."""
+    relations = [relation_of(r) for r in relations]
+    if relations and set(relations) == {"self"}:
+        return "family_self"
+    elif "wife" in relations or "husband" in relations:
+        return "family_self_spouse"
+    elif any(r in ["son", "daughter", "child"] for r in relations):
+        return "family_self_children"
+    elif any(r in ["father", "mother", "parent"] for r in relations):
+        return "family_self_parents"
+    # elif len(relations) > 2:
+    #     return "family_extended"
+    return None
+
+
+def convert_user_profile(raw_profile):
+    import pandas as pd
+
+    return pd.DataFrame([profile_flags(raw_profile)])
+
+
+def _per_value(frame, name, rule, width):
+    # lead columns have few distinct values: apply the rule once per value, then gather
+    import pandas as pd
+
+    if name not in frame:
+        return np.tile(np.asarray(rule(None), dtype=np.uint8), (len(frame), 1))
+    codes, uniques = pd.factorize(frame[name], use_na_sentinel=False)
+    table = np.zeros((len(uniques), width), dtype=np.uint8)
+    for i, value in enumerate(uniques):
+        table[i] = rule(None if pd.isna(value) else str(value).strip().lower())
+    return table[codes]
+
+
+def _tier_flags(loc):
+    loc = loc or ""
+    return [int(i == next((t for t in (1, 2, 3) if f"tier {t}" in loc), None)) for i in (1, 2, 3)]
+
+
+def _family_flags(members):
+    # a lead with no members listed is one member, the lead, with no relation stated
+    relations = [r for r in re.split(r"[;,]", members or "") if r.strip(" []'\"")] or [None]
+    family = family_flag(relations)
+    return [name == family for name in FAMILY_FLAGS]
+
+
+def _ped_flags(ped):
+    has_ped = int(ped not in (None, "", "none", "[]", "nan", "no"))
+    return [has_ped, has_ped]
+
+
+def profile_flag_matrix(frame):
+    """
+    Vectorised profile_flags over a DataFrame of flat lead rows: gender, age
+    (of self), location, members (relations separated by ";" or ",") and
+    ped_conditions (empty / "none" when there are none). Returns an
+    (n, len(PROFILE_FLAGS)) uint8 array in PROFILE_FLAGS order.
+    """
+    n = len(frame)
+    flags = np.zeros((n, len(PROFILE_FLAGS)), dtype=np.uint8)
+    col = {name: i for i, name in enumerate(PROFILE_FLAGS)}
+
+    # Gender + Age mapping
+    gender = _per_value(frame, "gender", lambda g: [g == "male", g == "female"], 2)
+    age = frame["age"].to_numpy(dtype=np.float64, na_value=np.nan) if "age" in frame else np.full(n, np.nan)
+    known = ~np.isnan(age)
+    bands = {
+        "below_35": known & (age < 35),
+        "35_to_45": known & (age >= 35) & (age <= 45),
+        "46_60": known & (age >= 46) & (age <= 60),
+    }
+    bands["above_60"] = known & ~(bands["below_35"] | bands["35_to_45"] | bands["46_60"])
+    for g, is_gender in zip(("male", "female"), gender.T.astype(bool)):
+        for band, mask in bands.items():
+            flags[:, col[f"{g}_{band}"]] = mask & is_gender
+
+    # City tier, family structure and health conditions, by the profile_flags rules
+    flags[:, [col[f"city_tier_{t}"] for t in (1, 2, 3)]] = _per_value(frame, "location", _tier_flags, 3)
+    flags[:, [col[name] for name in FAMILY_FLAGS]] = _per_value(frame, "members", _family_flags, len(FAMILY_FLAGS))
+    flags[:, [col["chronic_condition"], col["critical_illness_history"]]] = _per_value(
+        frame, "ped_conditions", _ped_flags, 2
+    )
+    return flags
+
+
+def pack_flags(flags):
+    """Bit-pack a flags dict into the integer key used by RecommendationIndex."""
+    key = 0
+    for bit, name in enumerate(PROFILE_FLAGS):
+        if flags.get(name):
+            key |= 1 << bit
+    return key
+
+
+def _as_mapping(value):
+    # parquet round-trips dicts as JSON strings, dicts or lists of (key, value) pairs
+    if value is None:
+        return {}
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+        return value if isinstance(value, dict) else {}
+    try:
+        return {k: v for k, v in value}
+    except (TypeError, ValueError):
+        return {}
+
+
+def read_plans(path=None):
+    """{variant: plan} from the plan column of PLANS_PATH; empty when there is no such file."""
+    import pandas as pd
+
+    path = path or PLANS_PATH
+    if not os.path.exists(path):
+        return {}
+    frame = pd.read_csv(path, dtype=str)
+    return dict(zip(frame["variant"].str.strip(), frame["plan"].str.strip()))
+
 
+def top_plans(score_fit, k=TOP_K, plans=None):
+    """
+    Partial top-k over score_fit, keeping only the best-scoring variant per plan.
+    plans maps a score_fit key to its plan (see read_plans); keys it doesn't
+    list are plans of their own. Returns a list of (plan_key, score) pairs,
+    highest score first.
+    """
+    plans = plans or {}
+    heap = [(-float(score), plan) for plan, score in score_fit.items() if score is not None]
+    heapq.heapify(heap)
+    seen = set()
+    top = []
+    while heap and len(top) < k:
+        neg_score, plan = heapq.heappop(heap)
+        name = plans.get(str(plan), str(plan))
+        if name in seen:
+            continue
+        seen.add(name)
+        top.append((plan, -neg_score))
+    return top
 
 
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+class RecommendationIndex:
+    """
+    Compiled profile → recommendation lookup.
+
+    Every row of df_all is packed into an integer key (one bit per profile flag)
+    and mapped to its precomputed row in df_rec, so a lookup is a single dict get.
+    Like the original linear scan, the first matching row wins.
+
+    Entries are kept as one JSON blob with offsets, which is also the on-disk
+    (.npz) layout; each entry is decoded on first lookup.
+    """
+
+    def __init__(self, keys, offsets, blob):
+        self._slots = {int(key): i for i, key in enumerate(keys)}
+        self._offsets = offsets
+        self._blob = blob
+        self._decoded = {}
+
+    @classmethod
+    def from_frames(cls, df_all, df_rec, k=TOP_K, plans=None):
+        values = df_all[PROFILE_FLAGS].to_numpy()
+        is_binary = np.all((values == 0) | (values == 1), axis=1)
+        weights = np.left_shift(np.int64(1), np.arange(len(PROFILE_FLAGS), dtype=np.int64))
+        keys = (values == 1).astype(np.int64) @ weights
+
+        rows = dict(zip(df_rec.index, df_rec.to_dict("records")))
+        entries = {}
+        for pos in np.flatnonzero(is_binary):
+            key = int(keys[pos])
+            if key in entries:
+                continue
+            row = rows.get(df_all.index[pos])
+            if row is not None:
+                entries[key] = cls._compile(row, k, plans)
+
+        encoded = [json.dumps(entry, default=_to_json).encode("utf-8") for entry in entries.values()]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(np.fromiter(entries.keys(), dtype=np.int64, count=len(entries)), offsets, blob)
+
+    @staticmethod
+    def _compile(row, k, plans):
+        score_fit = {str(plan): float(score) for plan, score in _as_mapping(row.get("score_fit")).items()}
+        entry = dict(row)
+        entry["score_fit"] = score_fit
+        entry["needs"] = _as_mapping(row.get("needs"))
+        entry["top_plans"] = top_plans(score_fit, k, plans)
+        return entry
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["keys"], data["offsets"], data["blob"])
+
+    def save(self, path):
+        keys = np.fromiter(self._slots.keys(), dtype=np.int64, count=len(self._slots))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, keys=keys, offsets=self._offsets, blob=self._blob)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def __len__(self):
+        return len(self._slots)
+
+    def lookup(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        entry = self._decoded.get(slot)
+        if entry is None:
+            raw = self._blob[self._offsets[slot]:self._offsets[slot + 1]].tobytes()
+            entry = json.loads(raw)
+            entry["top_plans"] = [tuple(pair) for pair in entry["top_plans"]]
+            self._decoded[slot] = entry
+        return entry
+
+
+def no_match(key):
+    return {
+        "matched": False,
+        "score_fit": {},
+        "needs": {},
+        "top_plans": [],
+        "user_attributes": flag_names(key),
+    }
+
+
+def source_hash(paths=None):
+    digest = hashlib.sha256(f"format={INDEX_FORMAT}".encode())
+    if paths is None:
+        paths = [DATA_PATH_v, DATA_PATH_r] + ([PLANS_PATH] if os.path.exists(PLANS_PATH) else [])
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def cache_path(digest):
+    return os.path.join(CACHE_DIR, f"scoring_index.{digest}.npz")
+
+
+def build_index():
+    import pandas as pd
+
+    df_all = pd.read_csv(DATA_PATH_v)
+    df_rec = pd.read_parquet(DATA_PATH_r)
+    return RecommendationIndex.from_frames(df_all, df_rec, plans=read_plans())
+
+
+# Last load timings in ms, e.g. {"hash": 1.2, "cache_load": 3.4}
+LOAD_TIMINGS = {}
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def load_index():
+    """
+    Load the compiled index from the on-disk cache, rebuilding it from the
+    source CSV/parquet (and replacing stale cache files) when their hash changes.
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    digest = source_hash()
+    timings["hash"] = (time.perf_counter() - t0) * 1000
+
+    path = cache_path(digest)
+    t0 = time.perf_counter()
+    if os.path.exists(path):
+        index = RecommendationIndex.load(path)
+        timings["cache_load"] = (time.perf_counter() - t0) * 1000
+    else:
+        index = build_index()
+        timings["build"] = (time.perf_counter() - t0) * 1000
+        _cache_index(index, path)
+
+    LOAD_TIMINGS.clear()
+    LOAD_TIMINGS.update(timings)
+    return index
+
+
+def _cache_index(index, path):
+    # Best effort: the built index is used either way. Other processes may be
+    # writing and cleaning the same directory, so each file is only replaced whole.
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        index.save(path)
+        for name in os.listdir(CACHE_DIR):
+            stale = os.path.join(CACHE_DIR, name)
+            if name.startswith("scoring_index.") and name.endswith(".npz") and stale != path:
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+    except OSError as e:
+        log.warning("Could not cache the scoring index in %s: %s", CACHE_DIR, e)
+
+
+def get_index():
+    # Module state outlives Streamlit reruns, so this loads once per process
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index()
+    return _index
+
+
+def _preload():
+    # a failure is recorded on the span; the first recommend loads (and reports) it again
+    try:
+        with span("scoring_preload"):
+            get_index()
+    except OSError:
+        pass
+
+
+def preload_index():
+    """Warm the index in a background thread so the first recommend doesn't wait."""
+    thread = threading.Thread(target=_preload, name="scoring-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def flag_names(key):
+    return [name for bit, name in enumerate(PROFILE_FLAGS) if key >> bit & 1]
+
+
+def score_plans_and_recommend(user_profile):
+    """Recommendation for a Profile (or a profile dict), straight from its flag bitmask."""
+    key = user_profile.key if hasattr(user_profile, "key") else pack_flags(profile_flags(user_profile))
+    entry = get_index().lookup(key)
+    if entry is None:
+        return no_match(key)
 
-    return final_dict
+    result = dict(entry)
+    result["matched"] = True
+    result.setdefault("user_attributes", flag_names(key))
+    return result
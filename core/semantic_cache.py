@@ -0,0 +1,173 @@
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+# Question scaffolding that doesn't change what is being asked
+STOPWORDS = {
+    "a", "about", "an", "and", "are", "by", "can", "define", "definition", "do", "does", "explain",
+    "for", "how", "i", "in", "is", "it", "know", "me", "mean", "meaning", "means", "of", "please",
+    "tell", "the", "to", "understand", "want", "what", "whats", "work", "works", "you",
+}
+# Flip a question's meaning while leaving most of its words alone
+NEGATIONS = {"not", "no", "without", "exclude", "excluded", "excludes", "excluding", "never", "dont", "doesnt",
+             "isnt", "arent", "cant", "cannot", "wont"}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_question(text):
+    # "co-pay" and "copay" should look the same
+    text = text.lower().replace("-", "").replace("’", "'").replace("'", "")
+    return [w for w in _WORD_RE.findall(text) if w not in STOPWORDS]
+
+
+def has_negation(text):
+    text = text.lower().replace("’", "'").replace("'", "")
+    return any(w in NEGATIONS for w in _WORD_RE.findall(text))
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder: hashed word and character-trigram features,
+    L2-normalised. Needs no network, so it suits offline tests and builds; as a
+    bag of words it can't tell "covered" from "not covered", so don't use it
+    to match questions in production.
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = normalize_question(text)
+        for word in words:
+            yield "w:" + word
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3]
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                # the top bit picks a sign so collisions tend to cancel out
+                vectors[row, h % self.dim] += -1.0 if h & 0x80000000 else 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def embed(self, texts):
+        """(vectors, usage) like OpenAIEmbedder.embed; nothing is spent locally."""
+        return self(texts), {"tokens_used": 0, "cost_inr": 0.0}
+
+
+class OpenAIEmbedder:
+    """Embeds with the OpenAI embeddings endpoint through the shared client."""
+
+    def __init__(self, model="text-embedding-3-small"):
+        self.model = model
+        self.name = model
+
+    def embed(self, texts):
+        """(L2-normalised vectors, {"tokens_used", "cost_inr"} of the request)."""
+        from core.gpt_handler import embed_texts
+
+        result = embed_texts(texts, model=self.model)
+        vectors = np.asarray(result["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        usage = {"tokens_used": result["tokens_used"], "cost_inr": result["cost_inr"]}
+        return vectors / np.maximum(norms, 1e-12), usage
+
+    def __call__(self, texts):
+        return self.embed(texts)[0]
+
+
+class _IntentBucket:
+    def __init__(self, dim, capacity):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.questions = [None] * capacity
+        self.answers = [None] * capacity
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.negated = np.zeros(capacity, dtype=bool)
+        self.size = 0
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by question similarity, one bucket per intent.
+
+    A lookup embeds the question and returns the answer of the nearest cached
+    question in the same intent when cosine similarity reaches the threshold.
+    Each bucket holds at most capacity_per_intent answers; the least recently
+    used one is replaced when it is full. A question with a negation ("not",
+    "without", ...) never matches one without, however similar they embed.
+
+    embed() returns a question's vector with what embedding it cost; pass that
+    vector to lookup() and store() so a miss is embedded only once.
+    """
+
+    def __init__(self, embedder, threshold=0.85, capacity_per_intent=512):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.capacity_per_intent = capacity_per_intent
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def embed(self, question):
+        """(vector, usage) for a question."""
+        vectors, usage = self.embedder.embed([question])
+        return vectors[0], usage
+
+    def lookup(self, intent, question, vector=None):
+        """Returns (answer, similarity) or None."""
+        if vector is None:
+            vector = self.embed(question)[0]
+        with self._lock:
+            bucket = self._buckets.get(intent)
+            if bucket is None or bucket.size == 0:
+                self.stats["misses"] += 1
+                return None
+            sims = bucket.vectors[:bucket.size] @ vector
+            sims[bucket.negated[:bucket.size] != has_negation(question)] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            bucket.last_used[best] = time.monotonic()
+            self.stats["hits"] += 1
+            return bucket.answers[best], float(sims[best])
+
+    def store(self, intent, question, answer, vector=None):
+        if vector is None:
+            vector = self.embed(question)[0]
+        with self._lock:
+            bucket = self._buckets.get(intent)
+            if bucket is None:
+                bucket = self._buckets[intent] = _IntentBucket(len(vector), self.capacity_per_intent)
+            if bucket.size < self.capacity_per_intent:
+                slot = bucket.size
+                bucket.size += 1
+            else:
+                slot = int(np.argmin(bucket.last_used))
+                self.stats["evictions"] += 1
+            bucket.vectors[slot] = vector
+            bucket.questions[slot] = question
+            bucket.negated[slot] = has_negation(question)
+            bucket.answers[slot] = answer
+            bucket.last_used[slot] = time.monotonic()
+            self.stats["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = {intent: b.size for intent, b in self._buckets.items()}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,427 @@
+"""
+Session state outside the process, so any worker can serve any turn and a
+restart doesn't lose conversations.
+
+    store = get_session_store()          # SESSION_STORE: memory | sqlite:///path | redis://host:port/db
+    session = store.load(session_id) or SessionState(session_id)
+    session.update(user_profile=..., total_tokens=...)
+    session.history.append(["user", message])
+    store.save(session)                  # writes only the fields and messages that changed
+
+Values are stored as compact JSON, one entry per field, and the chat history as
+an append-only list, so a turn writes a few hundred bytes regardless of how
+long the conversation is.
+
+Each save bumps a version kept next to the fields. A save made from a state that
+someone else has saved over since it was loaded (two workers running turns of
+one session at once) raises SessionConflict instead of interleaving the two.
+"""
+import json
+import os
+import select
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from core.llm_cache import LRUCache
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 24 * 3600))
+# Older chat messages are dropped beyond this many per session
+MAX_HISTORY = 200
+# Stored with the fields, but not one of them
+VERSION_FIELD = "_version"
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _encode(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class SessionConflict(RuntimeError):
+    """The session was saved by someone else after this copy was loaded."""
+
+    def __init__(self, session_id):
+        super().__init__(f"session {session_id} was changed by another request")
+        self.session_id = session_id
+
+
+class SessionState:
+    """
+    One session's fields and chat history. Remembers what was last loaded or
+    saved, so changes() is just the delta of this turn.
+    """
+
+    __slots__ = ("session_id", "fields", "history", "version", "_saved", "_saved_history")
+
+    def __init__(self, session_id, fields=None, history=None):
+        self.session_id = session_id
+        self.fields = dict(fields or {})
+        self.history = list(history or [])
+        self.version = 0  # saves so far; 0 for a session not in the store yet
+        self._saved = {}
+        self._saved_history = 0
+
+    @classmethod
+    def from_encoded(cls, session_id, fields, history):
+        """Rebuild from stored JSON strings; the result has no pending changes."""
+        fields = dict(fields)
+        version = int(fields.pop(VERSION_FIELD, 0))
+        state = cls(session_id, {name: json.loads(raw) for name, raw in fields.items()},
+                    [json.loads(raw) for raw in history])
+        state.version = version
+        state._saved = fields
+        state._saved_history = len(state.history)
+        return state
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+    def update(self, **values):
+        self.fields.update(values)
+
+    def apply(self, response):
+        """Take the session fields from a run_chat_controller response."""
+        self.update(
+            user_profile=response["updated_profile"],
+            last_bot_action=response["updated_last_action"],
+            total_tokens=response["total_tokens"],
+            total_cost_inr=response["total_cost_inr"],
+        )
+
+    def changes(self):
+        """(changed fields as {name: json}, new history messages as json) since the last save."""
+        encoded = {name: _encode(value) for name, value in self.fields.items()}
+        changed = {name: raw for name, raw in encoded.items() if self._saved.get(name) != raw}
+        return changed, [_encode(message) for message in self.history[self._saved_history:]]
+
+    def mark_saved(self, changed):
+        self._saved.update(changed)
+        self._saved_history = len(self.history)
+        self.version += 1
+
+
+class MemorySessionStore:
+    """In-process LRU with a TTL; for a single worker and for tests."""
+
+    def __init__(self, max_sessions=10000, ttl_seconds=SESSION_TTL):
+        self._sessions = LRUCache(max_sessions, ttl_seconds)
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            fields, history = item
+            return SessionState.from_encoded(session_id, fields, history)
+
+    def save(self, session):
+        changed, new_history = session.changes()
+        with self._lock:
+            fields, history = self._sessions.get(session.session_id) or ({}, [])
+            if int(fields.get(VERSION_FIELD, 0)) != session.version:
+                raise SessionConflict(session.session_id)
+            fields = dict(fields, **changed, **{VERSION_FIELD: str(session.version + 1)})
+            history = (history + new_history)[-MAX_HISTORY:]
+            # put() also refreshes the TTL
+            self._sessions.put(session.session_id, (fields, history))
+        session.mark_saved(changed)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.delete(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file (WAL), shared by the processes of one host."""
+
+    def __init__(self, path, ttl_seconds=SESSION_TTL):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, expires REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS session_fields ("
+            " session_id TEXT NOT NULL, name TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (session_id, name));"
+            "CREATE TABLE IF NOT EXISTS session_history ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, value TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS session_history_session ON session_history(session_id, id);"
+            "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions(expires);"
+        )
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT expires FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] < time.time():
+                self._delete(session_id)
+                return None
+            fields = dict(self._conn.execute(
+                "SELECT name, value FROM session_fields WHERE session_id = ?", (session_id,)
+            ))
+            history = [value for (value,) in self._conn.execute(
+                "SELECT value FROM session_history WHERE session_id = ? ORDER BY id", (session_id,)
+            )]
+        return SessionState.from_encoded(session_id, fields, history)
+
+    def save(self, session):
+        changed, new_history = session.changes()
+        sid = session.session_id
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM session_fields WHERE session_id = ? AND name = ?", (sid, VERSION_FIELD)
+                ).fetchone()
+                if int(row[0] if row else 0) != session.version:
+                    raise SessionConflict(sid)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, expires) VALUES (?, ?)",
+                    (sid, time.time() + self.ttl_seconds),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO session_fields (session_id, name, value) VALUES (?, ?, ?)",
+                    [(sid, name, raw) for name, raw in changed.items()]
+                    + [(sid, VERSION_FIELD, str(session.version + 1))],
+                )
+                if new_history:
+                    self._conn.executemany(
+                        "INSERT INTO session_history (session_id, value) VALUES (?, ?)",
+                        [(sid, raw) for raw in new_history],
+                    )
+                    self._conn.execute(
+                        "DELETE FROM session_history WHERE session_id = ? AND id NOT IN ("
+                        " SELECT id FROM session_history WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                        (sid, sid, MAX_HISTORY),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        session.mark_saved(changed)
+
+    def _delete(self, session_id):
+        for table in ("sessions", "session_fields", "session_history"):
+            self._conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+
+    def delete(self, session_id):
+        with self._lock:
+            self._delete(session_id)
+
+    def purge_expired(self):
+        """Drop expired sessions; returns how many."""
+        with self._lock:
+            expired = self._conn.execute("SELECT session_id FROM sessions WHERE expires < ?", (time.time(),)).fetchall()
+            for (session_id,) in expired:
+                self._delete(session_id)
+        return len(expired)
+
+    def close(self):
+        self._conn.close()
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """Minimal RESP2 client: pipelined commands over one socket, enough for the session store."""
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, timeout=5.0):
+        self.address = (host, port)
+        self.db = db
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address, self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.db:
+            self._sock.sendall(self._pack(("SELECT", self.db)))
+            self._check([self._read()])
+
+    def _alive(self):
+        """False once the server has closed an idle socket, so a write isn't sent into it."""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            # nothing is owed between pipelines, so a readable socket is an EOF (or junk)
+            return not readable
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    @staticmethod
+    def _pack(command):
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("redis closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    @staticmethod
+    def _check(replies):
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def pipeline(self, commands, transaction=False):
+        """
+        Send all commands in one round trip; returns their replies. transaction
+        wraps them in MULTI/EXEC so they apply all or nothing (None when a
+        WATCHed key changed and nothing ran). Only a failed send is retried on a
+        new connection: once the commands are written a dropped reply raises,
+        since the server may already have run them.
+        """
+        if transaction:
+            commands = [("MULTI",), *commands, ("EXEC",)]
+        payload = b"".join(self._pack(c) for c in commands)
+        for attempt in (1, 2):
+            try:
+                if self._sock is not None and not self._alive():
+                    self.close()
+                if self._sock is None:
+                    self._connect()
+                self._sock.sendall(payload)
+                break
+            except OSError:
+                self.close()
+                if attempt == 2:
+                    raise
+        try:
+            replies = [self._read() for _ in commands]
+        except OSError:
+            self.close()
+            raise
+        if transaction:
+            self._check(replies[:-1])
+            replies = replies[-1]
+            if replies is None:  # a WATCHed key changed, nothing ran
+                return None
+        return self._check(replies)
+
+
+class RedisSessionStore:
+    """
+    Sessions in Redis (or anything speaking its protocol): a hash of fields and
+    a capped list of messages per session, both expiring after ttl_seconds.
+    """
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, ttl_seconds=SESSION_TTL, prefix="chat:session:"):
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._conn = RedisConnection(host, port, db)
+        self._lock = threading.Lock()
+
+    def _keys(self, session_id):
+        return f"{self.prefix}{session_id}:f", f"{self.prefix}{session_id}:h"
+
+    def load(self, session_id):
+        fields_key, history_key = self._keys(session_id)
+        with self._lock:
+            flat, history = self._conn.pipeline([("HGETALL", fields_key), ("LRANGE", history_key, 0, -1)])
+        if not flat and not history:
+            return None
+        return SessionState.from_encoded(session_id, dict(zip(flat[::2], flat[1::2])), history)
+
+    def save(self, session):
+        changed, new_history = session.changes()
+        fields_key, history_key = self._keys(session.session_id)
+        ttl = int(self.ttl_seconds)
+        fields = dict(changed, **{VERSION_FIELD: session.version + 1})
+        commands = [("HSET", fields_key, *[part for item in fields.items() for part in item])]
+        if new_history:
+            commands.append(("RPUSH", history_key, *new_history))
+            commands.append(("LTRIM", history_key, -MAX_HISTORY, -1))
+        commands += [("EXPIRE", fields_key, ttl), ("EXPIRE", history_key, ttl)]
+        with self._lock:
+            # WATCH makes the EXEC fail if another client writes the fields in between
+            _, version = self._conn.pipeline([("WATCH", fields_key), ("HGET", fields_key, VERSION_FIELD)])
+            if int(version or 0) != session.version:
+                self._conn.pipeline([("UNWATCH",)])
+                raise SessionConflict(session.session_id)
+            if self._conn.pipeline(commands, transaction=True) is None:
+                raise SessionConflict(session.session_id)
+        session.mark_saved(changed)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.pipeline([("DEL", *self._keys(session_id))])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_session_store(url=None, ttl_seconds=SESSION_TTL, max_sessions=10000):
+    """memory | sqlite:///path/to/file.sqlite | redis://host:port/db"""
+    url = url or SESSION_STORE
+    if url == "memory":
+        return MemorySessionStore(max_sessions, ttl_seconds)
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteSessionStore(url[len("sqlite:///"):] or ":memory:", ttl_seconds)
+    if parsed.scheme == "redis":
+        db = int(parsed.path.strip("/") or 0)
+        return RedisSessionStore(parsed.hostname or "127.0.0.1", parsed.port or 6379, db, ttl_seconds)
+    raise ValueError(f"unknown session store {url!r}")
+
+
+def get_session_store():
+    """Process-wide store from SESSION_STORE, opened on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_session_store()
+    return _store
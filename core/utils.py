@@ -0,0 +1,159 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+LOGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logs")
+# CONVERSATION_LOG=0 turns transcript logging off
+CONVERSATION_LOG = os.environ.get("CONVERSATION_LOG", os.path.join(LOGS_DIR, "conversations.log"))
+
+log = logging.getLogger(__name__)
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def profile_hash(profile):
+    """Short stable digest of a profile, so turns of one user can be grouped without logging who they are."""
+    payload = json.dumps(profile or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ConversationLogger:
+    """
+    JSON-lines log written by a background thread. log() only enqueues: when
+    the bounded queue is full the record is dropped and counted, never waited
+    for. The writer flushes every batch_size records or flush_interval
+    seconds and rotates the file at max_bytes (path.1 ... path.<backups>).
+    """
+
+    def __init__(self, path, max_queue=10000, batch_size=256, flush_interval=1.0,
+                 max_bytes=10 * 1024 * 1024, backups=5, name="conversation-log"):
+        self.path = path
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.stats = {"logged": 0, "dropped": 0, "written": 0, "batches": 0, "rotations": 0, "errors": 0}
+        self._queue = queue.Queue(max_queue)
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def log(self, record):
+        if self._closed:
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+            self._count("logged")
+        except queue.Full:
+            self._count("dropped")
+
+    def _start(self):
+        with self._stats_lock:
+            if self._thread is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in batch:  # close() sentinel
+                stop = True
+            records = [r for r in batch if r is not None]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                self._count("errors")
+                log.warning("%s write failed: %s", self.name, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, records):
+        data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records).encode("utf-8")
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self._count("written", len(records))
+        self._count("batches")
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._count("rotations")
+
+    def flush(self):
+        """Block until everything logged so far is on disk (tests, shutdown)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+def get_conversation_logger():
+    """Process-wide logger for CONVERSATION_LOG, or None when logging is off."""
+    global _logger
+    if _logger is None and CONVERSATION_LOG not in ("", "0"):
+        with _logger_lock:
+            if _logger is None:
+                _logger = ConversationLogger(CONVERSATION_LOG)
+                atexit.register(_logger.close)
+    return _logger
+
+
+def configure_conversation_log(path):
+    """Point transcript logging at path (None turns it off); returns the previous logger, closed."""
+    global _logger, CONVERSATION_LOG
+    with _logger_lock:
+        previous, _logger = _logger, None
+        CONVERSATION_LOG = path or "0"
+    if previous is not None:
+        previous.close()
+    return previous
+
+
+def log_turn(record):
+    """Queue one anonymized turn record; never blocks the request."""
+    logger = get_conversation_logger()
+    if logger is not None:
+        logger.log(dict(record, ts=round(time.time(), 3)))
@@ -0,0 +1,134 @@
+"""
+Load time and memory of the memory-mapped chunk store against the old
+pickle of chunk dicts (plus kb.index), with N worker processes open at once.
+
+    python -m tests.bench_chunk_store                        # bundled KB, 4 workers
+    python -m tests.bench_chunk_store --scale 100 --workers 8
+
+--scale repeats the KB (with distinct ids) to show how both grow. Each worker
+loads the KB, runs a filtered search so the pages are actually touched, then
+reports from /proc (Linux): RSS is what the process has mapped in, PSS splits
+shared pages between the processes sharing them, so summed PSS is the real
+memory cost of N workers.
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from core.chunk_store import open_chunk_store, write_chunk_store
+from core.retrieval import INDEX_PATH, STORE_PATH, RetrievalEngine, read_flat_index, write_flat_index
+
+
+def _memory_kb():
+    """(rss, pss, private) of this process in kB."""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return None, None, None
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return fields.get("Rss"), fields.get("Pss"), private
+
+
+def load_pickle(paths):
+    vectors, metric = read_flat_index(paths["index"])
+    with open(paths["pickle"], "rb") as f:
+        chunks = pickle.load(f)
+    return vectors, chunks, metric
+
+
+def load_store(paths):
+    store = open_chunk_store(paths["store"])
+    return store.vectors, store, store.metric
+
+
+LOADERS = {"pickle": load_pickle, "store": load_store}
+
+
+def _worker(name, paths, barrier, results):
+    before = _memory_kb()
+    start = time.perf_counter()
+    vectors, chunks, metric = LOADERS[name](paths)
+    load_ms = (time.perf_counter() - start) * 1000
+    # engine setup is the same for both apart from encoding the filter columns
+    start = time.perf_counter()
+    engine = RetrievalEngine(vectors, chunks, metric=metric)
+    engine_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    hits = engine.search(np.asarray(vectors[0]), k=5, policy=engine.values("policy")[0], section=["coverage", "exclusions"])
+    search_ms = (time.perf_counter() - start) * 1000
+    assert hits[0]
+    barrier.wait()  # every worker has the KB open before anyone measures
+    after = _memory_kb()
+    barrier.wait()
+    results.put({
+        "load_ms": load_ms,
+        "engine_ms": engine_ms,
+        "first_search_ms": search_ms,
+        "rss_kb": after[0] - before[0] if after[0] is not None else None,
+        "pss_kb": after[1],
+        "private_kb": after[2] - before[2] if after[2] is not None else None,
+    })
+
+
+def measure(name, paths, workers):
+    ctx = multiprocessing.get_context("spawn")
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(name, paths, barrier, results)) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    rows = [results.get(timeout=120) for _ in processes]
+    for p in processes:
+        p.join()
+    report = {
+        f"{key}_p50": round(float(np.median([r[key] for r in rows])), 2)
+        for key in ("load_ms", "engine_ms", "first_search_ms")
+    }
+    if rows[0]["rss_kb"] is not None:
+        report["rss_added_mb_per_worker"] = round(float(np.mean([r["rss_kb"] for r in rows])) / 1024, 1)
+        report["private_added_mb_total"] = round(sum(r["private_kb"] for r in rows) / 1024, 1)
+        report["pss_mb_total"] = round(sum(r["pss_kb"] for r in rows) / 1024, 1)
+    return report
+
+
+def prepare(directory, scale):
+    """Write the bundled KB, repeated scale times, as pickle + kb.index and as a chunk store."""
+    store = open_chunk_store(STORE_PATH)
+    chunks = list(store)
+    vectors, metric = read_flat_index(INDEX_PATH)
+    if scale > 1:
+        chunks = [dict(c, id=f"{c['id']}#{copy}") for copy in range(scale) for c in chunks]
+        vectors = np.tile(vectors, (scale, 1))
+    paths = {name: os.path.join(directory, name) for name in ("pickle", "index", "store")}
+    with open(paths["pickle"], "wb") as f:
+        pickle.dump(chunks, f)
+    write_flat_index(paths["index"], vectors, metric)
+    write_chunk_store(paths["store"], chunks, vectors, metric)
+    sizes = {name: round(os.path.getsize(path) / 1024 / 1024, 2) for name, path in paths.items()}
+    return paths, len(chunks), sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="repeat the KB this many times")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths, rows, sizes = prepare(directory, args.scale)
+        print(f"{rows} chunks, file sizes (MB): {sizes}")
+        for name in LOADERS:
+            print(name, measure(name, paths, args.workers))
+
+
+if __name__ == "__main__":
+    main()
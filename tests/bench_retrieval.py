@@ -0,0 +1,75 @@
+"""
+Latency and recall of KB retrieval on the labelled queries in
+tests/retrieval_queries.json.
+
+    python -m tests.bench_retrieval            # BM25 only (offline)
+    python -m tests.bench_retrieval --embed    # + vector and hybrid (needs OpenAI access)
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from core.keyword_index import load_or_build
+from core.retrieval import KB_EMBEDDING_MODEL, RetrievalEngine
+
+QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_queries.json")
+
+
+def evaluate(search, queries, k, repeats):
+    recalls, hits, latencies = [], [], []
+    for q in queries:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results = search(q["query"], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        found = {r["chunk"]["id"] for r in results}
+        relevant = set(q["relevant"])
+        recalls.append(len(found & relevant) / min(len(relevant), k))
+        hits.append(bool(found & relevant))
+    return {
+        f"recall@{k}": round(float(np.mean(recalls)), 3),
+        f"hit@{k}": round(float(np.mean(hits)), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--embed", action="store_true", help="embed queries with OpenAI for vector/hybrid modes")
+    args = parser.parse_args()
+
+    with open(QUERIES_PATH) as f:
+        queries = json.load(f)
+
+    embedder = None
+    if args.embed:
+        from core.semantic_cache import OpenAIEmbedder
+
+        embedder = OpenAIEmbedder(KB_EMBEDDING_MODEL)
+    start = time.perf_counter()
+    keyword_index = load_or_build()
+    print(f"BM25 index ready in {(time.perf_counter() - start) * 1000:.1f} ms")
+    engine = RetrievalEngine.from_files(embedder=embedder, keyword_index=keyword_index)
+    # without an embedder hybrid_search ranks by BM25 alone
+    keyword_engine = RetrievalEngine.from_files(keyword_index=keyword_index)
+
+    modes = {"bm25": lambda text, k: keyword_engine.hybrid_search(text, k)}
+    if embedder is not None:
+        start = time.perf_counter()
+        engine.embed([q["query"] for q in queries])  # warm the query LRU so latency is search only
+        print(f"Embedded {len(queries)} queries in {(time.perf_counter() - start) * 1000:.1f} ms")
+        modes["vector"] = lambda text, k: engine.search_text(text, k)
+        modes["hybrid"] = lambda text, k: engine.hybrid_search(text, k)
+
+    for name, search in modes.items():
+        print(name, evaluate(search, queries, args.k, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import pytest
+
+from controller import chat_controller
+from core import gpt_handler, llm_dispatch, scoring
+from core.profile_extractor import clear_extraction_cache
+from core.semantic_cache import HashingEmbedder, SemanticCache
+from core.utils import configure_conversation_log
+from tests.mock_llm import MockLLMServer, fake_llm
+from tests.scoring_data import PLANS, make_frames
+
+DISPATCH_DEFAULTS = dict(llm_dispatch.DISPATCH_CONFIG)
+
+
+@pytest.fixture(autouse=True, scope="session")
+def conversation_log(tmp_path_factory):
+    """Keep test turns out of logs/conversations.log."""
+    configure_conversation_log(str(tmp_path_factory.mktemp("logs") / "conversations.log"))
+    yield
+    configure_conversation_log(None)
+
+
+@pytest.fixture
+def llm_server_options():
+    """MockLLMServer settings for llm_server; a test module overrides this fixture to change them."""
+    return {"reply": fake_llm, "latency": 0.2, "prompt_tokens": 100, "completion_tokens": 10}
+
+
+@pytest.fixture
+def llm_server(llm_server_options):
+    """A MockLLMServer with the OpenAI client and the dispatcher pointed at it, reset afterwards."""
+    with MockLLMServer(**llm_server_options) as server:
+        gpt_handler.configure_client(api_key="test-key", base_url=server.base_url, max_retries=0)
+        llm_dispatch.configure_dispatcher(base_delay=0.01)
+        clear_extraction_cache()
+        yield server
+    llm_dispatch.configure_dispatcher(**DISPATCH_DEFAULTS)
+    gpt_handler.configure_client(api_key=None, base_url=None, max_retries=0)
+
+
+@pytest.fixture
+def answer_cache(monkeypatch):
+    """The answer cache is off by default; this runs it on the offline embedder."""
+    cache = SemanticCache(HashingEmbedder())
+    monkeypatch.setattr(chat_controller, "ANSWER_CACHE", cache)
+    return cache
+
+
+@pytest.fixture
+def scoring_index(monkeypatch):
+    """The recommendation index over scoring_data.make_frames(), in place of the one in data/."""
+    index = scoring.RecommendationIndex.from_frames(*make_frames(), plans=PLANS)
+    monkeypatch.setattr(scoring, "_index", index)
+    return index
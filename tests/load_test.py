@@ -0,0 +1,232 @@
+"""
+Replay the scripted conversations in tests/golden_conversations.json against
+run_chat_controller with many concurrent users, answering every LLM call from
+a local mock server, and report throughput and latency percentiles.
+
+    python -m tests.load_test --users 50 --iterations 4 --latency 0.4 --prompt-tokens 900
+
+A turn is {"user": message, "intent": label the mock classifier returns,
+"extract": profile JSON the mock extractor returns, "expect_action": action}
+or {"form": profile}, which applies a profile form submission like app.py.
+When the scoring data files are missing, a synthetic recommendation index
+covering the scripted profiles is used.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from controller import chat_controller
+from core import gpt_handler, llm_dispatch, model_router, scoring
+from core.profile import Profile
+from tests.mock_llm import MockLLMServer
+
+CONVERSATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_conversations.json")
+STAGES = ["understand_ms", "dialogue_ms", "score_ms", "reply_ms", "total_ms"]
+PLANS = ["Super Star", "ReAssure 2.0", "Aspire - Gold+", "Aspire - Diamond+", "Aspire - Platinum+",
+         "Aspire - Titanium+", "Optima Secure", "Elevate", "Care"]
+EMPTY_PROFILE = {"gender": None, "location": None, "members": []}
+
+
+def load_conversations(path=None):
+    with open(path or CONVERSATIONS_PATH) as f:
+        return json.load(f)
+
+
+def make_llm(conversations, reply_words=120):
+    """Mock LLM reply function that answers from the conversation scripts."""
+    turns = {t["user"]: t for c in conversations for t in c["turns"] if "user" in t}
+    answer = " ".join(["Here is what you need to know about your cover."] * (reply_words // 10 or 1))
+
+    def reply(request):
+        system_prompt = request["messages"][0]["content"]
+        turn = turns.get(request["messages"][-1]["content"], {})
+        extract = turn.get("extract", EMPTY_PROFILE)
+        if "understanding engine" in system_prompt:
+            return json.dumps(dict(EMPTY_PROFILE, **extract, intent=turn.get("intent", "unknown")))
+        if "intent classifier" in system_prompt:
+            return turn.get("intent", "unknown")
+        if "profile extraction" in system_prompt:
+            return json.dumps(dict(EMPTY_PROFILE, **extract))
+        return answer
+
+    return reply
+
+
+def synthetic_index(conversations, seed=0):
+    """RecommendationIndex with a random ranking for every profile a script fills in."""
+    import pandas as pd
+
+    rng = random.Random(seed)
+    keys = {Profile.from_dict(t["form"]).key for c in conversations for t in c["turns"] if "form" in t}
+    keys |= {Profile.from_dict(t["extract"]).key for c in conversations for t in c["turns"] if "extract" in t}
+    bits = [[key >> b & 1 for b in range(len(scoring.PROFILE_FLAGS))] for key in sorted(keys)]
+    df_all = pd.DataFrame(bits, columns=scoring.PROFILE_FLAGS)
+    df_rec = pd.DataFrame([
+        {
+            "score_fit": {plan: round(rng.random(), 3) for plan in PLANS},
+            "needs": {plan: rng.sample(["restoration", "maternity", "opd", "no_room_rent_limit", "ncb_super",
+                                        "chronic_care", "ayush_cover", "annual_health_checkups"], 4) for plan in PLANS},
+        }
+        for _ in bits
+    ])
+    return scoring.RecommendationIndex.from_frames(df_all, df_rec)
+
+
+def run_conversation(conversation):
+    """Play one conversation; returns a list of per-turn records."""
+    profile, last_action, tokens, cost = {}, None, 0, 0.0
+    records = []
+    for turn in conversation["turns"]:
+        if "form" in turn:
+            profile = dict(profile, **turn["form"])
+            last_action = "static"
+            continue
+        start = time.perf_counter()
+        try:
+            response = chat_controller.run_chat_controller(turn["user"], profile, last_action, tokens, cost)
+        except Exception as e:
+            records.append({"action": "error", "error": repr(e), "latency_ms": (time.perf_counter() - start) * 1000})
+            break
+        latency_ms = (time.perf_counter() - start) * 1000
+        records.append({
+            "conversation": conversation["name"],
+            "action": response["action"],
+            "expected": turn.get("expect_action"),
+            "latency_ms": latency_ms,
+            "timings": response["timings"],
+            "tokens": response["total_tokens"] - tokens,
+        })
+        profile = response["updated_profile"]
+        last_action = response["updated_last_action"]
+        tokens, cost = response["total_tokens"], response["total_cost_inr"]
+    return records
+
+
+def _percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "n": int(values.size),
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+    }
+
+
+def summarize(records, seconds, conversations_run):
+    turns = [r for r in records if r["action"] != "error"]
+    by_action = {}
+    for r in turns:
+        by_action.setdefault(r["action"], []).append(r["latency_ms"])
+    by_stage = {}
+    for r in turns:
+        for stage in STAGES:
+            if stage in r["timings"]:
+                by_stage.setdefault(stage, []).append(r["timings"][stage])
+    return {
+        "conversations": conversations_run,
+        "turns": len(turns),
+        "errors": len(records) - len(turns),
+        "unexpected_actions": sum(1 for r in turns if r["expected"] and r["action"] != r["expected"]),
+        "seconds": round(seconds, 2),
+        "turns_per_s": round(len(turns) / seconds, 1) if seconds else 0.0,
+        "tokens": sum(r["tokens"] for r in turns),
+        "turn_ms": _percentiles([r["latency_ms"] for r in turns]) if turns else {},
+        "by_action_ms": {action: _percentiles(v) for action, v in sorted(by_action.items())},
+        "by_stage_ms": {stage: _percentiles(by_stage[stage]) for stage in STAGES if stage in by_stage},
+    }
+
+
+def run_load(conversations=None, users=10, iterations=1, latency=0.3, prompt_tokens=800, completion_tokens=150,
+             reply_words=120, quiet=True, rpm=0):
+    """
+    users threads each play every conversation `iterations` times against a
+    mock LLM with the given latency (s) and token counts. rpm caps LLM requests
+    per minute through the dispatcher (0 = unlimited). Returns summarize().
+    """
+    conversations = conversations or load_conversations()
+    previous_index = scoring._index
+    if not (os.path.exists(scoring.DATA_PATH_v) and os.path.exists(scoring.DATA_PATH_r)):
+        scoring._index = synthetic_index(conversations)
+    if chat_controller.ANSWER_CACHE is not None:
+        chat_controller.ANSWER_CACHE.clear()
+    dispatch_defaults = dict(llm_dispatch.DISPATCH_CONFIG)
+    llm_dispatch.configure_dispatcher(rpm=rpm, tpm=0)
+    model_router.reset_router_stats()
+    try:
+        report = _run(conversations, users, iterations, latency, prompt_tokens, completion_tokens, reply_words, quiet)
+        report["llm"] = llm_dispatch.dispatch_report()
+        report["routing"] = model_router.routing_report()
+        return report
+    finally:
+        scoring._index = previous_index
+        llm_dispatch.configure_dispatcher(**dispatch_defaults)
+
+
+def _run(conversations, users, iterations, latency, prompt_tokens, completion_tokens, reply_words, quiet):
+    schedule = [c for _ in range(iterations) for c in conversations]
+    with MockLLMServer(make_llm(conversations, reply_words), latency, prompt_tokens, completion_tokens) as server:
+        gpt_handler.configure_client(api_key="load-test", base_url=server.base_url, max_retries=0,
+                                     max_connections=max(users * 3, 50), max_keepalive_connections=max(users * 3, 20))
+        records = []
+        start = time.perf_counter()
+        # the prompt builder and KB loader print as they go; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            with ThreadPoolExecutor(users) as pool:
+                for user_records in pool.map(lambda i: [r for c in schedule for r in run_conversation(c)], range(users)):
+                    records.extend(user_records)
+        seconds = time.perf_counter() - start
+    gpt_handler.configure_client(api_key=None, base_url=None, max_retries=0, max_connections=50,
+                                 max_keepalive_connections=20)
+    return summarize(records, seconds, users * len(schedule))
+
+
+def print_report(report):
+    print(f"{report['conversations']} conversations, {report['turns']} turns in {report['seconds']} s "
+          f"→ {report['turns_per_s']} turns/s; {report['errors']} errors, "
+          f"{report['unexpected_actions']} unexpected actions, {report['tokens']} tokens")
+    print(f"{'':<20}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = [("turn", report["turn_ms"])] + list(report["by_action_ms"].items()) + list(report["by_stage_ms"].items())
+    for name, p in rows:
+        if p:
+            print(f"{name:<20}{p['n']:>7}{p['p50']:>10}{p['p95']:>10}{p['p99']:>10}")
+    llm = report["llm"]
+    print(f"LLM: {llm['api_calls']} API calls, {llm['coalesced']} coalesced, {llm['retries']} retries, "
+          f"avg queue wait {llm['avg_queue_wait_ms']} ms")
+    print(f"{'action / model':<32}{'calls':>7}{'cost ₹':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for action, models in report["routing"]["by_action"].items():
+        for model, r in models.items():
+            print(f"{action + ' / ' + model:<32}{r['calls']:>7}{r['cost_inr']:>10}{r['p50_ms']!s:>10}{r['p95_ms']!s:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", default=CONVERSATIONS_PATH)
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=1, help="times each user plays every conversation")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock LLM latency per call (s)")
+    parser.add_argument("--prompt-tokens", type=int, default=800)
+    parser.add_argument("--completion-tokens", type=int, default=150)
+    parser.add_argument("--reply-words", type=int, default=120)
+    parser.add_argument("--rpm", type=float, default=0, help="LLM requests per minute allowed (0 = unlimited)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the controller's own output")
+    args = parser.parse_args()
+
+    report = run_load(load_conversations(args.conversations), args.users, args.iterations, args.latency,
+                      args.prompt_tokens, args.completion_tokens, args.reply_words, quiet=not args.verbose,
+                      rpm=args.rpm)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Local OpenAI-compatible stand-in server for tests and load runs
+(chat completions, streamed or not, and embeddings).
+
+    with MockLLMServer(reply="hello") as server:
+        configure_client(api_key="test", base_url=server.base_url)
+"""
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is observable
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass  # the client gave up on the request (e.g. a losing hedge)
+
+    def do_POST(self):
+        server = self.server.owner
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request = json.loads(body or b"{}")
+        failure, latency = server._record(self.client_address, request)
+
+        if latency:
+            time.sleep(latency)
+        if failure is not None:
+            status, retry_after = failure
+            headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+            self._send_json(status, {"error": {"message": "mock failure", "type": "rate_limit_error",
+                                               "code": status}}, headers)
+            return
+
+        if self.path.endswith("/embeddings"):
+            self._send_embeddings(server, request)
+            return
+        reply = server.reply(request) if callable(server.reply) else server.reply
+        if request.get("stream"):
+            self._send_stream(server, request, reply)
+            return
+        payload = {
+            "id": f"chatcmpl-mock-{server.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": server.prompt_tokens,
+                "completion_tokens": server.completion_tokens,
+                "total_tokens": server.prompt_tokens + server.completion_tokens,
+            },
+        }
+        self._send_json(200, payload)
+
+    def _send_embeddings(self, server, request):
+        texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+        data = []
+        for i, text in enumerate(texts):
+            # deterministic per text, so repeated queries embed identically
+            rng = np.random.default_rng(zlib.crc32(str(text).encode()))
+            vector = rng.standard_normal(server.embedding_dim)
+            data.append({"object": "embedding", "index": i, "embedding": (vector / np.linalg.norm(vector)).tolist()})
+        tokens = sum(len(str(t).split()) for t in texts)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _send_stream(self, server, request, reply):
+        # SSE over chunked encoding: one chunk per word, then the usage chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {
+            "id": f"chatcmpl-mock-{server.request_count}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o-mini"),
+        }
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            if i and server.token_latency:
+                time.sleep(server.token_latency)
+            text = word if i == len(words) - 1 else word + " "
+            delta = {"role": "assistant", "content": text} if i == 0 else {"content": text}
+            self._send_event(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        self._send_event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage = {
+                "prompt_tokens": server.prompt_tokens,
+                "completion_tokens": server.completion_tokens,
+                "total_tokens": server.prompt_tokens + server.completion_tokens,
+            }
+            self._send_event(dict(base, choices=[], usage=usage))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _send_event(self, payload):
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+PROFILE = {"gender": "male", "location": None, "members": [{"relation": "self", "age": 30}]}
+
+
+def fake_llm(request):
+    """Reply to the chatbot's prompts: understanding, intent, profile extraction, else "Sure!"."""
+    system_prompt = request["messages"][0]["content"]
+    if "understanding engine" in system_prompt:
+        if "garbled" in request["messages"][1]["content"]:
+            return "greeting, probably"
+        return json.dumps(dict(PROFILE, intent="profile_info"))
+    if "intent classifier" in system_prompt:
+        return "concept_query" if "pay" in request["messages"][1]["content"] else "greeting"
+    if "profile extraction" in system_prompt:
+        return json.dumps(PROFILE)
+    return "Sure!"
+
+
+class MockLLMServer:
+    """
+    Serves /v1/chat/completions on 127.0.0.1 from a background thread.
+
+    reply may be a string or a callable taking the request JSON. latency (s)
+    and token counts are injected into every response. Streamed requests get
+    one SSE chunk per word, token_latency (s) apart. /v1/embeddings returns
+    deterministic random unit vectors of embedding_dim. fail_next() and
+    slow_next() script errors (e.g. 429s) and slow answers for the next requests.
+    """
+
+    def __init__(self, reply="ok", latency=0.0, prompt_tokens=10, completion_tokens=5, token_latency=0.0,
+                 embedding_dim=1536):
+        self.reply = reply
+        self.latency = latency
+        self.token_latency = token_latency
+        self.embedding_dim = embedding_dim
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.requests = []
+        self.client_ports = set()
+        self._failures = []  # (status, retry_after) for the next requests
+        self._delays = []  # latency (s) for the next requests
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def request_count(self):
+        return len(self.requests)
+
+    def _record(self, client_address, request):
+        with self._lock:
+            self.requests.append(request)
+            self.client_ports.add(client_address[1])
+            failure = self._failures.pop(0) if self._failures else None
+            latency = self._delays.pop(0) if self._delays else self.latency
+        return failure, latency
+
+    def fail_next(self, count=1, status=429, retry_after=None):
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def slow_next(self, count=1, seconds=1.0):
+        with self._lock:
+            self._delays.extend([seconds] * count)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
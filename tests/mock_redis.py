@@ -0,0 +1,187 @@
+"""
+Local stand-in for Redis: a threaded TCP server speaking RESP2 with the few
+commands the session store uses (PING, SELECT, HSET, HGET, HGETALL, RPUSH,
+LRANGE, LTRIM, EXPIRE, TTL, DEL, MULTI/EXEC, WATCH/UNWATCH). Set drop_next_exec to run the next
+transaction but close the connection instead of replying.
+
+    with MockRedisServer() as server:
+        store = RedisSessionStore(port=server.port)
+"""
+import socket
+import socketserver
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.server.connections.add(self.request)
+
+    def finish(self):
+        self.server.connections.discard(self.request)
+        super().finish()
+
+    def handle(self):
+        queued = None  # commands since MULTI, discarded if the client goes away before EXEC
+        watched = {}  # key → its write count at WATCH
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            name = command[0].upper()
+            if name in ("WATCH", "UNWATCH"):
+                watched = {key: self.server.writes.get(key, 0) for key in command[1:]}
+                self.server.commands.append(name)
+                self.wfile.write(b"+OK\r\n")
+            elif name == "MULTI":
+                queued = []
+                self.wfile.write(b"+OK\r\n")
+            elif name == "EXEC":
+                if any(self.server.writes.get(key, 0) != count for key, count in watched.items()):
+                    queued = None
+                watched = {}
+                if queued is None:
+                    self.wfile.write(b"*-1\r\n")
+                    continue
+                replies = [self.server.execute(c) for c in queued]
+                queued = None
+                if self.server.drop_next_exec:
+                    self.server.drop_next_exec = False
+                    return
+                self.wfile.write(b"*%d\r\n" % len(replies) + b"".join(replies))
+            elif queued is not None:
+                queued.append(command)
+                self.wfile.write(b"+QUEUED\r\n")
+            else:
+                self.wfile.write(self.server.execute(command))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            raise ValueError("inline commands are not supported")
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+
+def _bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    data = value.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _array(values):
+    return b"*%d\r\n" % len(values) + b"".join(_bulk(v) for v in values)
+
+
+class MockRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.data = {}  # key → dict (hash) or list
+        self.expires = {}  # key → monotonic deadline
+        self.commands = []
+        self.drop_next_exec = False
+        self.connections = set()
+        self.writes = {}  # key → number of commands that wrote it, for WATCH
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def close_connections(self):
+        """Hang up on every client, like a server-side idle timeout."""
+        for sock in list(self.connections):
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def _get(self, key, kind):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline < time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise TypeError
+        return value
+
+    def execute(self, args):
+        name, args = args[0].upper(), args[1:]
+        with self._lock:
+            self.commands.append(name)
+            if name in ("HSET", "RPUSH", "LTRIM", "EXPIRE", "DEL"):
+                for key in args[:1] if name != "DEL" else args:
+                    self.writes[key] = self.writes.get(key, 0) + 1
+            try:
+                return self._execute(name, args)
+            except TypeError:
+                return b"-WRONGTYPE Operation against a key holding the wrong kind of value\r\n"
+
+    def _execute(self, name, args):
+        if name in ("PING", "SELECT"):
+            return b"+OK\r\n" if name == "SELECT" else b"+PONG\r\n"
+        if name == "HSET":
+            h = self._get(args[0], dict)
+            if h is None:
+                h = self.data[args[0]] = {}
+            added = sum(1 for field in args[1::2] if field not in h)
+            h.update(zip(args[1::2], args[2::2]))
+            return b":%d\r\n" % added
+        if name == "HGET":
+            return _bulk((self._get(args[0], dict) or {}).get(args[1]))
+        if name == "HGETALL":
+            h = self._get(args[0], dict) or {}
+            return _array([part for item in h.items() for part in item])
+        if name == "RPUSH":
+            items = self._get(args[0], list)
+            if items is None:
+                items = self.data[args[0]] = []
+            items.extend(args[1:])
+            return b":%d\r\n" % len(items)
+        if name in ("LRANGE", "LTRIM"):
+            items = self._get(args[0], list) or []
+            start, stop = int(args[1]), int(args[2])
+            n = len(items)
+            start = max(start + n if start < 0 else start, 0)
+            stop = stop + n if stop < 0 else min(stop, n - 1)
+            selected = items[start:stop + 1]
+            if name == "LRANGE":
+                return _array(selected)
+            if args[0] in self.data:
+                self.data[args[0]] = selected
+            return b"+OK\r\n"
+        if name == "EXPIRE":
+            if self._get(args[0], object) is None:
+                return b":0\r\n"
+            self.expires[args[0]] = time.monotonic() + int(args[1])
+            return b":1\r\n"
+        if name == "TTL":
+            if self._get(args[0], object) is None:
+                return b":-2\r\n"
+            deadline = self.expires.get(args[0])
+            return b":%d\r\n" % (round(deadline - time.monotonic()) if deadline else -1)
+        if name == "DEL":
+            removed = sum(1 for key in args if self.data.pop(key, None) is not None)
+            for key in args:
+                self.expires.pop(key, None)
+            return b":%d\r\n" % removed
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
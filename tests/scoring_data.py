@@ -0,0 +1,25 @@
+"""Small scoring sources shared by the scoring and lead scoring tests."""
+import json
+
+import pandas as pd
+
+from core import scoring
+
+
+SELF_MALE_30 = {"gender": "male", "location": "Tier 1", "members": [{"relation": "self", "age": 30}]}
+SELF_FEMALE_50 = {"gender": "female", "location": "Tier 2", "members": [{"relation": "self", "age": 50}]}
+PLANS = {"Aspire - Gold+": "Aspire", "Aspire - Diamond+": "Aspire"}
+
+
+def make_frames():
+    flags = scoring.profile_flags(SELF_MALE_30)
+    df_all = pd.DataFrame([dict.fromkeys(scoring.PROFILE_FLAGS, 0), flags, flags])
+    df_rec = pd.DataFrame([
+        {"score_fit": json.dumps({"Care": 0.1}), "needs": {}},
+        {
+            "score_fit": [("Aspire - Gold+", 0.9), ("Aspire - Diamond+", 0.95), ("Care", 0.5), ("Elevate", 0.7)],
+            "needs": {"Care": ["frequent_opd"], "Elevate": ["restoration"]},
+        },
+        {"score_fit": {"Super Star": 1.0}, "needs": {}},
+    ])
+    return df_all, df_rec
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+
+from core import gpt_handler, llm_dispatch
+
+
+@pytest.fixture
+def llm_server_options():
+    return {"reply": " hello ", "prompt_tokens": 1000, "completion_tokens": 500}
+
+
+def test_call_gpt_reports_tokens_and_cost(llm_server):
+    result = gpt_handler.call_gpt([{"role": "user", "content": "hi"}])
+    assert result["output"] == "hello"
+    assert result["tokens_used"] == 1500
+    # 1k input + 0.5k output tokens of gpt-4o-mini
+    assert result["cost_usd"] == round(0.00015 + 0.5 * 0.00060, 4)
+    assert result["cost_inr"] == round((0.00015 + 0.5 * 0.00060) * 83, 4)
+
+
+def test_call_gpt_reuses_one_connection(llm_server):
+    for _ in range(5):
+        gpt_handler.call_gpt([{"role": "user", "content": "hi"}])
+    assert llm_server.request_count == 5
+    assert len(llm_server.client_ports) == 1
+
+
+def test_acall_gpt_matches_call_gpt(llm_server):
+    async def run():
+        return await asyncio.gather(*[
+            gpt_handler.acall_gpt([{"role": "user", "content": f"hi {i}"}]) for i in range(4)
+        ])
+
+    results = asyncio.run(run())
+    assert results[0] == gpt_handler.call_gpt([{"role": "user", "content": "hi"}])
+    assert llm_server.request_count == 5
+
+
+def test_stream_gpt_yields_deltas_then_usage(llm_server):
+    llm_server.reply = "co-pay is your share of the bill"
+    done = []
+    stream = gpt_handler.stream_gpt([{"role": "user", "content": "hi"}], on_complete=done.append)
+    assert llm_server.request_count == 0  # nothing is sent until iteration starts
+
+    deltas = list(stream)
+    assert len(deltas) == 7
+    assert "".join(deltas) == "co-pay is your share of the bill"
+    result = stream.result
+    assert done == [result]
+    assert result["output"] == "co-pay is your share of the bill"
+    assert result["tokens_used"] == 1500
+    assert result["cost_inr"] == gpt_handler.call_gpt([{"role": "user", "content": "hi"}])["cost_inr"]
+    assert 0 <= result["ttft_ms"] <= result["stream_ms"]
+    assert llm_server.requests[0]["stream"] is True
+
+
+def test_stream_gpt_first_token_before_full_reply(llm_server):
+    llm_server.reply = "one two three four"
+    llm_server.token_latency = 0.05
+    stream = gpt_handler.stream_gpt([{"role": "user", "content": "hi"}])
+    list(stream)
+    # three 50 ms gaps come after the first token
+    assert stream.result["stream_ms"] - stream.result["ttft_ms"] >= 140
+
+
+def test_unsupported_model():
+    with pytest.raises(ValueError):
+        gpt_handler.call_gpt([], model="gpt-3")
+
+
+def test_configure_client_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        gpt_handler.configure_client(api_keys="typo")
+
+
+def test_response_cache_serves_repeats_for_free(llm_server, tmp_path):
+    gpt_handler.enable_response_cache(str(tmp_path / "llm.sqlite"))
+    try:
+        messages = [{"role": "user", "content": "what is co-pay?"}]
+        first = gpt_handler.call_gpt(messages)
+        second = gpt_handler.call_gpt(messages)
+        assert first["cache_hit"] is False and second["cache_hit"] is True
+        assert second["output"] == first["output"]
+        assert second["tokens_used"] == 0 and second["cost_inr"] == 0.0
+        assert llm_server.request_count == 1
+
+        # a different temperature is a different request
+        gpt_handler.call_gpt(messages, temperature=0.5)
+        assert llm_server.request_count == 2
+
+        # the disk tier survives a fresh process-level cache
+        gpt_handler.enable_response_cache(str(tmp_path / "llm.sqlite"))
+        assert gpt_handler.call_gpt(messages)["cache_hit"] is True
+        stats = gpt_handler.response_cache_stats()
+        assert stats["disk_hits"] == 1 and stats["misses"] == 0
+    finally:
+        gpt_handler.disable_response_cache()
+
+
+def test_sqlite_cache_ttl_and_size_eviction(tmp_path, monkeypatch):
+    from core import llm_cache
+
+    disk = llm_cache.SQLiteCache(str(tmp_path / "c.sqlite"), ttl_seconds=60, max_bytes=10)
+    disk.put("a", "12345")
+    disk.put("b", "12345")
+    assert disk.get("a") == "12345"
+    # over budget: the least recently used row ("b") goes
+    assert disk.put("c", "12345") == 1
+    assert disk.get("b") is None and disk.get("a") == "12345"
+
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 120)
+    assert disk.get("a") is None
+
+
+def test_rate_limited_calls_are_retried(llm_server):
+    llm_server.fail_next(2, status=429)
+    assert gpt_handler.call_gpt([{"role": "user", "content": "hi"}])["output"] == "hello"
+    assert llm_server.request_count == 3
+    report = llm_dispatch.dispatch_report()
+    assert (report["retries"], report["rate_limited"], report["failures"]) == (2, 2, 0)
+
+    llm_server.fail_next(4, status=429, retry_after=0)  # one per attempt
+    with pytest.raises(openai.RateLimitError):
+        gpt_handler.call_gpt([{"role": "user", "content": "hello?"}])
+    assert llm_dispatch.dispatch_report()["failures"] == 1
+
+    llm_server.fail_next(1, status=400)
+    with pytest.raises(openai.BadRequestError):
+        gpt_handler.call_gpt([{"role": "user", "content": "bad"}])
+    assert llm_dispatch.dispatch_report()["retries"] == 5  # 2 + 3, none for the 400
+
+
+def test_embeddings_go_through_the_dispatcher(llm_server):
+    llm_server.fail_next(1, status=429)
+    result = gpt_handler.embed_texts(["what is a co-pay", "room rent"])
+    assert len(result["embeddings"]) == 2 and result["tokens_used"] == 6
+    assert llm_server.request_count == 2
+    assert llm_dispatch.dispatch_report()["retries"] == 1
+
+
+def test_identical_inflight_calls_are_coalesced(llm_server):
+    llm_server.latency = 0.2
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(gpt_handler.call_gpt([{"role": "user", "content": "hi"}])))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert llm_server.request_count == 1
+    assert {r["output"] for r in results} == {"hello"}
+    # only the call that went out is billed
+    assert sorted(r["tokens_used"] for r in results) == [0] * 7 + [1500]
+    assert llm_dispatch.dispatch_report()["coalesced"] == 7
+
+
+def test_requests_per_minute_are_limited(llm_server):
+    llm_dispatch.configure_dispatcher(rpm=600, burst_seconds=0.1)  # 10/s, one banked
+    start = time.perf_counter()
+    for i in range(4):
+        gpt_handler.call_gpt([{"role": "user", "content": f"hi {i}"}])
+    assert time.perf_counter() - start >= 0.25
+    assert llm_dispatch.dispatch_report()["max_queue_wait_ms"] > 50
+
+
+def test_slow_call_is_hedged(llm_server):
+    llm_dispatch.configure_dispatcher(hedge_after_ms=100)
+    llm_server.slow_next(1, seconds=1.0)
+    start = time.perf_counter()
+    result = gpt_handler.call_gpt([{"role": "user", "content": "hi"}])
+    assert result["output"] == "hello"
+    assert time.perf_counter() - start < 0.8
+    report = llm_dispatch.dispatch_report()
+    assert (report["hedges"], report["hedge_wins"]) == (1, 1)
+    # both requests are billed: the slow one is still running, so it is charged like the winner
+    assert llm_server.request_count == 2
+    assert result["tokens_used"] == 3000
+    assert result["cost_inr"] == pytest.approx(2 * round((0.00015 + 0.5 * 0.00060) * 83, 4))
+    assert result["hedged"] and result["hedge_estimated"]
+
+    llm_server.slow_next(1, seconds=1.0)
+    result = asyncio.run(gpt_handler.acall_gpt([{"role": "user", "content": "hello"}]))
+    assert result["tokens_used"] == 3000 and result["hedged"]
+    assert llm_dispatch.dispatch_report()["hedges"] == 2
+
+
+def test_hedge_is_skipped_when_the_limiter_is_busy(llm_server):
+    llm_dispatch.configure_dispatcher(hedge_after_ms=100, rpm=60, burst_seconds=1.0)  # one request banked
+    llm_server.slow_next(1, seconds=0.3)
+    result = gpt_handler.call_gpt([{"role": "user", "content": "hi"}])
+    assert llm_server.request_count == 1 and "hedged" not in result
+    assert llm_dispatch.dispatch_report()["hedges_skipped"] == 1
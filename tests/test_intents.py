@@ -0,0 +1,164 @@
+import json
+
+import pytest
+
+from controller import chat_controller
+from core.intent_handler import parse_understanding
+from core.rule_parser import fast_path_report, parse_message
+from tests.mock_llm import PROFILE
+
+
+def test_understand_runs_llm_calls_concurrently(llm_server):
+    intent, new_info, usage, timings = chat_controller.understand("hi, I'm a 30 year old guy looking for cover", mode="parallel")
+    assert intent == "greeting"
+    assert new_info == PROFILE
+    assert usage["tokens_used"] == 220
+    assert timings["intent_ms"] >= 200 and timings["profile_ms"] >= 200
+    assert timings["understand_ms"] < timings["intent_ms"] + timings["profile_ms"]
+    assert timings["saved_ms"] > 0
+
+
+def test_combined_understanding_makes_one_call(llm_server):
+    intent, new_info, usage, timings = chat_controller.understand("I'm a 30 year old guy looking for cover", mode="combined")
+    assert intent == "profile_info"
+    assert new_info == PROFILE
+    assert usage["tokens_used"] == 110
+    assert llm_server.request_count == 1
+    assert llm_server.requests[0]["response_format"]["type"] == "json_schema"
+
+
+def test_combined_understanding_falls_back_to_two_calls(llm_server):
+    intent, new_info, usage, timings = chat_controller.understand("garbled, age 30", mode="combined")
+    assert intent == "greeting"
+    assert new_info == PROFILE
+    # the failed combined call is still billed
+    assert usage["tokens_used"] == 330
+    assert llm_server.request_count == 3
+
+
+def test_profile_extraction_runs_only_on_signal(llm_server):
+    complete = {"gender": "male", "location": "Tier 1", "members": [{"relation": "self", "age": 30}]}
+    intent, new_info, usage, timings = chat_controller.understand("Explain co-pay", profile=complete)
+    assert (new_info, llm_server.request_count) == ({}, 1)
+    assert timings["extraction_skipped"]
+
+    # only the field the message hints at is asked for, and repeats are served from the cache
+    intent, new_info, usage, timings = chat_controller.understand("Actually I'm 45 now", profile=complete)
+    assert new_info == {"members": PROFILE["members"]}
+    # classification and extraction run concurrently, so either may have arrived last
+    assert any("Only extract these fields: members." in r["messages"][0]["content"] for r in llm_server.requests[-2:])
+    calls = llm_server.request_count
+    chat_controller.understand("actually, I'm 45 now!", profile=complete)
+    assert llm_server.request_count == calls + 1  # classification only
+
+    # no cue, but the classifier says profile_info: extract what is still missing
+    llm_server.reply = lambda request: "profile_info" if "intent classifier" in request["messages"][0]["content"] \
+        else json.dumps(PROFILE)
+    calls = llm_server.request_count
+    intent, new_info, usage, timings = chat_controller.understand("Lucknow", profile={"gender": "male"})
+    assert intent == "profile_info" and set(new_info) == {"location", "members"}
+    # the extraction was only sent once the classifier had answered
+    classify, extract = [r["messages"][0]["content"] for r in llm_server.requests[calls:]]
+    assert "intent classifier" in classify
+    assert "Only extract these fields: location, members." in extract
+    assert "extraction_skipped" not in timings
+
+
+@pytest.mark.parametrize("raw", [
+    "not json",
+    json.dumps(dict(PROFILE, intent="chit_chat")),
+    json.dumps(dict(PROFILE, intent="greeting", location="Mumbai")),
+    json.dumps(dict(PROFILE, intent="greeting", members=[{"relation": "self", "age": "30"}])),
+])
+def test_parse_understanding_rejects_invalid_replies(raw):
+    with pytest.raises(ValueError):
+        parse_understanding(raw)
+
+
+def test_greeting_turn_counts_all_tokens(llm_server):
+    response = chat_controller.run_chat_controller(
+        user_input="hi, I'm a 30 year old guy looking for cover",
+        user_profile={},
+        last_bot_action=None,
+        total_tokens=0,
+        total_cost_inr=0.0,
+    )
+    assert response["action"] == "static"
+    assert response["updated_profile"]["gender"] == "male"
+    assert response["total_tokens"] == 220
+    assert "total_ms" in response["timings"]
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("hi", "greeting"),
+    ("Good morning!", "greeting"),
+    ("ok sure", "affirmation"),
+    ("yes please", "affirmation"),
+    ("Fine.", "affirmation"),
+    ("30", "profile_info"),
+    ("female", "profile_info"),
+    ("Tier 2", "profile_info"),
+])
+def test_rule_parser_handles_trivial_turns(message, intent):
+    parsed = parse_message(message)
+    assert parsed["intent"] == intent
+    assert parsed["confidence"] == 1.0
+
+
+def test_rule_parser_extracts_profile_fields():
+    parsed = parse_message("I am a 30 year old male from a tier-2 city, wife 28 and son 3")
+    assert parsed["gender"] == "male"
+    assert parsed["location"] == "Tier 2"
+    assert parsed["members"] == [
+        {"relation": "self", "age": 30},
+        {"relation": "wife", "age": 28},
+        {"relation": "son", "age": 3},
+    ]
+    assert parse_message("son 5 and son 3")["members"] == [{"relation": "son", "age": 5}, {"relation": "son", "age": 3}]
+
+
+def test_rule_parser_defers_to_llm():
+    assert parse_message("what is co-pay?") is None
+    assert parse_message("hi, what does co-pay mean?") is None
+    assert parse_message("hi, tell me about co-pay")["confidence"] < 1.0
+
+
+@pytest.mark.parametrize("message", [
+    "is it?",  # a question, not a yes
+    "do it",
+    "sounds great",
+    "i am fine",  # an answer to "how are you"
+    "we are 2",  # a head count
+    "3 years",  # a policy term
+    "5 lakh",  # a sum insured
+    "30 and 28",  # two ages, nobody named
+    "wife and i are 30",  # whose age?
+])
+def test_rule_parser_does_not_fast_path_ambiguous_turns(message):
+    parsed = parse_message(message)
+    assert parsed is None or parsed["confidence"] < chat_controller.FAST_PATH_THRESHOLD
+
+
+def test_fast_path_skips_llm(llm_server):
+    before = fast_path_report()["hits"]
+    intent, new_info, usage, timings = chat_controller.understand("Tier 2")
+    assert intent == "profile_info"
+    assert new_info["location"] == "Tier 2"
+    assert usage == {"tokens_used": 0, "cost_inr": 0.0}
+    assert llm_server.request_count == 0
+    assert fast_path_report()["hits"] == before + 1
+
+
+def test_streamed_reply_matches_blocking_reply(llm_server, answer_cache):
+    turn = dict(user_profile={}, last_bot_action=None, total_tokens=0, total_cost_inr=0.0)
+    response = chat_controller.run_chat_controller(user_input="Explain co-pay", stream=True, **turn)
+    assert response["reply"] is None
+    assert response["total_tokens"] == 110  # classification only, the reply isn't sent yet
+
+    assert "".join(response["reply_stream"]) == "Sure!"
+    response = chat_controller.finish_streamed_reply(response)
+    assert response["reply"] == "Sure!"
+    assert response["total_tokens"] == 220
+    assert response["timings"]["ttft_ms"] >= 200  # mock latency comes before the first token
+    # the finished stream fed the answer cache
+    assert answer_cache.lookup("concept_query", "what does copay mean?")[0] == "Sure!"
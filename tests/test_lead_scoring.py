@@ -0,0 +1,86 @@
+import pandas as pd
+
+from core import lead_scoring, scoring
+from tests.scoring_data import SELF_MALE_30
+
+
+LEADS = pd.DataFrame({
+    "lead_id": ["L1", "L2", "L3", "L4"],
+    "gender": ["male", "Female", None, "male"],
+    "age": [30, 50, 40, None],
+    "location": ["Tier 1", "tier 2 city", "", None],
+    "members": ["self", "self;wife;son", "self, mother", None],
+    "ped_conditions": ["", "diabetes", None, "none"],
+})
+
+
+def test_profile_flag_matrix_matches_profile_flags():
+    profiles = [
+        SELF_MALE_30,
+        {
+            "gender": "female",
+            "location": "tier 2 city",
+            "members": [{"relation": "self", "age": 50}, {"relation": "wife", "age": 45}, {"relation": "son", "age": 9}],
+            "ped_conditions": ["diabetes"],
+        },
+        {"gender": None, "location": "", "members": [{"relation": "self", "age": 40}, {"relation": "mother", "age": 70}]},
+    ]
+    matrix = scoring.profile_flag_matrix(LEADS)
+    for row, profile in zip(matrix, profiles):
+        flags = scoring.profile_flags(profile)
+        assert row.tolist() == [flags[name] for name in scoring.PROFILE_FLAGS]
+    # no age: only the family flag is known
+    assert matrix[3].tolist() == [int(name == "family_self") for name in scoring.PROFILE_FLAGS]
+
+
+def test_member_without_relation_is_self_for_profiles_and_leads():
+    leads = pd.DataFrame({"gender": ["male", "male"], "age": [30, 30], "members": ["", " Self ;"]})
+    profiles = [
+        {"gender": "male", "members": [{"age": 30}]},
+        {"gender": "male", "members": [{"relation": "Self", "age": 30}]},
+    ]
+    matrix = scoring.profile_flag_matrix(leads)
+    for row, profile in zip(matrix, profiles):
+        flags = scoring.profile_flags(profile)
+        assert flags["family_self"] == flags["male_below_35"] == 1
+        assert row.tolist() == [flags[name] for name in scoring.PROFILE_FLAGS]
+    assert scoring.family_flag([]) is None
+
+
+def test_score_file_streams_chunks(tmp_path, scoring_index):
+    _, features, _ = lead_scoring.load_attribute_weights()
+    plans = pd.DataFrame(
+        [[1.0 if f in ("maternity_fertility", "family_floater") else 0.0 for f in features],
+         [1.0 if f in ("chronic_care", "critical_illness") else 0.0 for f in features],
+         [0.5 if f == "chronic_care" else 0.0 for f in features],
+         [1.0 if f == "preventive_care" else 0.0 for f in features]],
+        index=pd.Index(["Aspire - Gold+", "Care", "Aspire - Diamond+", "Elevate"], name="variant"),
+        columns=features,
+    )
+    plans.insert(0, "plan", ["Aspire", "Care", "Aspire", "Elevate"])
+    plans.to_csv(tmp_path / "plans.csv")
+    LEADS.to_csv(tmp_path / "leads.csv", index=False)
+
+    stats = lead_scoring.score_file(str(tmp_path / "leads.csv"), str(tmp_path / "out.csv"),
+                                    str(tmp_path / "plans.csv"), chunk_size=3, id_column="lead_id")
+    assert stats["leads"] == 4 and stats["chunks"] == 2
+    out = pd.read_csv(tmp_path / "out.csv")
+    assert out.columns.tolist() == lead_scoring.OUTPUT_COLUMNS
+    assert out["lead_id"].tolist() == ["L1", "L2", "L3", "L4"]
+    # one Aspire variant per lead, and the diabetic lead ranks Care first
+    assert out.loc[1, "plan_1"] == "Care"
+    for _, row in out.iterrows():
+        ranked = [row["plan_1"], row["plan_2"], row["plan_3"]]
+        assert sum(p.startswith("Aspire") for p in ranked) == 1
+        assert row["score_1"] >= row["score_2"] >= row["score_3"]
+
+    # the process pool writes the same rows, in order
+    lead_scoring.score_file(str(tmp_path / "leads.csv"), str(tmp_path / "pool.parquet"),
+                            str(tmp_path / "plans.csv"), chunk_size=1, workers=2, id_column="lead_id")
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / "pool.parquet"), out, check_dtype=False)
+
+    # without plan features, profiles go through the recommendation index
+    lead_scoring.score_file(str(tmp_path / "leads.csv"), str(tmp_path / "index.csv"), chunk_size=2)
+    by_index = pd.read_csv(tmp_path / "index.csv")
+    assert by_index.loc[0, "plan_1"] == "Aspire - Diamond+"
+    assert by_index["plan_1"].isna().tolist() == [False, True, True, True]
@@ -0,0 +1,9 @@
+from tests.load_test import run_load
+
+
+def test_golden_conversations_under_load():
+    report = run_load(users=4, latency=0.01, prompt_tokens=100, completion_tokens=10)
+    assert report["errors"] == 0 and report["unexpected_actions"] == 0
+    assert report["conversations"] == 16 and report["turns"] == 4 * 16
+    assert {"recommend", "compare", "ask_info", "call_gpt"} <= set(report["by_action_ms"])
+    assert report["by_stage_ms"]["total_ms"]["p99"] >= report["by_stage_ms"]["total_ms"]["p50"]
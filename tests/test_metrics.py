@@ -0,0 +1,44 @@
+import json
+
+from controller import chat_controller
+from core import metrics
+
+
+def test_turn_stages_are_recorded(llm_server, tmp_path):
+    path = tmp_path / "spans.jsonl"
+    metrics.configure_metrics(enabled=True, jsonl_path=str(path))
+    metrics.reset_metrics()
+    try:
+        chat_controller.run_chat_controller("Explain co-pay", {}, None, 0, 0.0)
+    finally:
+        metrics.configure_metrics(enabled=True, jsonl_path=None)
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    stages = [s["stage"] for s in spans]
+    assert {"llm", "understand", "dialogue", "reply", "turn"} <= set(stages)
+    assert stages[-1] == "turn" and len({s["turn_id"] for s in spans}) == 1
+    turn = spans[-1]
+    assert (turn["action"], turn["tokens"]) == ("call_gpt", 220)
+    assert sum(s["tokens"] for s in spans if s["stage"] == "llm") == 220
+
+    text = metrics.prometheus_text()
+    assert 'chat_stage_duration_ms_count{stage="turn"} 1' in text
+    assert 'chat_stage_tokens_total{stage="llm"} 220' in text
+    assert 'chat_llm_calls_total{model="gpt-4o-mini",cache_hit="false"} 2' in text
+
+    metrics.configure_metrics(enabled=False)
+    try:
+        chat_controller.run_chat_controller("hi", {}, None, 0, 0.0)
+    finally:
+        metrics.configure_metrics(enabled=True)
+    assert metrics.stage_summary()["turn"]["count"] == 1
+
+
+def test_retrieval_failure_is_recorded_on_its_span(monkeypatch):
+    def broken_engine():
+        raise RuntimeError("index missing")
+
+    monkeypatch.setattr(chat_controller, "get_engine", broken_engine)
+    metrics.reset_metrics()
+    assert chat_controller.retrieve_facts("does care cover maternity?", "plan_query") == []
+    assert 'chat_stage_errors_total{stage="retrieve",error="RuntimeError"} 1' in metrics.prometheus_text()
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from controller import chat_controller
+from core import model_router
+
+
+def test_model_router_downgrades_on_budget_and_latency(llm_server, tmp_path, monkeypatch):
+    saved = dict(model_router.ROUTER_CONFIG)
+    saved_policy = {action: dict(entry) for action, entry in model_router.ROUTING_POLICY.items()}
+    assert {entry["model"] for entry in saved_policy.values()} == {"gpt-4o-mini"}
+    # the bigger model is opt-in
+    policy = {action: {"model": "gpt-4o", "fallback": "gpt-4o-mini"} for action in ("recommend", "compare")}
+    (tmp_path / "policy.json").write_text(json.dumps(policy))
+    monkeypatch.setenv("ROUTING_POLICY_PATH", str(tmp_path / "policy.json"))
+    model_router._load_policy_overrides()
+    model_router.reset_router_stats()
+    model_router.configure_router(session_budget_inr=1.0)
+    try:
+        model_router.begin_turn(0.0)
+        assert model_router.choose_model("recommend") == ("gpt-4o", None)
+        assert model_router.choose_model("classify") == ("gpt-4o-mini", None)
+        result = model_router.routed_call("recommend", [{"role": "user", "content": "best plan?"}])
+        assert result["model"] == llm_server.requests[-1]["model"] == "gpt-4o"
+
+        model_router.begin_turn(0.85)  # 85% of the session budget spent
+        assert model_router.choose_model("recommend") == ("gpt-4o-mini", "session_budget")
+
+        model_router.begin_turn(0.0)
+        model_router.record_usage("compare", "gpt-4o", {"tokens_used": 10, "cost_inr": 0.01}, 30000)
+        assert model_router.choose_model("compare") == ("gpt-4o-mini", "latency")
+
+        report = model_router.routing_report()
+        assert report["by_action"]["recommend"]["gpt-4o"]["calls"] == 1
+        assert report["daily_spend_inr"] == round(result["cost_inr"] + 0.01, 4)
+        assert report["downgrades"] == {"compare:latency": 1, "recommend:session_budget": 1}
+    finally:
+        model_router.ROUTING_POLICY.clear()
+        model_router.ROUTING_POLICY.update(saved_policy)
+        model_router.configure_router(**saved)
+        model_router.reset_router_stats()
+
+
+def test_spent_session_budget_refuses_calls_under_default_policy(llm_server):
+    saved = dict(model_router.ROUTER_CONFIG)
+    model_router.reset_router_stats()
+    model_router.configure_router(session_budget_inr=1.0)
+    try:
+        # no action has a fallback by default, so a spent budget means no LLM call at all
+        model_router.begin_turn(1.0)
+        with pytest.raises(model_router.BudgetExceeded):
+            model_router.choose_model("answer")
+        response = chat_controller.run_chat_controller("Explain co-pay", {"gender": "male"}, "ask_info", 500, 1.0)
+        assert response["reply"] == chat_controller.BUDGET_REPLY and response["action"] == "static"
+        assert (response["total_tokens"], response["total_cost_inr"]) == (500, 1.0)
+        assert response["updated_profile"] == {"gender": "male"} and response["updated_last_action"] == "ask_info"
+        assert llm_server.request_count == 0
+        assert model_router.routing_report()["refusals"] == {"answer:session_budget": 1, "classify:session_budget": 1}
+
+        # below the budget the same turn goes through
+        response = chat_controller.run_chat_controller("Explain co-pay", {}, None, 0, 0.5)
+        assert response["reply"] == "Sure!" and llm_server.request_count > 0
+    finally:
+        model_router.configure_router(**saved)
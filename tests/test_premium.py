@@ -0,0 +1,37 @@
+from core.premium import FLOATER_LOADING, PremiumTable, get_table, premium_facts, suggest_cover
+
+
+def test_premium_batch_matches_per_profile_quotes():
+    table = PremiumTable.load()
+    assert table.sums_insured == [10, 20, 30, 50, 75, 100]
+    family = [35, 32, 3]
+    individual, floater = table.quote_batch([[35, 32, 3], [35, -1, -1], [120, -1, -1]])
+    rows = table.premiums[[35, 32, 3]]
+    assert individual[0].tolist() == rows.sum(axis=0).tolist()
+    assert floater[0].tolist() == (rows.max(axis=0) * FLOATER_LOADING[3]).tolist()
+    assert floater[1].tolist() == individual[1].tolist() == table.premiums[35].tolist()
+    # ages past the table are priced at its last row
+    assert individual[2].tolist() == table.premiums[-1].tolist()
+
+    quote = table.quote(family)
+    assert [q["sum_insured"] for q in quote] == ["10L", "20L", "30L", "50L", "75L", "1Cr"]
+    assert quote[0]["floater"] == round(floater[0, 0])
+
+
+def test_premium_facts_suggest_cover():
+    table = get_table()
+    young_family = {"location": "Tier 1", "members": [{"relation": "self", "age": 30}, {"relation": "wife", "age": 28}]}
+    assert suggest_cover(young_family, table) == (20, 3)
+    senior = {"location": "Tier 2", "members": [{"relation": "self", "age": 65}], "ped_conditions": ["diabetes"]}
+    assert suggest_cover(senior, table) == (30, 1)
+
+    facts = premium_facts(young_family)
+    assert facts[0] == "Suggested Sum Insured: 20L for 2 member(s)"
+    individual = sum(table.premiums[[30, 28], table.sums_insured.index(20)])
+    assert f"₹{round(individual):,} as individual policies" in facts[1]
+    assert "estimate" in facts[2] and "3 years" in facts[3]
+    assert not any("discount" in fact and "₹" in fact for fact in facts)
+    assert premium_facts({"members": [{"relation": "self", "age": 30}]})[1] == (
+        f"Annual premium at 10L from the premium table: ₹{round(table.premiums[30, 0]):,}"
+    )
+    assert premium_facts({"members": []}) == []
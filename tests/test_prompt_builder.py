@@ -0,0 +1,23 @@
+from core import scoring
+from core.prompt_builder import build_plan_prompt, estimate_tokens
+
+
+def test_plan_prompt_stays_within_budget_as_catalog_grows():
+    def recom(n_plans):
+        score_fit = {f"Plan {i}": 1 - i / n_plans for i in range(n_plans)}
+        return {
+            "score_fit": score_fit,
+            "top_plans": scoring.top_plans(score_fit, scoring.TOP_K),
+            "needs": {plan: [f"need_{j}_of_{plan}" for j in range(20)] for plan in score_fit},
+            "user_attributes": ["self_age_18_35", "city_tier_1"],
+        }
+
+    small, small_info = build_plan_prompt("recommend", recom(5), "which plan?")
+    large, large_info = build_plan_prompt("recommend", recom(500), "which plan?")
+    assert large_info["prompt_tokens_est"] == small_info["prompt_tokens_est"] <= small_info["budget"]
+    assert "Plan 0|1.00|" in large[0]["content"] and "Plan 3|" not in large[0]["content"]
+
+    # a tight budget trims needs before it drops plans
+    tight, info = build_plan_prompt("compare", recom(500), "compare them", budget=220)
+    assert info["plans"] == 3 and info["needs"] < 18
+    assert estimate_tokens(tight[0]["content"] + tight[1]["content"]) <= 220
@@ -0,0 +1,206 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from core import retrieval
+
+CHUNKS = [
+    {"id": "a", "policy": "Care", "insurer": "Care Health Insurance", "variant": "Care", "section": "coverage", "content": "Room rent: single private room"},
+    {"id": "b", "policy": "Care", "insurer": "Care Health Insurance", "variant": "Care", "section": "exclusions", "content": "Cosmetic surgery"},
+    {"id": "c", "policy": "Aspire", "insurer": "Niva Bupa", "variant": "Gold+", "section": "waiting_periods", "content": "Maternity: 9 months"},
+    {"id": "d", "policy": "Aspire", "insurer": "Niva Bupa", "variant": "Gold+", "section": "coverage", "content": "Restoration: unlimited"},
+]
+
+
+def write_flat_index(path, vectors, fourcc=b"IxF2"):
+    n, d = vectors.shape
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4siqqq?i", fourcc, d, n, 1 << 20, 1 << 20, True, 1 if fourcc == b"IxF2" else 0))
+        f.write(struct.pack("<Q", n * d))
+        f.write(vectors.astype(np.float32).tobytes())
+
+
+def make_engine(metric=retrieval.METRIC_INNER_PRODUCT, embedder=None):
+    return retrieval.RetrievalEngine(np.eye(4, dtype=np.float32), CHUNKS, metric=metric, embedder=embedder)
+
+
+def test_reads_bundled_kb_index():
+    path = os.path.join(os.path.dirname(retrieval.INDEX_PATH), "kb.index")
+    vectors, metric = retrieval.read_flat_index(path)
+    assert vectors.shape == (370, 1536)
+    assert metric == retrieval.METRIC_L2
+    assert isinstance(vectors, np.memmap)
+    assert np.allclose(np.linalg.norm(vectors[:10], axis=1), 1.0, atol=1e-4)
+
+
+def test_flat_index_round_trip(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(5, 8)).astype(np.float32)
+    write_flat_index(tmp_path / "x.index", vectors)
+    loaded, metric = retrieval.read_flat_index(str(tmp_path / "x.index"))
+    assert np.array_equal(loaded, vectors)
+
+
+def test_rejects_non_flat_index(tmp_path):
+    write_flat_index(tmp_path / "x.index", np.eye(2), fourcc=b"IHNf")
+    with pytest.raises(ValueError):
+        retrieval.read_flat_index(str(tmp_path / "x.index"))
+
+
+@pytest.mark.parametrize("metric", [retrieval.METRIC_INNER_PRODUCT, retrieval.METRIC_L2])
+def test_batched_top_k(metric):
+    engine = make_engine(metric)
+    queries = np.array([[0.1, 0.9, 0.0, 0.2], [0.0, 0.0, 1.0, 0.5]], dtype=np.float32)
+    results = engine.search(queries, k=2)
+    assert [[h["chunk"]["id"] for h in hits] for hits in results] == [["b", "d"], ["c", "d"]]
+
+
+def test_filters_use_masks():
+    engine = make_engine()
+    query = np.array([0.0, 0.0, 1.0, 0.5], dtype=np.float32)
+    hits = engine.search(query, k=3, policy="Care")[0]
+    assert [h["chunk"]["id"] for h in hits] == ["a", "b"]
+    hits = engine.search(query, k=3, policy=["Care", "Aspire"], section="coverage")[0]
+    assert [h["chunk"]["id"] for h in hits] == ["d", "a"]
+    assert engine.search(query, k=3, insurer="Star Health")[0] == []
+    with pytest.raises(ValueError):
+        engine.search(query, k=3, zone="A")
+
+
+def test_mentioned_policies():
+    engine = make_engine()
+    assert engine.mentioned("policy", "Does aspire cover maternity?") == ["Aspire"]
+    assert engine.mentioned("policy", "Compare healthcare plans with aspiration in mind") == []
+    assert engine.mentioned("policy", "Is Care, or Aspire, better?") == ["Aspire", "Care"]
+    assert engine.mentioned("variant", "what does gold+ add?") == ["Gold+"]
+
+
+def test_query_embeddings_are_cached():
+    calls = []
+
+    def embedder(texts):
+        calls.append(list(texts))
+        return np.tile(np.eye(4, dtype=np.float32)[3], (len(texts), 1))
+
+    engine = make_engine(embedder=embedder)
+    assert engine.search_text("restoration?", k=1)[0]["chunk"]["id"] == "d"
+    assert engine.search_text(["restoration?", "room rent?"], k=1)[1][0]["chunk"]["id"] == "d"
+    assert calls == [["restoration?"], ["room rent?"]]
+    assert engine.stats["embed_cache_hits"] == 1
+
+
+def test_bm25_matches_exact_terms():
+    from core.keyword_index import BM25Index
+
+    index = BM25Index.build(CHUNKS)
+    scores = index.scores("What is the room rent limit?")
+    assert CHUNKS[int(np.argmax(scores))]["id"] == "a"
+    # stemming lines up restoration/restore and hyphenless spellings
+    assert CHUNKS[int(np.argmax(index.scores("restore benefit")))]["id"] == "d"
+    assert not index.scores("zzz").any()
+
+
+def test_bm25_index_is_persisted(tmp_path):
+    import json
+    from core import keyword_index
+
+    kb_path = tmp_path / "kb.json"
+    kb_path.write_text(json.dumps(CHUNKS))
+    built = keyword_index.load_or_build(str(kb_path), str(tmp_path))
+    assert len(list(tmp_path.glob("kb_bm25.*.npz"))) == 1
+    loaded = keyword_index.load_or_build(str(kb_path), str(tmp_path))
+    assert np.array_equal(loaded.scores("maternity"), built.scores("maternity"))
+
+
+def test_hybrid_search_fuses_rankings():
+    from core.keyword_index import BM25Index
+
+    # the vector side prefers "b", the keyword side prefers "c"
+    engine = retrieval.RetrievalEngine(
+        np.eye(4, dtype=np.float32), CHUNKS,
+        embedder=lambda texts: np.tile([0.0, 1.0, 0.9, 0.0], (len(texts), 1)),
+        keyword_index=BM25Index.build(CHUNKS),
+    )
+    hits = engine.hybrid_search("maternity", k=2)
+    assert [h["chunk"]["id"] for h in hits] == ["c", "b"]
+    assert (hits[0]["vector_rank"], hits[0]["bm25_rank"]) == (2, 1)
+    assert hits[1]["bm25_rank"] is None
+
+    assert [h["chunk"]["id"] for h in engine.hybrid_search("maternity", k=2, policy="Care")] == ["b", "a"]
+
+
+def test_kb_build_matches_bundled_chunks():
+    import json
+    from core import kb_build
+
+    with open(kb_build.SOURCE_PATH) as f:
+        chunks = kb_build.chunk_knowledge_base(json.load(f))
+    with open(kb_build.KB_PATH) as f:
+        bundled = json.load(f)
+    assert chunks == bundled
+
+
+def test_kb_build_reembeds_only_changed_chunks(tmp_path):
+    import json
+    from core import kb_build
+    from core.semantic_cache import HashingEmbedder
+
+    with open(kb_build.SOURCE_PATH) as f:
+        kb = json.load(f)
+    kb["policies"] = kb["policies"][:2]
+    source = tmp_path / "source.json"
+    source.write_text(json.dumps(kb))
+    calls = []
+
+    def embedder(texts):
+        calls.append(len(texts))
+        return HashingEmbedder(64)(texts)
+
+    embedder.name = "hashing-64"
+    first = kb_build.build_kb(str(source), str(tmp_path), embedder, batch_size=16, workers=4)
+    assert first["reused"] == 0 and first["embedded"] == first["chunks"]
+    assert sum(calls) == first["embedded_texts"] and max(calls) <= 16
+
+    calls.clear()
+    again = kb_build.build_kb(str(source), str(tmp_path), embedder)
+    assert again["reused"] == again["chunks"] and calls == []
+
+    kb["policies"][0]["variants"][0]["coverage"][0] = "Room rent: single private room"
+    source.write_text(json.dumps(kb))
+    changed = kb_build.build_kb(str(source), str(tmp_path), embedder)
+    # the item, its section SUMMARY and the VARIANT_SUMMARY
+    assert changed["embedded"] == 3 and changed["reused"] == changed["chunks"] - 3
+
+    engine = retrieval.RetrievalEngine.from_files(str(tmp_path / "kb_chunks.cols"), embedder=HashingEmbedder(64))
+    assert engine.search_text("single private room", k=1)[0]["chunk"]["content"] == "Room rent: single private room"
+    assert kb_build.build_kb(str(source), str(tmp_path), embedder, full=True)["reused"] == 0
+
+
+def test_chunk_store_round_trip_and_filters(tmp_path):
+    from core.chunk_store import open_chunk_store, write_chunk_store
+
+    chunks = [dict(c, feature_tags=["maternity", "ped"] if c["id"] == "c" else []) for c in CHUNKS]
+    write_chunk_store(str(tmp_path / "x.cols"), chunks, np.eye(4), retrieval.METRIC_INNER_PRODUCT)
+    store = open_chunk_store(str(tmp_path / "x.cols"))
+    assert list(store) == chunks and store[-1] == chunks[-1]
+    assert isinstance(store.vectors, np.memmap) and np.array_equal(store.vectors, np.eye(4))
+
+    engine = retrieval.RetrievalEngine.from_files(str(tmp_path / "x.cols"))
+    assert engine.values("policy") == ["Aspire", "Care"]
+    assert engine.filter_mask(policy=["Care"], section=["coverage", "exclusions"]).tolist() == [True, True, False, False]
+    assert engine.filter_mask(policy="Unknown").tolist() == [False] * 4
+    hits = engine.search(np.array([0.0, 0.0, 1.0, 0.0]), k=1, policy="Aspire")[0]
+    assert hits[0]["chunk"] == chunks[2]
+
+
+def test_bundled_chunk_store_matches_kb_json():
+    import json
+    from core import keyword_index
+    from core.chunk_store import open_chunk_store
+
+    store = open_chunk_store(retrieval.STORE_PATH)
+    with open(keyword_index.KB_PATH) as f:
+        assert list(store) == json.load(f)
+    vectors, _ = retrieval.read_flat_index(retrieval.INDEX_PATH)
+    assert np.array_equal(store.vectors, vectors)
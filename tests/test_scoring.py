@@ -0,0 +1,143 @@
+import json
+import os
+
+import pytest
+
+from core import scoring
+from tests.scoring_data import PLANS, SELF_FEMALE_50, SELF_MALE_30, make_frames
+
+
+def test_pack_flags_sets_one_bit_per_flag():
+    flags = scoring.profile_flags(SELF_MALE_30)
+    key = scoring.pack_flags(flags)
+    assert bin(key).count("1") == sum(flags.values()) == 3
+    assert key & (1 << scoring.PROFILE_FLAGS.index("city_tier_1"))
+
+
+def test_top_plans_dedupes_variants():
+    score_fit = {"Aspire - Gold+": 0.9, "Aspire - Diamond+": 0.95, "Care": 0.5, "Elevate": 0.7}
+    assert scoring.top_plans(score_fit, plans=PLANS) == [("Aspire - Diamond+", 0.95), ("Elevate", 0.7), ("Care", 0.5)]
+    assert scoring.top_plans(score_fit, k=1, plans=PLANS) == [("Aspire - Diamond+", 0.95)]
+    # only the plan column groups variants, not the look of the key
+    assert scoring.top_plans(score_fit, k=2) == [("Aspire - Diamond+", 0.95), ("Aspire - Gold+", 0.9)]
+    assert scoring.read_plans()["Aspire - Gold+"] == "Aspire"
+
+
+def test_recommend_uses_first_matching_row(scoring_index):
+    result = scoring.score_plans_and_recommend(SELF_MALE_30)
+    assert result["matched"] is True
+    assert result["top_plans"][0] == ("Aspire - Diamond+", 0.95)
+    assert result["needs"]["Care"] == ["frequent_opd"]
+    assert "male_below_35" in result["user_attributes"]
+
+
+def test_recommend_without_match(scoring_index):
+    result = scoring.score_plans_and_recommend(SELF_FEMALE_50)
+    assert result["matched"] is False
+    assert result["top_plans"] == []
+    assert "female_46_60" in result["user_attributes"]
+
+
+def test_index_round_trips_through_npz(tmp_path, scoring_index):
+    path = tmp_path / "index.npz"
+    scoring_index.save(str(path))
+    loaded = scoring.RecommendationIndex.load(str(path))
+    key = scoring.pack_flags(scoring.profile_flags(SELF_MALE_30))
+    assert len(loaded) == len(scoring_index) == 2
+    assert loaded.lookup(key) == scoring_index.lookup(key)
+
+
+@pytest.fixture
+def index_sources(tmp_path, monkeypatch):
+    """The scoring sources written to tmp_path; returns (df_all, csv path)."""
+    df_all, df_rec = make_frames()
+    df_rec["score_fit"] = df_rec["score_fit"].map(lambda v: v if isinstance(v, str) else json.dumps(dict(v)))
+    df_rec["needs"] = df_rec["needs"].map(json.dumps)
+    csv_path, parquet_path = tmp_path / "df_variations.csv", tmp_path / "dfv_variations.parquet"
+    df_all.to_csv(csv_path, index=False)
+    df_rec.to_parquet(parquet_path)
+    monkeypatch.setattr(scoring, "DATA_PATH_v", str(csv_path))
+    monkeypatch.setattr(scoring, "DATA_PATH_r", str(parquet_path))
+    return df_all, csv_path
+
+
+def test_load_index_rebuilds_when_sources_change(index_sources, tmp_path, monkeypatch):
+    df_all, csv_path = index_sources
+    monkeypatch.setattr(scoring, "CACHE_DIR", str(tmp_path / ".cache"))
+
+    scoring.load_index()
+    assert "build" in scoring.LOAD_TIMINGS
+    scoring.load_index()
+    assert "cache_load" in scoring.LOAD_TIMINGS
+
+    df_all.iloc[1:].to_csv(csv_path, index=False)
+    scoring.load_index()
+    assert "build" in scoring.LOAD_TIMINGS
+    assert len(os.listdir(tmp_path / ".cache")) == 1
+
+
+def test_load_index_works_without_a_writable_cache(index_sources, monkeypatch, caplog):
+    _, csv_path = index_sources
+    monkeypatch.setattr(scoring, "CACHE_DIR", str(csv_path / ".cache"))  # under a file, so it can't be created
+
+    index = scoring.load_index()
+    assert len(index) and "build" in scoring.LOAD_TIMINGS
+    assert "Could not cache the scoring index" in caplog.text
+
+
+def test_profile_merge_diff_and_key(scoring_index):
+    from core.profile import Profile
+
+    profile = Profile.from_dict({"gender": "male", "members": [{"relation": "self", "age": None}]})
+    assert profile.missing_fields() == ["age", "location"] and not profile.is_complete()
+    with pytest.raises(AttributeError):
+        profile.gender = "female"
+
+    merged = profile.merge({"location": "Tier 1", "members": [{"relation": "self", "age": 30}]})
+    assert merged.diff(profile) == {"location", "members"}
+    assert merged.is_complete() and merged.missing_fields() == []
+    # a member without an age keeps the one we have; no-op merges return the same object
+    assert merged.merge({"members": [{"relation": "self", "age": None}]}) is merged
+
+    assert merged == Profile.from_dict(merged.to_dict())
+    assert len({merged, Profile.from_dict(SELF_MALE_30)}) == 1
+    assert merged.key == scoring.pack_flags(scoring.profile_flags(SELF_MALE_30))
+    assert scoring.score_plans_and_recommend(merged) == scoring.score_plans_and_recommend(SELF_MALE_30)
+
+
+def test_profile_keeps_every_child():
+    from core.profile import Profile
+
+    family = {
+        "gender": "female",
+        "location": "Tier 1",
+        "members": [
+            {"relation": "self", "age": 38},
+            {"relation": "son", "age": 9},
+            {"relation": "son", "age": 6},
+        ],
+        "ped_conditions": [],
+    }
+    profile = Profile.from_dict(family)
+    assert profile.ages_of("son") == (9, 6) and profile.age_of("self") == 38
+    assert profile.to_dict() == family
+    assert Profile.from_dict(profile.to_dict()) == profile
+
+    # a son given without an age keeps the first one's; a new list of sons replaces the old
+    assert profile.merge({"members": [{"relation": "son", "age": None}]}) is profile
+    grown = profile.merge({"members": [{"relation": "son", "age": None}, {"relation": "son", "age": 7}]})
+    assert grown.ages_of("son") == (9, 7)
+    assert profile.merge({"members": [{"relation": "daughter", "age": 2}]}).ages_of("son") == (9, 6)
+
+
+def test_profile_merge_adds_another_child():
+    from core.profile import Profile
+
+    profile = Profile.from_dict({"members": [{"relation": "self", "age": 38},
+                                             {"relation": "son", "age": 9}, {"relation": "son", "age": 6}]})
+    # "another son aged 2": the extractor only returns the new son
+    assert profile.merge({"members": [{"relation": "son", "age": 2}]}).ages_of("son") == (9, 6, 2)
+    # a son we already have is not added twice
+    assert profile.merge({"members": [{"relation": "son", "age": 6}]}) is profile
+    # a single-member relation is still replaced
+    assert profile.merge({"members": [{"relation": "self", "age": 39}]}).age_of("self") == 39
@@ -0,0 +1,67 @@
+import pytest
+
+from controller import chat_controller
+from core.semantic_cache import HashingEmbedder, OpenAIEmbedder, SemanticCache
+
+
+def test_similar_concept_questions_share_an_answer(llm_server, answer_cache):
+    turn = dict(user_profile={}, last_bot_action=None, total_tokens=0, total_cost_inr=0.0)
+    first = chat_controller.run_chat_controller(user_input="Explain co-pay", **turn)
+    calls = llm_server.request_count
+    second = chat_controller.run_chat_controller(user_input="what does copay mean?", **turn)
+    assert second["reply"] == first["reply"] == "Sure!"
+    # only intent classification (no profile cue, no extraction), no answer generation
+    assert llm_server.request_count == calls + 1
+    assert second["total_tokens"] == 110
+
+
+def test_answer_cache_embeds_each_question_once_and_bills_it(llm_server, monkeypatch):
+    turn = dict(user_profile={}, last_bot_action=None, total_tokens=0, total_cost_inr=0.0)
+    monkeypatch.setattr(chat_controller, "ANSWER_CACHE", None)
+    uncached = chat_controller.run_chat_controller(user_input="Explain co-pay", **turn)
+
+    monkeypatch.setattr(chat_controller, "ANSWER_CACHE", SemanticCache(OpenAIEmbedder()))
+    first = chat_controller.run_chat_controller(user_input="Explain co-pay", **turn)
+    embeds = [r for r in llm_server.requests if "input" in r]
+    assert len(embeds) == 1  # looked up and stored with the same vector
+    # classification and answer plus the 2-token embedding
+    assert first["total_tokens"] == uncached["total_tokens"] + 2 == 222
+    assert first["total_cost_inr"] == pytest.approx(uncached["total_cost_inr"] + round(2 / 1000 * 0.00002 * 83, 6))
+
+    second = chat_controller.run_chat_controller(user_input="Explain co-pay", **turn)
+    assert second["reply"] == "Sure!" and second["total_tokens"] == 112
+
+
+def test_a_failing_answer_cache_falls_through_to_the_llm(llm_server, answer_cache, monkeypatch):
+    def broken_lookup(*args, **kwargs):
+        raise RuntimeError("cache down")
+
+    monkeypatch.setattr(answer_cache, "lookup", broken_lookup)
+    response = chat_controller.run_chat_controller("Explain co-pay", {}, None, 0, 0.0)
+    assert response["reply"] == "Sure!" and response["total_tokens"] == 220
+
+
+def test_semantic_cache_threshold_and_eviction():
+    cache = SemanticCache(HashingEmbedder(), threshold=0.85, capacity_per_intent=2)
+    cache.store("concept_query", "what is co-pay?", "copay answer")
+    cache.store("concept_query", "what is a deductible?", "deductible answer")
+    assert cache.lookup("concept_query", "explain copay")[0] == "copay answer"
+    assert cache.lookup("general_info", "explain copay") is None
+    assert cache.lookup("concept_query", "what is a waiting period?") is None
+
+    # deductible is now least recently used and makes room
+    cache.store("concept_query", "what is a waiting period?", "waiting answer")
+    assert cache.lookup("concept_query", "what is a deductible?") is None
+    assert cache.report()["evictions"] == 1
+
+
+def test_semantic_cache_keeps_negated_questions_apart():
+    cache = SemanticCache(HashingEmbedder())
+    cache.store("concept_query", "what is covered in health insurance", "covered answer")
+    cache.store("concept_query", "why should I buy health insurance", "buy answer")
+    # both pairs embed above the threshold, but one side has a negation
+    assert cache.lookup("concept_query", "what is not covered in health insurance") is None
+    assert cache.lookup("concept_query", "why should I not buy health insurance") is None
+    cache.store("concept_query", "what is not covered in health insurance", "exclusions answer")
+    assert cache.lookup("concept_query", "what isn't covered in health insurance")[0] == "exclusions answer"
+    assert cache.lookup("concept_query", "what is covered in health insurance")[0] == "covered answer"
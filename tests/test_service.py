@@ -0,0 +1,259 @@
+import asyncio
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+from controller import chat_service
+from core.session_store import SessionConflict, SessionState, open_session_store
+from tests.mock_redis import MockRedisServer
+
+
+def start_service(llm_server, **settings):
+    config = chat_service.load_config(
+        environ={},
+        port=0,
+        openai_api_key="test-key",
+        openai_base_url=llm_server.base_url,
+        **settings,
+    )
+    service = chat_service.ChatService(config)
+    thread = threading.Thread(target=asyncio.run, args=(service.serve(install_signal_handlers=False),), daemon=True)
+    thread.start()
+    assert service.started.wait(5)
+    return service, thread
+
+
+def request(service, method, path, payload=None):
+    conn = http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+    body = json.dumps(payload) if payload is not None else None
+    conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    data = json.loads(response.read())
+    conn.close()
+    return response.status, data
+
+
+def test_load_config_layers_file_env_and_overrides(tmp_path):
+    path = tmp_path / "service.json"
+    path.write_text(json.dumps({"port": 9000, "max_concurrency": 4}))
+    config = chat_service.load_config(str(path), environ={"CHAT_SERVICE_MAX_CONCURRENCY": "8"}, host="0.0.0.0")
+    assert (config["port"], config["max_concurrency"], config["host"]) == (9000, 8, "0.0.0.0")
+
+    path.write_text(json.dumps({"prot": 9000}))
+    with pytest.raises(ValueError):
+        chat_service.load_config(str(path), environ={})
+
+
+def test_chat_keeps_session_state(llm_server):
+    service, thread = start_service(llm_server)
+    try:
+        status, first = request(service, "POST", "/v1/chat", {"message": "hi"})
+        assert status == 200 and first["action"] == "static" and first["reply"]
+        status, second = request(service, "POST", "/v1/chat",
+                                 {"message": "I am 30, male, looking for cover", "session_id": first["session_id"]})
+        assert status == 200
+        assert second["session_id"] == first["session_id"]
+        assert second["profile"]["gender"] == "male"
+        assert second["total_tokens"] > first["total_tokens"]
+
+        assert request(service, "POST", "/v1/chat", {"text": "hi"})[0] == 400
+        assert request(service, "GET", "/v1/chat")[0] == 405
+        assert request(service, "GET", "/healthz")[1]["status"] == "ok"
+
+        conn = http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+        conn.request("GET", "/metrics")
+        response = conn.getresponse()
+        assert response.getheader("Content-Type").startswith("text/plain")
+        assert 'chat_stage_duration_ms_bucket{stage="turn"' in response.read().decode()
+        conn.close()
+    finally:
+        service.shutdown()
+        thread.join(5)
+
+
+def test_overload_is_rejected_and_shutdown_drains(llm_server):
+    service, thread = start_service(llm_server, max_concurrency=1, max_pending=1)
+    results = []
+    messages = ["Explain co-pay please", "Explain deductible please", "Explain room rent please"]
+    workers = [
+        threading.Thread(target=lambda m=m: results.append(request(service, "POST", "/v1/chat", {"message": m})))
+        for m in messages
+    ]
+    for w in workers:
+        w.start()
+        time.sleep(0.05)
+    # one turn running, one waiting, the third gets a 503 straight away
+    service.shutdown()
+    for w in workers:
+        w.join(10)
+    thread.join(10)
+    statuses = sorted(status for status, _ in results)
+    assert statuses == [200, 200, 503]
+    assert service.stats["rejected"] == 1 and service.stats["in_flight"] == 0
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def session_store(request, tmp_path):
+    if request.param == "redis":
+        with MockRedisServer() as server:
+            store = open_session_store(f"redis://127.0.0.1:{server.port}/0")
+            store.server = server
+            yield store
+            store.close()
+        return
+    url = "memory" if request.param == "memory" else f"sqlite:///{tmp_path / 'sessions.sqlite'}"
+    store = open_session_store(url)
+    yield store
+    store.close()
+
+
+def test_session_store_saves_only_changes(session_store):
+    assert session_store.load("s1") is None
+    session = SessionState("s1", {"user_profile": {"gender": "male"}, "total_tokens": 10})
+    session.history.append(["user", "hi"])
+    session_store.save(session)
+    assert session.changes() == ({}, [])
+
+    session.update(total_tokens=25, user_profile={"gender": "male"})
+    session.history.append(["assistant", "hello"])
+    assert session.changes() == ({"total_tokens": "25"}, ['["assistant","hello"]'])
+    session_store.save(session)
+
+    loaded = session_store.load("s1")
+    assert loaded.fields == {"user_profile": {"gender": "male"}, "total_tokens": 25}
+    assert loaded.history == [["user", "hi"], ["assistant", "hello"]]
+    assert loaded.changes() == ({}, [])
+    if hasattr(session_store, "server"):
+        assert session_store.server.commands.count("HSET") == 2
+
+    session_store.delete("s1")
+    assert session_store.load("s1") is None
+
+
+def test_a_stale_session_is_not_saved_over_a_newer_one(session_store):
+    session_store.save(SessionState("s1", {"total_tokens": 1}))
+    first, second = session_store.load("s1"), session_store.load("s1")
+    first.update(total_tokens=2)
+    first.history.append(["user", "hi"])
+    session_store.save(first)
+
+    second.update(total_tokens=3)
+    second.history.append(["user", "hello"])
+    with pytest.raises(SessionConflict):
+        session_store.save(second)
+    # nor a new session created over an existing one
+    with pytest.raises(SessionConflict):
+        session_store.save(SessionState("s1", {"total_tokens": 4}))
+
+    loaded = session_store.load("s1")
+    assert loaded.fields == {"total_tokens": 2} and loaded.history == [["user", "hi"]]
+    assert loaded.version == 2
+
+
+def test_redis_save_is_sent_once():
+    with MockRedisServer() as server:
+        store = open_session_store(f"redis://127.0.0.1:{server.port}/0")
+        session = SessionState("s1", {"total_tokens": 1})
+        session.history.append(["user", "hi"])
+        store.save(session)
+
+        # an idle connection the server hung up on is replaced before writing
+        server.close_connections()
+        time.sleep(0.05)
+        session.history.append(["assistant", "hello"])
+        store.save(session)
+
+        # the transaction ran but its reply was lost: raise rather than run it twice
+        server.drop_next_exec = True
+        session.history.append(["user", "thanks"])
+        with pytest.raises(ConnectionError):
+            store.save(session)
+        assert store.load("s1").history == [["user", "hi"], ["assistant", "hello"], ["user", "thanks"]]
+        assert server.commands.count("RPUSH") == 3
+        store.close()
+
+
+def test_sessions_survive_a_service_restart(llm_server, tmp_path):
+    store_url = f"sqlite:///{tmp_path / 'sessions.sqlite'}"
+    service, thread = start_service(llm_server, session_store=store_url)
+    try:
+        _, first = request(service, "POST", "/v1/chat", {"message": "I am 30, male, looking for cover"})
+    finally:
+        service.shutdown()
+        thread.join(5)
+
+    service, thread = start_service(llm_server, session_store=store_url)
+    try:
+        _, second = request(service, "POST", "/v1/chat", {"message": "Explain co-pay please", "session_id": first["session_id"]})
+        assert second["profile"]["gender"] == "male"
+        assert second["total_tokens"] > first["total_tokens"]
+        assert len(service.store.load(first["session_id"]).history) == 4
+    finally:
+        service.shutdown()
+        thread.join(5)
+
+
+def test_overlapping_turns_in_two_workers_conflict(llm_server, tmp_path):
+    store_url = f"sqlite:///{tmp_path / 'sessions.sqlite'}"
+    (first, first_thread), (second, second_thread) = (start_service(llm_server, session_store=store_url)
+                                                      for _ in range(2))
+    try:
+        _, turn = request(first, "POST", "/v1/chat", {"message": "I am 30, male, looking for cover"})
+        session_id = turn["session_id"]
+        results = []
+        seen = llm_server.request_count
+        llm_server.slow_next(seconds=1.0)
+        slow = threading.Thread(target=lambda: results.append(
+            request(first, "POST", "/v1/chat", {"message": "Explain co-pay please", "session_id": session_id})))
+        slow.start()
+        while llm_server.request_count == seen:
+            time.sleep(0.01)
+        # the same session on the other worker saves while the first turn is still running
+        assert request(second, "POST", "/v1/chat", {"message": "Explain sub-limits please",
+                                                    "session_id": session_id})[0] == 200
+        slow.join(10)
+        assert results[0][0] == 409 and first.stats["conflicts"] == 1
+        assert len(first.store.load(session_id).history) == 4
+    finally:
+        for service, thread in ((first, first_thread), (second, second_thread)):
+            service.shutdown()
+            thread.join(5)
+
+
+def test_timed_out_turn_keeps_the_session_until_it_has_saved(llm_server):
+    service, thread = start_service(llm_server, request_timeout=0.05)
+    try:
+        status, _ = request(service, "POST", "/v1/chat", {"message": "Explain waiting periods please", "session_id": "s1"})
+        assert status == 504
+        # the turn is still running on its thread and still owns the session
+        assert service.stats["in_flight"] == 1 and "s1" in service._session_locks
+
+        service.config["request_timeout"] = 10
+        status, second = request(service, "POST", "/v1/chat", {"message": "Explain sub-limits please", "session_id": "s1"})
+        assert status == 200
+        # the late turn saved before this one started, so both are in the history
+        assert len(service.store.load("s1").history) == 4
+        assert service.stats["in_flight"] == 0 and not service._session_locks
+    finally:
+        service.shutdown()
+        thread.join(5)
+
+
+def test_malformed_content_length_is_a_bad_request(llm_server):
+    service, thread = start_service(llm_server)
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", service.port, timeout=10)
+        conn.putrequest("POST", "/v1/chat")
+        conn.putheader("Content-Length", "ten")
+        conn.endheaders()
+        response = conn.getresponse()
+        assert response.status == 400
+        assert json.loads(response.read()) == {"error": "malformed Content-Length"}
+        conn.close()
+        assert request(service, "GET", "/healthz")[0] == 200
+    finally:
+        service.shutdown()
+        thread.join(5)
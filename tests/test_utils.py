@@ -0,0 +1,43 @@
+import json
+
+from controller import chat_controller
+from core import utils
+
+
+def test_turns_are_logged_without_blocking(llm_server, tmp_path):
+    path = tmp_path / "conversations.log"
+    utils.configure_conversation_log(str(path))
+    chat_controller.run_chat_controller("Explain co-pay", {"gender": "male"}, None, 0, 0.0)
+    response = chat_controller.run_chat_controller("Explain co-pay", {}, None, 0, 0.0, stream=True)
+    "".join(response["reply_stream"])
+    chat_controller.finish_streamed_reply(response)
+    utils.get_conversation_logger().flush()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["tokens"] for r in records] == [220, 220]
+    assert records[0]["profile_hash"] == utils.profile_hash({"gender": "male", "location": None, "members": [],
+                                                            "ped_conditions": []})
+    assert records[1]["profile_hash"] != records[0]["profile_hash"]
+    assert records[1]["streamed"] and "co-pay" not in path.read_text()
+
+    # a full queue drops instead of waiting; a small max_bytes rotates the file
+    logger = utils.ConversationLogger(str(path), max_queue=3, max_bytes=200, flush_interval=0.05)
+    logger._start = lambda: None
+    for i in range(5):
+        logger.log({"turn_id": i, "padding": "x" * 80})
+    assert logger.stats["dropped"] == 2
+    utils.ConversationLogger._start(logger)
+    logger.flush()
+    logger.log({"turn_id": 5, "padding": "x" * 80})
+    logger.close()
+    assert logger.stats["written"] == 4 and logger.stats["rotations"] >= 1
+    assert (tmp_path / "conversations.log.1").exists()
+
+
+def test_log_write_failures_are_counted_and_logged(tmp_path, caplog):
+    logger = utils.ConversationLogger(str(tmp_path), flush_interval=0.01)  # a directory can't be appended to
+    logger.log({"turn_id": 1})
+    logger.flush()
+    logger.close()
+    assert logger.stats["errors"] == 1
+    assert "conversation-log write failed" in caplog.text